@@ -0,0 +1,310 @@
+"""
+Pipeline Benchmark Suite
+Runs the month-end pipeline (generation, PD/LGD, staging, ECL, aggregation)
+at several portfolio sizes and product mixes, plus the notebook summaries and
+the CSV/Parquet write and read paths, and records throughput and peak memory
+per stage with profiler. Each size/mix runs in a fresh process. Runs are
+appended to a JSON history and compared with a baseline run; the CLI exits
+non-zero when throughput or peak memory regresses past the tolerance.
+Everything runs locally on generated data.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+SIZES = [10_000, 1_000_000, 10_000_000]
+
+# Product weights in portfolio_schema.PRODUCT_TYPES order:
+# Mortgage, Personal Loan, Auto Loan, Credit Card, SME Loan
+PRODUCT_MIXES = {
+    'baseline': [0.35, 0.25, 0.20, 0.15, 0.05],
+    'mortgage_heavy': [0.70, 0.10, 0.10, 0.05, 0.05],
+    'unsecured_heavy': [0.10, 0.35, 0.10, 0.40, 0.05],
+    'sme_heavy': [0.15, 0.10, 0.10, 0.15, 0.50],
+}
+
+# Passes are repeated (best result kept) until about this many loans have been processed
+REPEAT_LOANS = 3_000_000
+
+THROUGHPUT_TOLERANCE = 0.20
+MEMORY_TOLERANCE = 0.10
+
+# Stages faster than this in the baseline are too noisy for a throughput check
+MIN_COMPARE_SECONDS = 0.05
+
+RESULTS_DIR = 'benchmark_results'
+HISTORY_FILE = 'history.json'
+BASELINE_FILE = 'baseline.json'
+
+
+def result_key(stage, mix, n_loans):
+    return f"{stage}/{mix}/{n_loans}"
+
+
+def _stage_results(stages, mix, n_loans, top_level_only=False):
+    results = {}
+    for record in stages:
+        if top_level_only and record['parent'] is not None:
+            continue
+        results[result_key(record['stage'], mix, n_loans)] = {
+            'stage': record['stage'], 'mix': mix, 'n_loans': n_loans,
+            'wall_seconds': record['wall_seconds'], 'rows_per_sec': record['rows_per_sec'],
+            'peak_rss_mb': record['peak_rss_mb'],
+        }
+    return results
+
+
+def run_pass(n_loans, mix, work_dir, io=False, seed=42):
+    """One size/mix: the streamed pipeline, plus the I/O and notebook summary paths if ``io``"""
+    import aggregation
+    import data_source
+    import portfolio_generator
+    import portfolio_io
+    import portfolio_schema
+    import profiler
+
+    profiler.reset()
+    profiler.enable()
+    os.makedirs(work_dir, exist_ok=True)
+    parquet_file = os.path.join(work_dir, 'portfolio.parquet')
+    csv_file = os.path.join(work_dir, 'portfolio.csv')
+    weights = PRODUCT_MIXES[mix]
+
+    acc = aggregation.CubeAccumulator()
+    writer = portfolio_io.ParquetChunkWriter(parquet_file) if io else None
+    for chunk_index in range(portfolio_generator.n_chunks(n_loans)):
+        with profiler.stage('pipeline') as pipeline:
+            chunk = portfolio_generator.generate_chunk(chunk_index, n_loans, seed=seed, product_weights=weights)
+            acc.update(chunk)
+            pipeline.rows = len(chunk)
+        if io:
+            with profiler.stage('parquet_write', rows=len(chunk)):
+                writer.write(chunk)
+            with profiler.stage('csv_write', rows=len(chunk)):
+                portfolio_schema.expand(chunk).to_csv(csv_file, mode='w' if chunk_index == 0 else 'a',
+                                                      header=chunk_index == 0, index=False)
+        del chunk
+    with profiler.stage('pipeline'):
+        aggregation.build_summaries(acc)
+    if writer is not None:
+        writer.close()
+    results = _stage_results(profiler.report()['stages'], mix, n_loans)
+
+    if io:
+        # Fresh report so the notebook summaries' aggregate calls are not added to the pipeline's
+        profiler.reset()
+        for stage_name, path in (('parquet_read', parquet_file), ('csv_read', csv_file)):
+            with profiler.stage(stage_name) as read:
+                read.rows = sum(len(chunk) for chunk in data_source.LocalSource(path).iter_chunks())
+        with profiler.stage('notebook_summaries', rows=n_loans):
+            aggregation.compute_summaries(
+                data_source.LocalSource(parquet_file).iter_chunks(data_source.SUMMARY_COLUMNS))
+        results.update(_stage_results(profiler.report()['stages'], mix, n_loans, top_level_only=True))
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def _best(results, previous):
+    """Best of repeated passes: highest throughput, shortest time and lowest peak per stage"""
+    if previous is None:
+        return results
+    for key, record in results.items():
+        best = previous.get(key)
+        if best is None:
+            previous[key] = record
+            continue
+        if record['rows_per_sec'] is not None:
+            best['rows_per_sec'] = max(best['rows_per_sec'] or 0, record['rows_per_sec'])
+        best['wall_seconds'] = min(best['wall_seconds'], record['wall_seconds'])
+        best['peak_rss_mb'] = min(best['peak_rss_mb'], record['peak_rss_mb'])
+    return previous
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes=SIZES, mixes=tuple(PRODUCT_MIXES), work_dir='benchmark_work', max_repeats=3, seed=42):
+    """Every size x mix in its own process; I/O and notebook summaries run with the first mix"""
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    start = time.perf_counter()
+    for n_loans in sizes:
+        repeats = max(1, min(max_repeats, REPEAT_LOANS // n_loans))
+        for mix_index, mix in enumerate(mixes):
+            best = None
+            for _ in range(repeats):
+                # A fresh interpreter per pass keeps peak RSS independent of earlier passes
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    best = _best(pool.submit(run_pass, n_loans, mix, work_dir, mix_index == 0, seed).result(),
+                                 best)
+            results.update(best)
+            print(f"  {n_loans:>12,} loans, {mix:<16} ×{repeats}  "
+                  f"pipeline {best[result_key('pipeline', mix, n_loans)]['rows_per_sec']:>12,} rows/s")
+    return {
+        'run_id': uuid.uuid4().hex[:12],
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpus': os.cpu_count()},
+        'config': {'sizes': list(sizes), 'mixes': list(mixes), 'max_repeats': max_repeats, 'seed': seed},
+        'suite_seconds': round(time.perf_counter() - start, 3),
+        'results': results,
+    }
+
+
+# =============================================================================
+# HISTORY AND BASELINE
+# =============================================================================
+
+def load_history(results_dir=RESULTS_DIR):
+    path = os.path.join(results_dir, HISTORY_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def append_history(run, results_dir=RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    history = load_history(results_dir) + [run]
+    with open(os.path.join(results_dir, HISTORY_FILE), 'w') as f:
+        json.dump(history, f, indent=2)
+
+
+def load_baseline(results_dir=RESULTS_DIR):
+    path = os.path.join(results_dir, BASELINE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(run, results_dir=RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, BASELINE_FILE), 'w') as f:
+        json.dump(run, f, indent=2)
+
+
+def find_run(run_id, results_dir=RESULTS_DIR):
+    """A run from the history by ID prefix, or the latest for 'latest'"""
+    history = load_history(results_dir)
+    if not history:
+        raise ValueError(f"No benchmark history in {results_dir}")
+    if run_id == 'latest':
+        return history[-1]
+    matches = [run for run in history if run['run_id'].startswith(run_id)]
+    if len(matches) != 1:
+        raise ValueError(f"Run ID {run_id!r} matches {len(matches)} runs")
+    return matches[0]
+
+
+def compare(run, baseline, tolerance=THROUGHPUT_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    """Per-stage changes against the baseline; 'regressed' marks those past the tolerance"""
+    rows = []
+    for key, base in baseline['results'].items():
+        current = run['results'].get(key)
+        if current is None:
+            continue
+        if base['rows_per_sec'] and current['rows_per_sec'] and base['wall_seconds'] >= MIN_COMPARE_SECONDS:
+            change = current['rows_per_sec'] / base['rows_per_sec'] - 1
+            rows.append({'key': key, 'metric': 'rows_per_sec', 'baseline': base['rows_per_sec'],
+                         'current': current['rows_per_sec'], 'change': change, 'regressed': change < -tolerance})
+        change = current['peak_rss_mb'] / base['peak_rss_mb'] - 1
+        rows.append({'key': key, 'metric': 'peak_rss_mb', 'baseline': base['peak_rss_mb'],
+                     'current': current['peak_rss_mb'], 'change': change, 'regressed': change > memory_tolerance})
+    return rows
+
+
+def format_comparison(rows):
+    width = max([len('stage/mix/loans')] + [len(row['key']) for row in rows])
+    lines = [f"   {'stage/mix/loans':<{width}} {'metric':<13} {'baseline':>14} {'current':>14} {'change':>8}"]
+    for row in rows:
+        lines.append(f"{'❌' if row['regressed'] else '✅'} {row['key']:<{width}} {row['metric']:<13} "
+                     f"{row['baseline']:>14,} {row['current']:>14,} {row['change']:>+8.1%}")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IFRS 9 pipeline benchmark suite with regression tracking")
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run the suite, record it and check it against the baseline")
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    run_parser.add_argument('--mixes', nargs='+', choices=list(PRODUCT_MIXES), default=list(PRODUCT_MIXES))
+    run_parser.add_argument('--repeats', type=int, default=3, help="Max passes per size/mix (best kept)")
+    run_parser.add_argument('--work-dir', default='benchmark_work')
+    run_parser.add_argument('--tolerance', type=float, default=THROUGHPUT_TOLERANCE,
+                            help="Allowed throughput drop, e.g. 0.2 = 20%%")
+    run_parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE,
+                            help="Allowed peak RSS growth, e.g. 0.1 = 10%%")
+    run_parser.add_argument('--update-baseline', action='store_true', help="Make this run the new baseline")
+
+    compare_parser = subparsers.add_parser('compare', help="Check a recorded run against the baseline")
+    compare_parser.add_argument('run_id', nargs='?', default='latest')
+    compare_parser.add_argument('--tolerance', type=float, default=THROUGHPUT_TOLERANCE)
+    compare_parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+
+    baseline_parser = subparsers.add_parser('baseline', help="Make a recorded run the baseline")
+    baseline_parser.add_argument('run_id', nargs='?', default='latest')
+
+    subparsers.add_parser('history', help="List recorded runs")
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        print(f"Benchmarking {len(args.sizes)} sizes × {len(args.mixes)} product mixes:")
+        run = run_suite(args.sizes, args.mixes, args.work_dir, args.repeats)
+        append_history(run, args.results_dir)
+        print(f"\n✅ Recorded run {run['run_id']} ({run['suite_seconds']:.1f}s) in "
+              f"{os.path.join(args.results_dir, HISTORY_FILE)}")
+
+        baseline = load_baseline(args.results_dir)
+        if baseline is None or args.update_baseline:
+            save_baseline(run, args.results_dir)
+            print(f"✅ Baseline is now run {run['run_id']}")
+        else:
+            rows = compare(run, baseline, args.tolerance, args.memory_tolerance)
+            print(f"\nAgainst baseline {baseline['run_id']} ({baseline['timestamp']}, commit {baseline['commit']}):")
+            print(format_comparison(rows))
+            regressions = [row for row in rows if row['regressed']]
+            if regressions:
+                print(f"\n❌ {len(regressions)} regressions past tolerance")
+                sys.exit(1)
+            print("\n✅ No regressions")
+
+    elif args.command == 'compare':
+        baseline = load_baseline(args.results_dir)
+        if baseline is None:
+            sys.exit(f"No baseline in {args.results_dir}")
+        rows = compare(find_run(args.run_id, args.results_dir), baseline, args.tolerance, args.memory_tolerance)
+        print(format_comparison(rows))
+        if any(row['regressed'] for row in rows):
+            sys.exit(1)
+
+    elif args.command == 'baseline':
+        run = find_run(args.run_id, args.results_dir)
+        save_baseline(run, args.results_dir)
+        print(f"✅ Baseline is now run {run['run_id']} ({run['timestamp']})")
+
+    elif args.command == 'history':
+        for run in load_history(args.results_dir):
+            pipeline = [r['rows_per_sec'] for r in run['results'].values() if r['stage'] == 'pipeline']
+            print(f"{run['run_id']}  {run['timestamp']}  commit {run['commit'] or '-':<9} "
+                  f"{len(run['results']):>4} results  best pipeline {max(pipeline, default=0):>12,} rows/s")
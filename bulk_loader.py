@@ -0,0 +1,429 @@
+"""
+Parallel Partitioned Bulk Loader
+Loads a monthly portfolio snapshot into the reporting_date-partitioned
+BigQuery table. The file is split into zstd Parquet shards, the shards are
+uploaded concurrently to a Cloud Storage staging prefix, and one load job
+replaces only that reporting date's partition (table$YYYYMMDD). Earlier
+snapshots are kept and re-running a load is idempotent. A manifest in the
+work directory records which shards are uploaded, so a failed run resumes
+without re-sending them.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+import data_source
+import portfolio_io
+import query_cache
+
+SHARD_ROWS = 2_000_000
+UPLOAD_WORKERS = 8
+UPLOAD_ATTEMPTS = 3
+UPLOAD_CHUNK_BYTES = 32 * 1024 ** 2  # resumable upload chunk (multiple of 256 KB)
+MANIFEST_FILE = 'manifest.json'
+
+
+def partition_decorator(table_ref, reporting_date):
+    """Destination for one reporting_date partition, e.g. project.dataset.table$20241231"""
+    return f"{table_ref}${pd.Timestamp(reporting_date):%Y%m%d}"
+
+
+def file_md5(path):
+    """Base64 MD5 of a file, as reported by Cloud Storage"""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 ** 2), b''):
+            digest.update(block)
+    return base64.b64encode(digest.digest()).decode()
+
+
+# =============================================================================
+# SHARDING AND MANIFEST
+# =============================================================================
+
+class LoadManifest:
+    """Shard list and upload/load progress of one snapshot load, saved after every change"""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, work_dir):
+        with open(os.path.join(work_dir, MANIFEST_FILE)) as f:
+            return cls(os.path.join(work_dir, MANIFEST_FILE), json.load(f))
+
+    @property
+    def shards(self):
+        return self.data['shards']
+
+    def pending(self):
+        return [shard for shard in self.shards if not shard['uploaded']]
+
+    def reporting_dates(self):
+        return sorted({shard['reporting_date'] for shard in self.shards})
+
+    def mark(self, shard, **fields):
+        with self._lock:
+            shard.update(fields)
+            self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def write_shards(source_path, work_dir, shard_rows=SHARD_ROWS):
+    """Split a portfolio file into Parquet shards of one reporting date each
+
+    An existing manifest for the same, unchanged source file is reused, so a
+    resumed load keeps its shards and upload progress.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    version = query_cache.file_version(source_path)
+    if os.path.exists(os.path.join(work_dir, MANIFEST_FILE)):
+        manifest = LoadManifest.load(work_dir)
+        if manifest.data['source_version'] == version and manifest.data['shard_rows'] == shard_rows:
+            return manifest
+
+    shards = []
+    source = data_source.LocalSource(source_path, chunk_size=shard_rows)
+    for chunk in source.iter_chunks():
+        dates = pd.to_datetime(chunk['reporting_date'])
+        for reporting_date, rows in chunk.groupby(dates.dt.strftime('%Y-%m-%d'), sort=True):
+            name = f"{reporting_date.replace('-', '')}-{len(shards):05d}.parquet"
+            path = os.path.join(work_dir, name)
+            portfolio_io.write_parquet(rows, path)
+            shards.append({'name': name, 'reporting_date': reporting_date, 'rows': len(rows),
+                           'bytes': os.path.getsize(path), 'md5': file_md5(path), 'uploaded': False})
+
+    manifest = LoadManifest(os.path.join(work_dir, MANIFEST_FILE), {
+        'source': os.path.abspath(source_path), 'source_version': version, 'shard_rows': shard_rows,
+        'shards': shards, 'loaded': {},
+    })
+    manifest.save()
+    return manifest
+
+
+# =============================================================================
+# STAGING AREAS
+# =============================================================================
+
+class GCSStage:
+    """Cloud Storage staging prefix; shards go up as chunked resumable uploads, MD5-checked"""
+
+    def __init__(self, bucket, prefix='ifrs9-loads', client=None):
+        from google.cloud import storage
+
+        self.client = client or storage.Client()
+        self.bucket = self.client.bucket(bucket)
+        self.prefix = prefix.strip('/')
+
+    def _blob_name(self, name):
+        return f"{self.prefix}/{name}"
+
+    def uri(self, name):
+        return f"gs://{self.bucket.name}/{self._blob_name(name)}"
+
+    def exists(self, name, md5):
+        blob = self.bucket.get_blob(self._blob_name(name))
+        return blob is not None and blob.md5_hash == md5
+
+    def upload(self, path, name, md5):
+        blob = self.bucket.blob(self._blob_name(name), chunk_size=UPLOAD_CHUNK_BYTES)
+        blob.upload_from_filename(path, content_type='application/octet-stream', checksum='md5')
+
+
+class LocalStage:
+    """Directory stand-in for GCSStage, with optional throughput limit and failure injection"""
+
+    def __init__(self, path, bandwidth_mb_s=None, failures=None):
+        self.path = path
+        self.bandwidth_mb_s = bandwidth_mb_s  # per upload, like one HTTP connection
+        self.failures = dict(failures or {})  # shard name -> uploads to fail
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def uri(self, name):
+        return os.path.join(self.path, name)
+
+    def exists(self, name, md5):
+        return os.path.exists(self.uri(name)) and file_md5(self.uri(name)) == md5
+
+    def upload(self, path, name, md5):
+        size = os.path.getsize(path)
+        with self._lock:
+            self.bytes_sent += size
+        if self.bandwidth_mb_s:
+            time.sleep(size / (self.bandwidth_mb_s * 1024 ** 2))
+        with self._lock:
+            fail = self.failures.get(name, 0) > 0
+            if fail:
+                self.failures[name] -= 1
+        if fail:
+            raise ConnectionError(f"Simulated upload failure: {name}")
+        os.makedirs(os.path.dirname(self.uri(name)), exist_ok=True)
+        tmp_path = f"{self.uri(name)}.tmp"
+        shutil.copyfile(path, tmp_path)
+        if file_md5(tmp_path) != md5:
+            raise IOError(f"Checksum mismatch uploading {name}")
+        os.replace(tmp_path, self.uri(name))
+
+
+def upload_shards(stage, manifest, work_dir, workers=UPLOAD_WORKERS, attempts=UPLOAD_ATTEMPTS):
+    """Upload pending shards concurrently; returns the shards still failing after retries"""
+    # Shards live under the source version, so loads of different files never collide
+    def remote_name(shard):
+        return f"{manifest.data['source_version']}/{shard['name']}"
+
+    def upload(shard):
+        path = os.path.join(work_dir, shard['name'])
+        for attempt in range(attempts):
+            try:
+                stage.upload(path, remote_name(shard), shard['md5'])
+                manifest.mark(shard, uploaded=True, uri=stage.uri(remote_name(shard)), error=None)
+                return None
+            except Exception as e:  # network/service errors: retry, then leave for a resume
+                error = f"{type(e).__name__}: {e}"
+                if attempt + 1 < attempts:
+                    time.sleep(0.1 * 2 ** attempt)
+        manifest.mark(shard, error=error)
+        return shard
+
+    # A shard marked uploaded but missing from the stage (e.g. prefix cleaned up) is re-sent
+    for shard in manifest.shards:
+        if shard['uploaded'] and not stage.exists(remote_name(shard), shard['md5']):
+            manifest.mark(shard, uploaded=False)
+
+    pending = manifest.pending()
+    if not pending:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+        return [shard for shard in pool.map(upload, pending) if shard is not None]
+
+
+# =============================================================================
+# PARTITION LOAD
+# =============================================================================
+
+class LocalLoadJob:
+    def __init__(self, output_rows):
+        self.output_rows = output_rows
+        self.job_id = f"local-{time.time_ns()}"
+
+    def result(self):
+        return self
+
+
+class LocalWarehouse:
+    """Stand-in for bigquery.Client.load_table_from_uri over a local directory
+
+    Each table is a directory with one sub-directory per reporting_date
+    partition, readable with data_source.LocalSource and local_sql.LocalClient.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def table_path(self, table_ref):
+        return os.path.join(self.root, table_ref.split('$')[0].split('.')[-1])
+
+    def load_table_from_uri(self, source_uris, destination, job_config=None):
+        table_ref, partition = destination.split('$')
+        write_disposition = getattr(job_config, 'write_disposition', 'WRITE_TRUNCATE')
+        if write_disposition != 'WRITE_TRUNCATE':
+            raise ValueError("LocalWarehouse only supports WRITE_TRUNCATE partition loads")
+
+        expected = pd.Timestamp(partition).date()
+        partition_path = os.path.join(self.table_path(table_ref), partition)
+        staging_path = f"{partition_path}.loading"
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(staging_path)
+        rows = 0
+        for uri in source_uris:
+            dates = pq.read_table(uri, columns=['reporting_date']).column('reporting_date').unique().to_pylist()
+            if dates != [expected]:
+                raise ValueError(f"{uri} has rows outside partition {partition}")
+            shutil.copyfile(uri, os.path.join(staging_path, os.path.basename(uri)))
+            rows += pq.read_metadata(uri).num_rows
+
+        # Swap the partition in whole, like a WRITE_TRUNCATE load job
+        replaced_path = f"{partition_path}.replaced"
+        if os.path.exists(partition_path):
+            os.replace(partition_path, replaced_path)
+        os.replace(staging_path, partition_path)
+        shutil.rmtree(replaced_path, ignore_errors=True)
+        return LocalLoadJob(rows)
+
+
+def _load_job_config():
+    from google.cloud import bigquery
+
+    return bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,  # this partition only
+        time_partitioning=bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.DAY,
+                                                    field='reporting_date'),
+    )
+
+
+def load_snapshot(client, stage, source_path, table_ref, work_dir, shard_rows=SHARD_ROWS,
+                  workers=UPLOAD_WORKERS, cache=None):
+    """Shard, upload and load a snapshot file, one partition load job per reporting date
+
+    Raises RuntimeError if shards still fail after retries; re-running the same
+    call resumes from the manifest.
+    """
+    manifest = write_shards(source_path, work_dir, shard_rows)
+    failed = upload_shards(stage, manifest, work_dir, workers)
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(manifest.shards)} shards failed to upload "
+                           f"({failed[0]['error']}); re-run to resume")
+
+    job_config = None if isinstance(client, LocalWarehouse) else _load_job_config()
+    for reporting_date in manifest.reporting_dates():
+        uris = [shard['uri'] for shard in manifest.shards if shard['reporting_date'] == reporting_date]
+        job = client.load_table_from_uri(uris, partition_decorator(table_ref, reporting_date),
+                                         job_config=job_config).result()
+        manifest.data['loaded'][reporting_date] = {'rows': job.output_rows, 'job_id': job.job_id}
+        manifest.save()
+
+    # Cached query results for the replaced partitions are now stale
+    (cache or query_cache.QueryCache()).invalidate(table_ref.split('.')[-1])
+    return manifest
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def benchmark(n_loans, work_dir, shard_rows=500_000, workers=UPLOAD_WORKERS, bandwidth_mb_s=20.0, seed=42):
+    """Single-file upload vs sharded parallel upload at a simulated per-connection bandwidth"""
+    import portfolio_generator
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    csv_file = os.path.join(work_dir, 'portfolio.csv')
+    portfolio_generator.write_portfolio_stream(csv_file, n_loans, seed=seed)
+    cache = query_cache.QueryCache(os.path.join(work_dir, 'cache'))
+    table_ref = 'local.credit_risk_ifrs9.loan_portfolio'
+
+    # Baseline: the whole CSV over one connection, then one load
+    stage = LocalStage(os.path.join(work_dir, 'stage_single'), bandwidth_mb_s)
+    start = time.perf_counter()
+    stage.upload(csv_file, 'portfolio.csv', file_md5(csv_file))
+    single_seconds = time.perf_counter() - start
+    single_bytes = stage.bytes_sent
+
+    # Sharded load, with two shards failing on the first run
+    warehouse = LocalWarehouse(os.path.join(work_dir, 'warehouse'))
+    shard_dir = os.path.join(work_dir, 'shards')
+    stage = LocalStage(os.path.join(work_dir, 'stage'), bandwidth_mb_s)
+    start = time.perf_counter()
+    manifest = write_shards(csv_file, shard_dir, shard_rows)
+    shard_seconds = time.perf_counter() - start
+    version = manifest.data['source_version']
+    stage.failures = {f"{version}/{shard['name']}": UPLOAD_ATTEMPTS for shard in manifest.shards[:2]}
+
+    start = time.perf_counter()
+    try:
+        load_snapshot(warehouse, stage, csv_file, table_ref, shard_dir, shard_rows, workers, cache)
+        failed_first = 0
+    except RuntimeError:
+        failed_first = len(LoadManifest.load(shard_dir).pending())
+    first_seconds = time.perf_counter() - start
+    first_bytes = stage.bytes_sent
+
+    start = time.perf_counter()
+    manifest = load_snapshot(warehouse, stage, csv_file, table_ref, shard_dir, shard_rows, workers, cache)
+    resume_seconds = time.perf_counter() - start
+
+    loaded = data_source.LocalSource(warehouse.table_path(table_ref)).read(['loan_id'])
+    assert len(loaded) == n_loans and loaded['loan_id'].is_unique
+
+    return {
+        'single_bytes': single_bytes, 'single_seconds': single_seconds,
+        'shard_bytes': sum(shard['bytes'] for shard in manifest.shards), 'n_shards': len(manifest.shards),
+        'shard_seconds': shard_seconds, 'first_seconds': first_seconds, 'failed_first': failed_first,
+        'resume_seconds': resume_seconds, 'resent_bytes': stage.bytes_sent - first_bytes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel partitioned bulk loader")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    load_parser = subparsers.add_parser('load', help="Load a snapshot file into its reporting_date partition")
+    load_parser.add_argument('source', help="Portfolio Parquet/Feather/CSV file")
+    load_parser.add_argument('--table', default='credit_risk_ifrs9.loan_portfolio',
+                             help="[project.]dataset.table")
+    load_parser.add_argument('--project')
+    load_parser.add_argument('--bucket', help="Cloud Storage staging bucket")
+    load_parser.add_argument('--prefix', default='ifrs9-loads')
+    load_parser.add_argument('--local-warehouse', help="Load into a local directory instead of BigQuery")
+    load_parser.add_argument('--work-dir', help="Shards and manifest (default: loads/<source name>)")
+    load_parser.add_argument('--shard-rows', type=int, default=SHARD_ROWS)
+    load_parser.add_argument('--workers', type=int, default=UPLOAD_WORKERS)
+
+    status_parser = subparsers.add_parser('status', help="Show a load manifest")
+    status_parser.add_argument('work_dir')
+
+    bench_parser = subparsers.add_parser('benchmark', help="Single upload vs sharded parallel upload and resume")
+    bench_parser.add_argument('--n-loans', type=int, default=2_000_000)
+    bench_parser.add_argument('--shard-rows', type=int, default=250_000)
+    bench_parser.add_argument('--workers', type=int, default=UPLOAD_WORKERS)
+    bench_parser.add_argument('--bandwidth', type=float, default=20.0, help="Simulated MB/s per connection")
+    bench_parser.add_argument('--work-dir', default='load_benchmark')
+
+    args = parser.parse_args()
+
+    if args.command == 'load':
+        work_dir = args.work_dir or os.path.join('loads', os.path.splitext(os.path.basename(args.source))[0])
+        table_ref = args.table
+        if args.local_warehouse:
+            client = LocalWarehouse(args.local_warehouse)
+            stage = LocalStage(os.path.join(args.local_warehouse, '_stage'))
+        else:
+            from google.cloud import bigquery
+            if not args.bucket:
+                parser.error("--bucket is required for BigQuery loads")
+            client = bigquery.Client(project=args.project)
+            if table_ref.count('.') == 1:
+                table_ref = f"{client.project}.{table_ref}"
+            stage = GCSStage(args.bucket, args.prefix)
+        manifest = load_snapshot(client, stage, args.source, table_ref, work_dir, args.shard_rows, args.workers)
+        for reporting_date, load in manifest.data['loaded'].items():
+            print(f"✅ {partition_decorator(table_ref, reporting_date)}: {load['rows']:,} rows")
+
+    elif args.command == 'status':
+        manifest = LoadManifest.load(args.work_dir)
+        shards = pd.DataFrame(manifest.shards)
+        print(shards[['name', 'reporting_date', 'rows', 'bytes', 'uploaded']].to_string(index=False))
+        print(f"\n{shards['uploaded'].sum()} of {len(shards)} shards uploaded; "
+              f"loaded partitions: {', '.join(manifest.data['loaded']) or 'none'}")
+
+    elif args.command == 'benchmark':
+        result = benchmark(args.n_loans, args.work_dir, args.shard_rows, args.workers, args.bandwidth)
+        mb = 1024 ** 2
+        print(f"Loading {args.n_loans:,} loans at {args.bandwidth:.0f} MB/s per connection:")
+        print(f"  single CSV upload:       {result['single_bytes'] / mb:8.1f} MB {result['single_seconds']:8.2f}s")
+        print(f"  shard to Parquet:        {result['shard_bytes'] / mb:8.1f} MB {result['shard_seconds']:8.2f}s "
+              f"({result['n_shards']} shards)")
+        print(f"  parallel upload + load:  {result['first_seconds']:8.2f}s "
+              f"({result['failed_first']} shards failed)")
+        print(f"  resume:                  {result['resent_bytes'] / mb:8.1f} MB {result['resume_seconds']:8.2f}s "
+              f"(only failed shards re-sent)")
@@ -0,0 +1,312 @@
+"""
+Portfolio Data Sources
+One read interface for the loan portfolio with column projection and row
+filters pushed down to the backend: the BigQuery Storage Read API (Arrow
+record batches over parallel streams) in production, and local Parquet /
+Feather / CSV files for offline work and testing.
+
+Filters use the pyarrow convention: a list of (column, op, value) tuples
+that must all hold, or a list of such lists, any of which may hold.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import aggregation
+import portfolio_io
+
+# Columns read by the notebook's summaries, charts and watchlist
+ANALYTICS_COLUMNS = ['loan_id', 'reporting_date', 'product_type', 'origination_date', 'outstanding_balance',
+                     'credit_score_current', 'days_past_due', 'geography', 'pd_12m', 'pd_lifetime', 'lgd',
+                     'ifrs9_stage', 'ecl_amount', 'ecl_rate']
+
+# Columns read by aggregation.CubeAccumulator (summary tables and cubes)
+SUMMARY_COLUMNS = ['reporting_date', 'ifrs9_stage', 'product_type', 'origination_date',
+                   'geography'] + aggregation.NUMERICAL_COLUMNS
+
+DATE_COLUMNS = ('reporting_date', 'origination_date')
+
+# Parallel Storage Read streams per session (the service may return fewer)
+MAX_STREAMS = 8
+
+
+def _conjunctions(filters):
+    """Filters as a list of AND-groups (OR across groups)"""
+    if not filters:
+        return []
+    if isinstance(filters[0], tuple):
+        filters = [filters]
+    return [[_normalize(term) for term in group] for group in filters]
+
+
+def _normalize(term):
+    column, op, value = term
+    op = '=' if op == '==' else op
+    if column in DATE_COLUMNS:
+        to_date = lambda v: pd.Timestamp(v).date()
+        value = [to_date(v) for v in value] if op in ('in', 'not in') else to_date(value)
+    return column, op, value
+
+
+def filter_columns(filters):
+    """Columns referenced by the filters"""
+    return [column for group in _conjunctions(filters) for column, _, _ in group]
+
+
+def stage_filter(reporting_date=None, stages=None):
+    """Filter on reporting date and/or IFRS 9 stages"""
+    terms = []
+    if reporting_date is not None:
+        terms.append(('reporting_date', '=', reporting_date))
+    if stages is not None:
+        terms.append(('ifrs9_stage', 'in', [int(stage) for stage in stages]))
+    return terms
+
+
+def _sql_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("'", "\\'") + "'"
+    if hasattr(value, 'isoformat'):
+        return f"CAST('{value.isoformat()}' AS DATE)"
+    return repr(value.item() if isinstance(value, np.generic) else value)
+
+
+def row_restriction(filters):
+    """Filters as a BigQuery Storage Read API row restriction (SQL predicate)"""
+    groups = []
+    for group in _conjunctions(filters):
+        terms = []
+        for column, op, value in group:
+            if op in ('in', 'not in'):
+                values = ', '.join(_sql_literal(v) for v in value)
+                terms.append(f"{column} {op.upper()} ({values})")
+            else:
+                terms.append(f"{column} {op} {_sql_literal(value)}")
+        groups.append(' AND '.join(terms))
+    if len(groups) > 1:
+        return ' OR '.join(f'({group})' for group in groups)
+    return groups[0] if groups else ''
+
+
+def filter_mask(df, filters):
+    """Boolean row mask for a pandas frame"""
+    mask = np.zeros(len(df), dtype=bool) if filters else np.ones(len(df), dtype=bool)
+    for group in _conjunctions(filters):
+        group_mask = np.ones(len(df), dtype=bool)
+        for column, op, value in group:
+            values = df[column]
+            if column in DATE_COLUMNS:
+                values = pd.to_datetime(values).dt.date
+            if op in ('in', 'not in'):
+                hit = values.isin(value).to_numpy()
+                group_mask &= hit if op == 'in' else ~hit
+            else:
+                group_mask &= {'=': values.__eq__, '!=': values.__ne__, '<': values.__lt__,
+                               '<=': values.__le__, '>': values.__gt__, '>=': values.__ge__}[op](value).to_numpy()
+        mask |= group_mask
+    return mask
+
+
+def _projection(columns, filters):
+    """Columns to read: the requested ones plus any only needed to filter"""
+    if columns is None:
+        return None
+    return list(columns) + [c for c in dict.fromkeys(filter_columns(filters)) if c not in columns]
+
+
+class LocalSource:
+    """Portfolio file (Parquet, Feather or CSV) or directory of Parquet files"""
+
+    def __init__(self, path, chunk_size=1_000_000):
+        self.path = path
+        self.chunk_size = chunk_size
+        extension = os.path.splitext(path)[1].lower()
+        if os.path.isdir(path) or extension == '.parquet':
+            self.format = 'parquet'
+        elif extension in ('.feather', '.arrow'):
+            self.format = 'feather'
+        elif extension == '.csv':
+            self.format = 'csv'
+        else:
+            raise ValueError(f"Unsupported portfolio file format: {path}")
+
+    def __repr__(self):
+        return f"LocalSource({self.path!r})"
+
+    def _dataset(self):
+        partitioning = 'hive' if os.path.isdir(self.path) else None
+        return ds.dataset(self.path, format='ipc' if self.format == 'feather' else 'parquet',
+                          partitioning=partitioning)
+
+    def _expression(self, filters):
+        groups = _conjunctions(filters)
+        return pq.filters_to_expression(groups) if groups else None
+
+    def read(self, columns=None, filters=None):
+        """Projected, filtered portfolio as a wide DataFrame"""
+        if self.format == 'csv':
+            return pd.concat(list(self.iter_chunks(columns, filters)), ignore_index=True)
+        table = self._dataset().to_table(columns=columns, filter=self._expression(filters))
+        return portfolio_io.from_arrow(table)
+
+    def iter_chunks(self, columns=None, filters=None):
+        """Projected, filtered portfolio in chunks of up to chunk_size rows"""
+        if self.format == 'csv':
+            read = _projection(columns, filters)
+            parse_dates = [c for c in DATE_COLUMNS if read is None or c in read]
+            # 'N/A' is a real industry_sector value, not a missing marker
+            for chunk in pd.read_csv(self.path, usecols=read, keep_default_na=False,
+                                     parse_dates=parse_dates, chunksize=self.chunk_size):
+                if filters:
+                    chunk = chunk[filter_mask(chunk, filters)]
+                yield chunk[columns] if columns is not None else chunk
+            return
+        scanner = self._dataset().scanner(columns=columns, filter=self._expression(filters),
+                                          batch_size=self.chunk_size)
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield portfolio_io.from_arrow(pa.Table.from_batches([batch]))
+
+
+class BigQuerySource:
+    """BigQuery table read through the Storage Read API as Arrow, one thread per stream
+
+    Column projection and row filters are applied server side, so only the
+    requested columns of matching rows leave BigQuery.
+    """
+
+    def __init__(self, table, project=None, max_streams=MAX_STREAMS, client=None):
+        from google.cloud import bigquery_storage
+
+        parts = table.replace(':', '.').split('.')
+        if len(parts) == 2 and project:
+            parts = [project] + parts
+        if len(parts) != 3:
+            raise ValueError(f"Expected project.dataset.table, got {table!r}")
+        self.project, self.dataset, self.table = parts
+        self.billing_project = project or self.project
+        self.max_streams = max_streams
+        self._types = bigquery_storage.types
+        self.client = client or bigquery_storage.BigQueryReadClient()
+
+    def __repr__(self):
+        return f"BigQuerySource('{self.project}.{self.dataset}.{self.table}')"
+
+    def _session(self, columns, filters):
+        types = self._types
+        read_options = types.ReadSession.TableReadOptions(
+            selected_fields=list(columns or []), row_restriction=row_restriction(filters))
+        session = types.ReadSession(
+            table=f"projects/{self.project}/datasets/{self.dataset}/tables/{self.table}",
+            data_format=types.DataFormat.ARROW, read_options=read_options)
+        return self.client.create_read_session(parent=f"projects/{self.billing_project}",
+                                               read_session=session, max_stream_count=self.max_streams)
+
+    def _read_stream(self, session, stream):
+        return self.client.read_rows(stream.name).to_arrow(session)
+
+    def _stream_tables(self, columns, filters):
+        session = self._session(columns, filters)
+        if not session.streams:
+            schema = pa.ipc.read_schema(pa.py_buffer(session.arrow_schema.serialized_schema))
+            yield schema.empty_table()
+            return
+        with ThreadPoolExecutor(max_workers=len(session.streams)) as pool:
+            futures = [pool.submit(self._read_stream, session, stream) for stream in session.streams]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def read(self, columns=None, filters=None):
+        """Projected, filtered table as a wide DataFrame"""
+        table = pa.concat_tables(list(self._stream_tables(columns, filters)))
+        return portfolio_io.from_arrow(table)
+
+    def iter_chunks(self, columns=None, filters=None):
+        """Projected, filtered table, one chunk per read stream as streams finish"""
+        for table in self._stream_tables(columns, filters):
+            if table.num_rows:
+                yield portfolio_io.from_arrow(table)
+
+
+def open_source(location, project=None, **kwargs):
+    """Local path -> LocalSource; 'project.dataset.table' -> BigQuerySource"""
+    if os.path.exists(location) or os.path.splitext(location)[1].lower() in ('.parquet', '.feather',
+                                                                                '.arrow', '.csv'):
+        return LocalSource(location, **kwargs)
+    return BigQuerySource(location, project=project, **kwargs)
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def benchmark(n_loans, work_dir, seed=42):
+    """Full-table read vs projected, stage-filtered read of a local Parquet portfolio"""
+    import portfolio_generator
+
+    os.makedirs(work_dir, exist_ok=True)
+    parquet_file = os.path.join(work_dir, 'portfolio.parquet')
+    portfolio_generator.write_portfolio_stream(parquet_file, n_loans, seed=seed)
+    source = LocalSource(parquet_file)
+
+    reads = {
+        'SELECT * (all columns)': dict(),
+        'analytics columns': dict(columns=ANALYTICS_COLUMNS),
+        'summary columns': dict(columns=SUMMARY_COLUMNS),
+        'summary columns, Stage 2+3': dict(columns=SUMMARY_COLUMNS, filters=stage_filter(stages=[2, 3])),
+    }
+    results = []
+    for label, kwargs in reads.items():
+        start = time.perf_counter()
+        df = source.read(**kwargs)
+        seconds = time.perf_counter() - start
+        results.append({'read': label, 'rows': len(df), 'columns': len(df.columns),
+                        'memory_mb': df.memory_usage(deep=True).sum() / 1e6, 'seconds': seconds})
+        del df
+    return pd.DataFrame(results).set_index('read')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read the loan portfolio with projection and filter pushdown")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    read_parser = subparsers.add_parser('read', help="Read a portfolio source")
+    read_parser.add_argument('source', help="Local file/directory or project.dataset.table")
+    read_parser.add_argument('--project', help="Billing project for BigQuery sources")
+    read_parser.add_argument('--columns', help="Comma-separated columns (default: all)")
+    read_parser.add_argument('--reporting-date')
+    read_parser.add_argument('--stages', help="Comma-separated IFRS 9 stages, e.g. 2,3")
+    read_parser.add_argument('--output', help="Write the result (.parquet, .feather or .csv)")
+
+    bench_parser = subparsers.add_parser('benchmark', help="Full read vs projected/filtered reads")
+    bench_parser.add_argument('--n-loans', type=int, default=5_000_000)
+    bench_parser.add_argument('--work-dir', default='source_benchmark')
+
+    args = parser.parse_args()
+
+    if args.command == 'read':
+        source = open_source(args.source, project=args.project)
+        columns = args.columns.split(',') if args.columns else None
+        stages = [int(s) for s in args.stages.split(',')] if args.stages else None
+        start = time.perf_counter()
+        df = source.read(columns, stage_filter(args.reporting_date, stages))
+        elapsed = time.perf_counter() - start
+        print(f"✅ {source}: {len(df):,} rows x {len(df.columns)} columns in {elapsed:.2f}s")
+        if args.output:
+            portfolio_io.write_portfolio(df, args.output)
+            print(f"✅ Saved: {args.output}")
+        else:
+            print(df.head())
+
+    elif args.command == 'benchmark':
+        results = benchmark(args.n_loans, args.work_dir)
+        print(f"Reading {args.n_loans:,} loans from Parquet:")
+        print(results.round({'memory_mb': 1, 'seconds': 3}).to_string())
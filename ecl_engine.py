@@ -0,0 +1,234 @@
+"""
+Vectorized IFRS 9 ECL Engine
+Column-wise replacements for the row-wise PD/LGD, staging and ECL functions
+in generate_sample_data.py. Results are bit-identical to the originals.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import portfolio_schema
+import profiler
+
+# Product order used for every product lookup array below
+PRODUCT_TYPES = ['Mortgage', 'Auto Loan', 'Personal Loan', 'Credit Card', 'SME Loan']
+
+# PD bands by current credit score: <600, 600-649, 650-699, 700-749, 750+
+SCORE_BAND_EDGES = np.array([600, 650, 700, 750])
+BASE_PD_BY_BAND = np.array([0.10, 0.05, 0.025, 0.01, 0.005])
+
+# DPD multipliers: current, 1-30, 31-90, 90+
+DPD_MULTIPLIERS = np.array([1.0, 2.0, 4.0, 8.0])
+
+# Product risk adjustment (last entry is the default for unknown products)
+PRODUCT_PD_ADJ = np.array([0.7, 0.9, 1.2, 1.5, 1.3, 1.0])
+
+# LGD uniform ranges in PRODUCT_TYPES order (collateral-driven)
+LGD_LOW = np.array([0.15, 0.25, 0.50, 0.60, 0.40])
+LGD_HIGH = np.array([0.30, 0.40, 0.70, 0.80, 0.60])
+DEFAULT_LGD = 0.50
+
+LIFETIME_PD_MULTIPLIER = 3.0
+
+# SICR thresholds
+STAGE3_DPD = 90
+SICR_DPD = 30
+SICR_SCORE_DROP = 100
+SICR_PD_THRESHOLD = 0.03
+
+
+def product_codes(products):
+    """Map product names to indices into PRODUCT_TYPES (-1 for unknown)"""
+    if isinstance(getattr(products, 'dtype', None), pd.CategoricalDtype):
+        # Recode the category dictionary only, not every row's string
+        return products.cat.set_categories(PRODUCT_TYPES).cat.codes.to_numpy()
+    return pd.Categorical(np.asarray(products), categories=PRODUCT_TYPES).codes
+
+
+def pd_12m_vectorized(credit_score, days_past_due, codes):
+    """Unrounded 12-month PD from score band, DPD multiplier and product"""
+    credit_score = np.asarray(credit_score)
+    days_past_due = np.asarray(days_past_due)
+
+    base_pd = BASE_PD_BY_BAND[np.searchsorted(SCORE_BAND_EDGES, credit_score, side='right')]
+    dpd_multiplier = DPD_MULTIPLIERS[np.select(
+        [days_past_due == 0, days_past_due <= 30, days_past_due <= 90],
+        [0, 1, 2],
+        default=3,
+    )]
+    # Index -1 (unknown product) picks the trailing default adjustment
+    product_adj = PRODUCT_PD_ADJ[codes]
+
+    return np.minimum(base_pd * dpd_multiplier * product_adj, 1.0)
+
+
+def lgd_vectorized(codes, rng=None):
+    """LGD drawn per loan from the product range
+
+    Consumes five uniforms per loan in PRODUCT_TYPES order, exactly as the
+    row-wise version did, so the legacy global RNG stream is preserved.
+    """
+    uniform = np.random.uniform if rng is None else rng.uniform
+    draws = uniform(LGD_LOW, LGD_HIGH, size=(len(codes), len(PRODUCT_TYPES)))
+
+    lgd = np.full(len(codes), DEFAULT_LGD)
+    known = codes >= 0
+    lgd[known] = draws[np.flatnonzero(known), codes[known]]
+    return lgd
+
+
+@profiler.profiled()
+def calculate_pd(df, codes=None):
+    """Calculate 12-month and lifetime PD, leaving LGD untouched"""
+    if codes is None:
+        codes = product_codes(df['product_type'])
+    pd_12m = pd_12m_vectorized(df['credit_score_current'], df['days_past_due'], codes)
+
+    # Lifetime PD is derived from the unrounded 12m PD
+    df['pd_12m'] = np.round(pd_12m, 6)
+    df['pd_lifetime'] = np.round(np.minimum(pd_12m * LIFETIME_PD_MULTIPLIER, 1.0), 6)
+    return df
+
+
+@profiler.profiled()
+def calculate_pd_lgd(df, rng=None):
+    """Calculate PD (Probability of Default) and LGD (Loss Given Default)"""
+
+    codes = product_codes(df['product_type'])
+    calculate_pd(df, codes)
+    df['lgd'] = np.round(lgd_vectorized(codes, rng), 4)
+
+    if portfolio_schema.is_compact(df):
+        portfolio_schema.apply_dtypes(df)
+    return df
+
+
+def stage_vectorized(days_past_due, credit_score_origination, credit_score_current, pd_12m):
+    """IFRS 9 stage (1, 2 or 3) from DPD, score drop and 12m PD"""
+    days_past_due = np.asarray(days_past_due)
+    credit_score_drop = np.asarray(credit_score_origination) - np.asarray(credit_score_current)
+
+    sicr = (
+        (days_past_due >= SICR_DPD)
+        | (credit_score_drop > SICR_SCORE_DROP)
+        | (np.asarray(pd_12m) > SICR_PD_THRESHOLD)
+    )
+    return np.select([days_past_due > STAGE3_DPD, sicr], [3, 2], default=1)
+
+
+@profiler.profiled()
+def assign_ifrs9_stage(df):
+    """Assign IFRS 9 staging (Stage 1, 2, or 3)"""
+    df['ifrs9_stage'] = stage_vectorized(
+        df['days_past_due'],
+        df['credit_score_origination'],
+        df['credit_score_current'],
+        df['pd_12m'],
+    ).astype(portfolio_schema.COMPACT_DTYPES['ifrs9_stage'] if portfolio_schema.is_compact(df)
+             else np.int64)
+    return df
+
+
+def ecl_vectorized(outstanding_balance, stage, pd_12m, pd_lifetime, lgd):
+    """Unrounded ECL: 12-month PD for Stage 1, lifetime PD otherwise"""
+    pd_applied = np.where(np.asarray(stage) == 1, pd_12m, pd_lifetime)
+    return np.asarray(outstanding_balance) * pd_applied * np.asarray(lgd)
+
+
+@profiler.profiled()
+def calculate_ecl(df):
+    """Calculate Expected Credit Loss"""
+    df['ecl_amount'] = pd.Series(
+        ecl_vectorized(df['outstanding_balance'], df['ifrs9_stage'],
+                       df['pd_12m'], df['pd_lifetime'], df['lgd']),
+        index=df.index,
+    ).round(2)
+    df['ecl_rate'] = (df['ecl_amount'] / df['outstanding_balance'] * 100).round(4)
+
+    if portfolio_schema.is_compact(df):
+        portfolio_schema.apply_dtypes(df)
+    return df
+
+
+def run_ecl_pipeline(df, rng=None):
+    """Run PD/LGD, staging and ECL on a generated portfolio"""
+    df = calculate_pd_lgd(df, rng)
+    df = assign_ifrs9_stage(df)
+    return calculate_ecl(df)
+
+
+def recalculate_ecl(df):
+    """Re-run PD, staging and ECL on loans that already carry an LGD draw"""
+    df = calculate_pd(df)
+    df = assign_ifrs9_stage(df)
+    return calculate_ecl(df)
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def synthetic_ecl_inputs(n_loans, seed=42):
+    """Draw only the columns the ECL pipeline reads, for benchmarking"""
+    rng = np.random.default_rng(seed)
+    score_orig = rng.normal(680, 80, n_loans).clip(300, 850).round()
+    score_curr = (score_orig + rng.normal(0, 30, n_loans)).clip(300, 850).round()
+    return pd.DataFrame({
+        'product_type': rng.choice(PRODUCT_TYPES, n_loans, p=[0.35, 0.20, 0.25, 0.15, 0.05]),
+        'outstanding_balance': rng.lognormal(10.5, 1.0, n_loans).round(2),
+        'credit_score_origination': score_orig.astype(np.int64),
+        'credit_score_current': score_curr.astype(np.int64),
+        'days_past_due': rng.choice([0, 30, 60, 90, 120, 180], n_loans,
+                                    p=[0.85, 0.08, 0.03, 0.02, 0.01, 0.01]),
+    })
+
+
+def verify_against_legacy(n_loans=5000, seed=42):
+    """Check the vectorized pipeline reproduces the row-wise one exactly"""
+    import generate_sample_data as legacy
+
+    np.random.seed(seed)
+    base = legacy.generate_loan_portfolio(n_loans)
+
+    np.random.seed(seed)
+    expected = legacy.calculate_ecl(legacy.assign_ifrs9_stage(legacy.calculate_pd_lgd(base.copy())))
+    np.random.seed(seed)
+    actual = run_ecl_pipeline(base.copy())
+
+    pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+    return True
+
+
+def benchmark(sizes, seed=42):
+    """Time the vectorized pipeline and report rows/second per size"""
+    results = []
+    for n_loans in sizes:
+        df = synthetic_ecl_inputs(n_loans, seed)
+        rng = np.random.default_rng(seed)
+
+        start = time.perf_counter()
+        run_ecl_pipeline(df, rng)
+        elapsed = time.perf_counter() - start
+
+        results.append({'n_loans': n_loans, 'seconds': elapsed, 'rows_per_sec': n_loans / elapsed})
+        print(f"{n_loans:>12,} loans: {elapsed:8.3f}s  {n_loans / elapsed:>14,.0f} rows/s")
+        del df
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized ECL pipeline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5000, 1_000_000, 20_000_000])
+    parser.add_argument('--skip-verify', action='store_true',
+                        help="Skip the bit-identical check against the row-wise functions")
+    args = parser.parse_args()
+
+    if not args.skip_verify:
+        verify_against_legacy()
+        print("✅ Vectorized results are bit-identical to the row-wise pipeline (5,000 loans)")
+
+    print("\nVectorized ECL pipeline throughput:")
+    benchmark(args.sizes)
@@ -8,10 +8,13 @@ import numpy as np
 from datetime import datetime, timedelta
 import random
 
+import profiler
+
 # Set random seed for reproducibility
 np.random.seed(42)
 random.seed(42)
 
+@profiler.profiled('generate_loan_portfolio_legacy')
 def generate_loan_portfolio(n_loans=5000):
     """Generate synthetic loan portfolio data"""
     
@@ -126,6 +129,7 @@ def generate_loan_portfolio(n_loans=5000):
     return df
 
 
+@profiler.profiled('calculate_pd_lgd_legacy')
 def calculate_pd_lgd(df):
     """Calculate PD (Probability of Default) and LGD (Loss Given Default)"""
     
@@ -194,6 +198,7 @@ def calculate_pd_lgd(df):
     return df
 
 
+@profiler.profiled('assign_ifrs9_stage_legacy')
 def assign_ifrs9_stage(df):
     """Assign IFRS 9 staging (Stage 1, 2, or 3)"""
     
@@ -219,6 +224,7 @@ def assign_ifrs9_stage(df):
     return df
 
 
+@profiler.profiled('calculate_ecl_legacy')
 def calculate_ecl(df):
     """Calculate Expected Credit Loss"""
     
@@ -241,19 +247,22 @@ def calculate_ecl(df):
 
 
 if __name__ == "__main__":
+    # Vectorized equivalents of the functions above (bit-identical output)
+    import ecl_engine
+
     print("Generating synthetic IFRS 9 loan portfolio data...")
     
     # Generate portfolio
     portfolio_df = generate_loan_portfolio(n_loans=5000)
     
     # Calculate risk parameters
-    portfolio_df = calculate_pd_lgd(portfolio_df)
+    portfolio_df = ecl_engine.calculate_pd_lgd(portfolio_df)
     
     # Assign IFRS 9 stages
-    portfolio_df = assign_ifrs9_stage(portfolio_df)
+    portfolio_df = ecl_engine.assign_ifrs9_stage(portfolio_df)
     
     # Calculate ECL
-    portfolio_df = calculate_ecl(portfolio_df)
+    portfolio_df = ecl_engine.calculate_ecl(portfolio_df)
     
     # Save to CSV
     output_file = 'loan_portfolio_data.csv'
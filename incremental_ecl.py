@@ -0,0 +1,218 @@
+"""
+Incremental ECL Recalculation
+Applies a month-end change feed (loans whose DPD, credit score or balance
+moved) to the previous snapshot's results. Only the changed rows go through
+PD, staging and ECL, and portfolio totals and stage allocations are adjusted
+by the difference, so a close costs O(changes) instead of O(portfolio).
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import ecl_engine
+import portfolio_schema
+
+# Loan attributes a change feed may update; anything else needs a full run
+CHANGE_COLUMNS = ['days_past_due', 'credit_score_current', 'outstanding_balance']
+RESULT_COLUMNS = ['pd_12m', 'pd_lifetime', 'ifrs9_stage', 'ecl_amount', 'ecl_rate']
+
+
+def stage_allocation(df):
+    """Loan count, exposure and ECL per IFRS 9 stage (rows indexed 0-3, 0 unused)"""
+    stage = np.asarray(df['ifrs9_stage'], dtype=np.intp)
+    return np.stack([
+        np.bincount(stage, minlength=4).astype(np.float64),
+        np.bincount(stage, weights=df['outstanding_balance'].to_numpy(dtype=np.float64), minlength=4),
+        np.bincount(stage, weights=df['ecl_amount'].to_numpy(dtype=np.float64), minlength=4),
+    ], axis=1)
+
+
+class IncrementalECL:
+    """Previous snapshot results plus running totals, updated from change feeds"""
+
+    def __init__(self, snapshot, cube=None):
+        df = portfolio_schema.compact(snapshot)
+        if not df['loan_id'].is_monotonic_increasing:
+            df = df.sort_values('loan_id')
+        self.df = df.reset_index(drop=True)
+        self.loan_ids = self.df['loan_id'].to_numpy()
+        self.allocation = stage_allocation(self.df)
+        # Optional summary_cube.SummaryCube kept in step with the snapshot
+        self.cube = cube
+
+    def positions(self, loan_ids):
+        """Row positions of loan IDs in the snapshot (KeyError for unknown loans)"""
+        loan_ids = portfolio_schema.parse_loan_ids(loan_ids)
+        rows = np.searchsorted(self.loan_ids, loan_ids)
+        found = rows < len(self.loan_ids)
+        found[found] = self.loan_ids[rows[found]] == loan_ids[found]
+        if not found.all():
+            raise KeyError(f"{(~found).sum():,} loans in the change feed are not in the snapshot, "
+                           f"e.g. {portfolio_schema.format_loan_ids(loan_ids[~found][:3]).tolist()}")
+        return rows
+
+    def apply_changes(self, changes):
+        """Recompute the changed loans and update totals; returns (before, after) rows"""
+        changes = changes.drop_duplicates('loan_id', keep='last')
+        rows = self.positions(changes['loan_id'])
+        columns = [c for c in CHANGE_COLUMNS if c in changes.columns]
+
+        before = self.df.iloc[rows].copy()
+        after = before.copy()
+        for column in columns:
+            after[column] = changes[column].to_numpy().astype(after[column].dtype)
+        if 'dpd_bucket' in after.columns:
+            after['dpd_bucket'] = portfolio_schema.dpd_bucket(after['days_past_due'])
+
+        # LGD is collateral-driven and keeps the loan's existing draw
+        after = ecl_engine.recalculate_ecl(after)
+
+        for column in columns + [c for c in ('dpd_bucket',) if c in after.columns] + RESULT_COLUMNS:
+            self.df.iloc[rows, self.df.columns.get_loc(column)] = after[column].to_numpy()
+
+        self.allocation += stage_allocation(after) - stage_allocation(before)
+        if self.cube is not None:
+            self.cube.apply_delta(before, after)
+        return before, after
+
+    def add_loans(self, new_loans, rng=None):
+        """Append newly originated loans, running the full pipeline on them only"""
+        new_loans = ecl_engine.run_ecl_pipeline(portfolio_schema.compact(new_loans), rng)
+        self.df = pd.concat([self.df, new_loans[self.df.columns]], ignore_index=True)
+        if not self.df['loan_id'].is_monotonic_increasing:
+            self.df = self.df.sort_values('loan_id', ignore_index=True)
+        self.loan_ids = self.df['loan_id'].to_numpy()
+
+        self.allocation += stage_allocation(new_loans)
+        if self.cube is not None:
+            self.cube.apply_delta(after=new_loans)
+        return new_loans
+
+    def close_loans(self, loan_ids):
+        """Remove repaid or written-off loans from the snapshot and the totals"""
+        rows = self.positions(loan_ids)
+        closed = self.df.iloc[rows]
+        self.df = self.df.drop(index=self.df.index[rows]).reset_index(drop=True)
+        self.loan_ids = self.df['loan_id'].to_numpy()
+
+        self.allocation -= stage_allocation(closed)
+        if self.cube is not None:
+            self.cube.apply_delta(before=closed)
+        return closed
+
+    def totals(self):
+        """Portfolio totals and stage allocation from the running sums"""
+        counts, exposure, ecl = self.allocation[1:].T
+        return {
+            'loans': int(round(counts.sum())),
+            'exposure': exposure.sum(),
+            'ecl': ecl.sum(),
+            'coverage_ratio': ecl.sum() / exposure.sum() * 100,
+            'stage_allocation': pd.DataFrame({
+                'loans': counts.round().astype(np.int64),
+                'exposure': exposure,
+                'ecl': ecl,
+            }, index=pd.Index([1, 2, 3], name='ifrs9_stage')),
+        }
+
+    def verify(self, rtol=1e-9):
+        """Assert the incremental results equal a full recompute of the snapshot"""
+        full = ecl_engine.recalculate_ecl(self.df.copy())
+        for column in RESULT_COLUMNS:
+            np.testing.assert_array_equal(self.df[column].to_numpy(), full[column].to_numpy(),
+                                          err_msg=f"incremental {column} differs from full recompute")
+        np.testing.assert_allclose(self.allocation, stage_allocation(full), rtol=rtol, atol=1e-6,
+                                   err_msg="running totals differ from full recompute")
+        return True
+
+
+def read_changes(path):
+    """Read a change feed (CSV or Parquet) with loan_id and CHANGE_COLUMNS"""
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def synthetic_changes(df, n_changes, seed=0):
+    """Change feed moving DPD, score and balance for n_changes random loans"""
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(df), n_changes, replace=False))
+    changed = df.iloc[rows]
+    return pd.DataFrame({
+        'loan_id': changed['loan_id'].to_numpy(),
+        'days_past_due': rng.choice([0, 30, 60, 90, 120, 180], n_changes, p=[0.6, 0.2, 0.1, 0.05, 0.03, 0.02]),
+        'credit_score_current': (changed['credit_score_current'].to_numpy().astype(np.int64)
+                                 + rng.integers(-40, 41, n_changes)).clip(300, 850),
+        'outstanding_balance': (changed['outstanding_balance'].to_numpy() * 0.98).round(2),
+    })
+
+
+def benchmark(n_loans, n_changes, seed=42):
+    """Time an incremental close against a full recompute of the portfolio"""
+    import portfolio_generator
+
+    df = pd.concat(portfolio_generator.iter_portfolio_chunks(n_loans, seed=seed), ignore_index=True)
+    state = IncrementalECL(df)
+    changes = synthetic_changes(df, n_changes)
+
+    start = time.perf_counter()
+    state.apply_changes(changes)
+    state.totals()
+    incremental_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    full = ecl_engine.recalculate_ecl(state.df.copy())
+    stage_allocation(full)
+    full_seconds = time.perf_counter() - start
+
+    state.verify()
+    return full_seconds, incremental_seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental ECL from a loan-level change feed")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    apply_parser = subparsers.add_parser('apply', help="Apply a change feed to a snapshot")
+    apply_parser.add_argument('snapshot', help="Previous snapshot (CSV, Parquet or Feather)")
+    apply_parser.add_argument('changes', help="Change feed with loan_id and changed columns")
+    apply_parser.add_argument('--output', help="Write the updated snapshot here")
+    apply_parser.add_argument('--verify', action='store_true', help="Check against a full recompute")
+
+    bench_parser = subparsers.add_parser('benchmark', help="Incremental vs full recompute")
+    bench_parser.add_argument('--n-loans', type=int, default=5_000_000)
+    bench_parser.add_argument('--n-changes', type=int, default=50_000)
+
+    args = parser.parse_args()
+
+    if args.command == 'apply':
+        import portfolio_io
+
+        state = IncrementalECL(portfolio_io.read_portfolio(args.snapshot))
+        before_totals = state.totals()
+        before, after = state.apply_changes(read_changes(args.changes))
+        totals = state.totals()
+
+        print(f"Applied {len(after):,} loan changes "
+              f"({(before['ifrs9_stage'].to_numpy() != after['ifrs9_stage'].to_numpy()).sum():,} stage moves)")
+        print(f"  ECL: ${before_totals['ecl']:,.0f} → ${totals['ecl']:,.0f}")
+        print(totals['stage_allocation'].to_string(float_format=lambda v: f"{v:,.2f}"))
+        if args.verify:
+            state.verify()
+            print("✅ Incremental results match a full recompute")
+        if args.output:
+            portfolio_io.write_portfolio(state.df, args.output)
+            print(f"✅ Saved: {args.output}")
+
+    elif args.command == 'benchmark':
+        full_seconds, incremental_seconds = benchmark(args.n_loans, args.n_changes)
+        print(f"Month-end close on {args.n_loans:,} loans with {args.n_changes:,} changes (verified):")
+        print(f"  full recompute:  {full_seconds:8.3f}s")
+        print(f"  incremental:     {incremental_seconds:8.3f}s")
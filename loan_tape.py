@@ -0,0 +1,217 @@
+"""
+Memory-Mapped Loan Tape
+Binary on-disk snapshot format: one fixed-width .npy file per column of the
+compact schema plus a small JSON header. Readers memory-map the columns, so
+any number of analysis processes share a single page-cached copy with no
+parsing or deserialization.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import portfolio_schema
+
+HEADER_FILE = 'tape.json'
+TAPE_VERSION = 1
+
+CATEGORICAL_COLUMNS = {
+    'product_type': portfolio_schema.PRODUCT_DTYPE,
+    'industry_sector': portfolio_schema.SECTOR_DTYPE,
+    'geography': portfolio_schema.GEOGRAPHY_DTYPE,
+}
+CODE_DTYPE = np.int8
+
+
+def _column_file(path, column):
+    return os.path.join(path, f"{column}.npy")
+
+
+def _column_array(df, column):
+    """Fixed-width array stored for one column (categoricals as their codes)"""
+    if column in CATEGORICAL_COLUMNS:
+        return df[column].cat.codes.to_numpy().astype(CODE_DTYPE)
+    return df[column].to_numpy()
+
+
+def _write_header(path, columns, n_loans, reporting_date):
+    header = {
+        'version': TAPE_VERSION,
+        'n_loans': int(n_loans),
+        'reporting_date': str(pd.Timestamp(reporting_date).date()) if reporting_date is not None else None,
+        'columns': columns,
+        'categories': {c: list(CATEGORICAL_COLUMNS[c].categories) for c in columns if c in CATEGORICAL_COLUMNS},
+    }
+    with open(os.path.join(path, HEADER_FILE), 'w') as f:
+        json.dump(header, f, indent=2)
+
+
+def read_header(path):
+    """Tape metadata: row count, reporting date, columns and category dictionaries"""
+    with open(os.path.join(path, HEADER_FILE)) as f:
+        return json.load(f)
+
+
+def write_loan_tape(df, path):
+    """Write a portfolio frame (wide or compact) as a loan tape directory"""
+    df = portfolio_schema.compact(df)
+    os.makedirs(path, exist_ok=True)
+
+    for column in df.columns:
+        np.save(_column_file(path, column), _column_array(df, column))
+    _write_header(path, list(df.columns), len(df), df.attrs.get('reporting_date'))
+    return path
+
+
+def write_loan_tape_chunks(chunks, path, n_loans):
+    """Write compact chunks straight into preallocated memory-mapped columns"""
+    os.makedirs(path, exist_ok=True)
+    arrays = {}
+    offset = 0
+    reporting_date = None
+
+    for chunk in chunks:
+        chunk = portfolio_schema.compact(chunk)
+        if not arrays:
+            reporting_date = chunk.attrs.get('reporting_date')
+            for column in chunk.columns:
+                sample = _column_array(chunk.iloc[:1], column)
+                arrays[column] = np.lib.format.open_memmap(
+                    _column_file(path, column), mode='w+', dtype=sample.dtype, shape=(n_loans,))
+
+        end = offset + len(chunk)
+        for column, array in arrays.items():
+            array[offset:end] = _column_array(chunk, column)
+        offset = end
+
+    if offset != n_loans:
+        raise ValueError(f"Chunks held {offset:,} loans, expected {n_loans:,}")
+
+    for array in arrays.values():
+        array.flush()
+    _write_header(path, list(arrays), n_loans, reporting_date)
+    return path
+
+
+def open_loan_tape(path, columns=None):
+    """Memory-map a loan tape as a compact DataFrame without copying column data"""
+    header = read_header(path)
+    columns = header['columns'] if columns is None else columns
+
+    data = {}
+    for column in columns:
+        array = np.load(_column_file(path, column), mmap_mode='r')
+        if column in CATEGORICAL_COLUMNS:
+            dtype = pd.CategoricalDtype(header['categories'][column])
+            data[column] = pd.Categorical.from_codes(array, dtype=dtype, validate=False)
+        else:
+            data[column] = array
+
+    df = pd.DataFrame(data, copy=False)
+    df.attrs['schema'] = 'compact'
+    if header['reporting_date'] is not None:
+        df.attrs['reporting_date'] = pd.Timestamp(header['reporting_date'])
+    return df
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def _process_memory_mb():
+    """Peak RSS and current private (unshared) memory of this process in MB"""
+    import resource
+
+    # VmHWM is reset on exec; ru_maxrss would carry over the parent's peak
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    private = None
+    try:
+        with open('/proc/self/status') as f:
+            peak_rss = next(int(line.split()[1]) for line in f if line.startswith('VmHWM')) / 1024
+        with open('/proc/self/smaps_rollup') as f:
+            private = sum(int(line.split()[1]) for line in f
+                          if line.startswith(('Private_Clean', 'Private_Dirty'))) / 1024
+    except (OSError, StopIteration):
+        pass
+    return peak_rss, private
+
+
+def _probe(loader, path):
+    """Run in a fresh process: load the snapshot, run the staging summary, report"""
+    start = time.perf_counter()
+    if loader == 'csv':
+        df = pd.read_csv(path, keep_default_na=False)
+    elif loader == 'parquet':
+        import portfolio_io
+        df = portfolio_io.read_parquet(path)
+    else:
+        df = open_loan_tape(path)
+    load_seconds = time.perf_counter() - start
+
+    df.groupby('ifrs9_stage').agg({'outstanding_balance': 'sum', 'ecl_amount': 'sum'})
+    total_seconds = time.perf_counter() - start
+
+    peak_rss, private = _process_memory_mb()
+    print(json.dumps({'loader': loader, 'startup_s': load_seconds, 'staging_summary_s': total_seconds,
+                      'peak_rss_mb': peak_rss, 'private_mb': private}))
+
+
+def benchmark(n_loans, work_dir, seed=42):
+    """Compare startup time and memory of CSV, Parquet and the mapped tape"""
+    import portfolio_generator
+    import portfolio_io
+
+    os.makedirs(work_dir, exist_ok=True)
+    csv_file = os.path.join(work_dir, 'portfolio.csv')
+    parquet_file = os.path.join(work_dir, 'portfolio.parquet')
+    tape_dir = os.path.join(work_dir, 'portfolio.tape')
+
+    chunk_size = portfolio_generator.DEFAULT_CHUNK_SIZE
+    portfolio_generator.write_portfolio_stream(csv_file, n_loans, chunk_size, seed)
+    portfolio_generator.write_portfolio_stream(parquet_file, n_loans, chunk_size, seed)
+    write_loan_tape_chunks(portfolio_generator.iter_portfolio_chunks(n_loans, chunk_size, seed),
+                           tape_dir, n_loans)
+
+    results = []
+    for loader, path in (('csv', csv_file), ('parquet', parquet_file), ('tape', tape_dir)):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '_probe', loader, path],
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return pd.DataFrame(results).set_index('loader')
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == '_probe':
+        _probe(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Memory-mapped loan tape")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    write_parser = subparsers.add_parser('write', help="Convert a CSV/Parquet/Feather snapshot to a tape")
+    write_parser.add_argument('source')
+    write_parser.add_argument('tape')
+
+    bench_parser = subparsers.add_parser('benchmark', help="Startup time and RSS vs pd.read_csv")
+    bench_parser.add_argument('--n-loans', type=int, default=1_000_000)
+    bench_parser.add_argument('--work-dir', default='tape_benchmark')
+    bench_parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    if args.command == 'write':
+        import portfolio_io
+
+        write_loan_tape(portfolio_io.read_portfolio(args.source), args.tape)
+        print(f"✅ Wrote loan tape: {args.tape} ({read_header(args.tape)['n_loans']:,} loans)")
+
+    elif args.command == 'benchmark':
+        print(f"Loading a {args.n_loans:,}-loan snapshot in a fresh process:")
+        report = benchmark(args.n_loans, args.work_dir, args.seed)
+        print(report.to_string(float_format=lambda v: f"{v:,.3f}"))
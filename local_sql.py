@@ -0,0 +1,192 @@
+"""
+Local SQL Engine
+Runs the BigQuery query library (sql_queries.sql) and the notebook's
+client.query(...) calls against a local portfolio file with DuckDB, so the
+analytics can be developed offline and in CI. Fully qualified BigQuery table
+names such as `{project_id}.{dataset_id}.loan_portfolio` resolve to a local
+view over Parquet, CSV or an in-memory DataFrame.
+"""
+
+import argparse
+import os
+import re
+import time
+
+import duckdb
+import pandas as pd
+
+import portfolio_schema
+
+QUERY_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql_queries.sql')
+TABLE_ID = 'loan_portfolio'
+
+# `project.dataset.table` (placeholders or real names) -> table
+_QUALIFIED_TABLE = re.compile(r"`(?:[^`.]+\.)*([^`.]+)`")
+_SECTION = re.compile(r"^--\s*(\d+)\.\s*(.+?)\s*$")
+
+
+def to_local_sql(sql):
+    """Translate a BigQuery statement for DuckDB (table references and quoting)"""
+    return _QUALIFIED_TABLE.sub(r'\1', sql)
+
+
+def _slug(text):
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+def load_query_library(path=QUERY_LIBRARY):
+    """Named statements from sql_queries.sql, in file order
+
+    Each statement is named after the first comment line above it and tagged
+    with its numbered section.
+    """
+    queries = []
+    section = None
+    name = None
+    statement = []
+    with open(path) as f:
+        for line in f:
+            stripped = line.strip()
+            if not statement and stripped.startswith('--'):
+                text = stripped.lstrip('-').strip()
+                match = _SECTION.match(stripped)
+                if match:
+                    section = match.group(2).title()
+                    name = None
+                elif text and not set(text) <= {'='} and name is None:
+                    name = text
+                continue
+            if not statement and not stripped:
+                continue
+
+            statement.append(line)
+            if stripped.endswith(';'):
+                sql = ''.join(statement).strip().rstrip(';')
+                queries.append({'key': _slug(name or f'query {len(queries) + 1}'), 'name': name,
+                                'section': section, 'sql': sql})
+                name = None
+                statement = []
+    return queries
+
+
+class LocalQueryJob:
+    """Result handle with the parts of bigquery.QueryJob the notebook uses"""
+
+    def __init__(self, connection, sql):
+        self._connection = connection
+        self.query = sql
+
+    def result(self):
+        return self
+
+    def to_dataframe(self):
+        return self._connection.execute(self.query).df()
+
+
+class LocalClient:
+    """Drop-in for bigquery.Client.query(), backed by an in-process DuckDB database"""
+
+    def __init__(self, source=None, project=None, table_id=TABLE_ID):
+        self.project = project
+        self.connection = duckdb.connect()
+        if source is not None:
+            self.register(source, table_id)
+
+    def register(self, source, table_id=TABLE_ID):
+        """Expose a Parquet/CSV file (or glob), or a DataFrame, as a table"""
+        if isinstance(source, pd.DataFrame):
+            self.connection.register(f'{table_id}_frame', portfolio_schema.expand(source))
+            relation = f'{table_id}_frame'
+        elif source.endswith('.parquet') or os.path.isdir(source):
+            pattern = os.path.join(source, '**', '*.parquet') if os.path.isdir(source) else source
+            relation = f"read_parquet('{pattern}', hive_partitioning = true)"
+        elif source.endswith('.csv'):
+            relation = f"read_csv_auto('{source}')"
+        else:
+            raise ValueError(f"Unsupported local source: {source}")
+        self.connection.execute(f"CREATE OR REPLACE VIEW {table_id} AS SELECT * FROM {relation}")
+        return self
+
+    def query(self, sql):
+        return LocalQueryJob(self.connection, to_local_sql(sql))
+
+
+def run_library(client, queries=None):
+    """Run every library statement; returns {key: (DataFrame, seconds)}"""
+    results = {}
+    for query in queries or load_query_library():
+        start = time.perf_counter()
+        result = client.query(query['sql']).to_dataframe()
+        results[query['key']] = (result, time.perf_counter() - start)
+    return results
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+# Library statements matching the notebook's pandas summary tables
+NOTEBOOK_QUERIES = ['ecl_by_ifrs_9_stage', 'ecl_by_product_type', 'distribution_by_credit_score_bands',
+                    'ecl_by_vintage_origination_year', 'ecl_by_geography']
+
+
+def benchmark(n_loans, work_dir, seed=42):
+    """Notebook pandas tables (load + groupbys) vs the same tables as local SQL"""
+    import aggregation
+    import portfolio_generator
+    import portfolio_io
+
+    os.makedirs(work_dir, exist_ok=True)
+    parquet_file = os.path.join(work_dir, 'portfolio.parquet')
+    portfolio_generator.write_portfolio_stream(parquet_file, n_loans, seed=seed)
+
+    start = time.perf_counter()
+    df = portfolio_io.read_parquet(parquet_file)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    aggregation.notebook_summaries(df)
+    pandas_seconds = time.perf_counter() - start
+    del df
+
+    library = run_library(LocalClient(parquet_file))
+    sql_seconds = sum(library[key][1] for key in NOTEBOOK_QUERIES)
+
+    timings = pd.DataFrame({'seconds': {key: seconds for key, (_, seconds) in library.items()}})
+    return load_seconds, pandas_seconds, sql_seconds, timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run sql_queries.sql locally with DuckDB")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help="List the query library")
+
+    run_parser = subparsers.add_parser('run', help="Run library queries against a local file")
+    run_parser.add_argument('source', help="Portfolio Parquet/CSV file or Parquet directory")
+    run_parser.add_argument('--query', nargs='+', help="Query keys to run (default: all)")
+    run_parser.add_argument('--rows', type=int, default=10, help="Rows to print per result")
+
+    bench_parser = subparsers.add_parser('benchmark', help="Local SQL latency vs the notebook's pandas path")
+    bench_parser.add_argument('--n-loans', type=int, default=1_000_000)
+    bench_parser.add_argument('--work-dir', default='sql_benchmark')
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for query in load_query_library():
+            print(f"{query['key']:<45} {query['section']}")
+
+    elif args.command == 'run':
+        queries = [q for q in load_query_library() if not args.query or q['key'] in args.query]
+        client = LocalClient(args.source)
+        for key, (result, seconds) in run_library(client, queries).items():
+            print(f"\n── {key} ({len(result):,} rows, {seconds * 1000:.1f} ms)")
+            print(result.head(args.rows).to_string(index=False))
+
+    elif args.command == 'benchmark':
+        load_seconds, pandas_seconds, sql_seconds, timings = benchmark(args.n_loans, args.work_dir)
+        print(f"Notebook summary tables over {args.n_loans:,} loans:")
+        print(f"  pandas: load {load_seconds:.3f}s + groupbys {pandas_seconds:.3f}s = {load_seconds + pandas_seconds:.3f}s")
+        print(f"  DuckDB over Parquet ({len(NOTEBOOK_QUERIES)} queries): {sql_seconds:.3f}s")
+        print("\nFull query library latency:")
+        print((timings * 1000).round(1).rename(columns={'seconds': 'ms'}).to_string())
@@ -0,0 +1,301 @@
+"""
+Portfolio Analytics
+The notebook's analysis as an importable object. Each step (loan data,
+summary tables, watchlist, charts, exports) is computed on first access and
+memoized, and pandas, plotly and the BigQuery clients are only imported by
+the steps that need them. The CLI runs just the requested sections, so a
+summary table can be printed without loading plotly or the loan-level data.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from functools import cached_property
+
+import profiler
+
+_START = time.perf_counter()
+
+DEFAULT_TABLE = 'ifrs9-analytics.credit_risk_ifrs9.loan_portfolio'
+DEFAULT_REPORTING_DATE = '2024-12-31'
+
+WATCHLIST_COLUMNS = ['loan_id', 'product_type', 'outstanding_balance', 'ecl_amount', 'ecl_rate',
+                     'ifrs9_stage', 'days_past_due']
+
+EXPORT_FILES = ('portfolio_summary.csv', 'high_risk_watchlist.csv', 'product_risk_analysis.csv')
+
+
+def credit_band(scores):
+    """Credit quality band of each current credit score (same bands as the summaries)"""
+    import aggregation
+    import pandas as pd
+    return pd.cut(scores, bins=list(aggregation.CREDIT_BAND_EDGES), labels=aggregation.CREDIT_BANDS)
+
+
+def key_correlations(correlation_matrix, n=5):
+    """Strongest off-diagonal correlations"""
+    pairs = correlation_matrix.unstack()
+    return pairs[pairs < 1].sort_values(ascending=False).head(n)
+
+
+class PortfolioAnalytics:
+    """IFRS 9 analysis of one portfolio snapshot, each step computed lazily and memoized
+
+    ``location`` is a local portfolio file, a saved summary cube (.npz, summary
+    tables only) or 'project.dataset.table'; it defaults to $IFRS9_LOCAL_DATA,
+    then the production BigQuery table.
+    """
+
+    def __init__(self, location=None, project=None, reporting_date=DEFAULT_REPORTING_DATE):
+        self.location = location or os.environ.get('IFRS9_LOCAL_DATA') or DEFAULT_TABLE
+        self.project = project
+        self.reporting_date = reporting_date
+
+    def computed(self):
+        """Names of the steps computed so far"""
+        steps = {'source': 'source', '_loaded': 'loans', 'summaries': 'summaries', 'high_risk': 'high_risk',
+                 'watchlist': 'watchlist', 'figures': 'figures'}
+        return [name for attribute, name in steps.items() if attribute in self.__dict__]
+
+    @cached_property
+    def source(self):
+        """data_source backend for the location"""
+        import data_source
+        if self.location.endswith('.npz'):
+            raise ValueError(f"{self.location} is a summary cube; it has no loan-level data")
+        return data_source.open_source(self.location, project=self.project)
+
+    @cached_property
+    def reporting_filter(self):
+        import data_source
+        return data_source.stage_filter(self.reporting_date)
+
+    @cached_property
+    @profiler.profiled('analytics.loans', rows=lambda result, args: len(result[0]))
+    def _loaded(self):
+        import data_source
+        import portfolio_schema
+        wide = self.source.read(data_source.ANALYTICS_COLUMNS, self.reporting_filter)
+        loans = portfolio_schema.compact(wide)
+        return loans, portfolio_schema.memory_report(wide, loans)
+
+    @property
+    def loans(self):
+        """Analysis columns of every loan at the reporting date (compact schema)"""
+        return self._loaded[0]
+
+    @property
+    def memory(self):
+        """Memory footprint of the loans, wide vs compact schema"""
+        return self._loaded[1]
+
+    @cached_property
+    @profiler.profiled('analytics.summaries', rows=lambda result, args: result['totals']['Total_Loans'])
+    def summaries(self):
+        """aggregation.compute_summaries tables, from a cube, the loaded loans or one streaming scan"""
+        import aggregation
+        if self.location.endswith('.npz'):
+            import summary_cube
+            return summary_cube.SummaryCube.load(self.location).summaries()
+        if '_loaded' in self.__dict__:
+            return aggregation.compute_summaries(self.loans)
+
+        import data_source
+        return aggregation.compute_summaries(
+            self.source.iter_chunks(data_source.SUMMARY_COLUMNS, self.reporting_filter))
+
+    @cached_property
+    @profiler.profiled('analytics.high_risk')
+    def high_risk(self):
+        """Stage 3 or high ECL-rate loans, all columns plus credit band and vintage year"""
+        import pandas as pd
+
+        import portfolio_schema
+        import watchlist
+        # Only the flagged rows are fetched: the risk filter is pushed down to the source
+        high_risk_filter = [self.reporting_filter + [('ifrs9_stage', '=', 3)],
+                            self.reporting_filter + [('ecl_rate', '>', watchlist.HIGH_RISK_ECL_RATE)]]
+        high_risk = portfolio_schema.compact(self.source.read(filters=high_risk_filter))
+        high_risk['credit_band'] = credit_band(high_risk['credit_score_current'])
+        high_risk['vintage_year'] = pd.to_datetime(high_risk['origination_date']).dt.year
+        return high_risk
+
+    @cached_property
+    @profiler.profiled('analytics.watchlist')
+    def watchlist(self):
+        """watchlist.Watchlist over the high-risk loans"""
+        import watchlist
+        return watchlist.Watchlist(self.high_risk)
+
+    @cached_property
+    @profiler.profiled('analytics.figures', rows=lambda result, args: None)
+    def figures(self):
+        """Chart name -> Plotly figure (report_renderer builders)"""
+        import report_renderer
+        return {name: builder(self.summaries[table])
+                for name, (builder, table, _, _) in report_renderer.CHARTS.items()}
+
+    def summary_stats(self):
+        """One-row portfolio summary for portfolio_summary.csv"""
+        from datetime import datetime
+
+        import pandas as pd
+        totals = self.summaries['totals']
+        keys = ['Total_Loans', 'Total_Exposure', 'Total_ECL', 'Coverage_Ratio', 'Stage_1_Count',
+                'Stage_2_Count', 'Stage_3_Count', 'Avg_Credit_Score']
+        stats = {key: totals[key] for key in keys}
+        stats['Analysis_Date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return pd.DataFrame([stats])
+
+    @profiler.profiled('analytics.export', rows=lambda result, args: len(args[0].high_risk))
+    def export(self, output_dir='.'):
+        """Write the portfolio summary, high-risk watchlist and product analysis CSVs"""
+        import portfolio_schema
+        os.makedirs(output_dir, exist_ok=True)
+        paths = [os.path.join(output_dir, name) for name in EXPORT_FILES]
+        self.summary_stats().to_csv(paths[0], index=False)
+        portfolio_schema.expand(self.watchlist.ranked()).to_csv(paths[1], index=False)
+        self.summaries['product_analysis'].to_csv(paths[2])
+        return paths
+
+
+# =============================================================================
+# CLI SECTIONS
+# =============================================================================
+
+def _print_table(title, table):
+    print(f"\n📊 {title}:")
+    print(table)
+
+
+def _loans_section(analysis, args):
+    memory = analysis.memory.loc['TOTAL']
+    print(f"\n✅ {len(analysis.loans):,} loans, {len(analysis.loans.columns)} columns, "
+          f"{memory['compact_bytes'] / 1e6:,.1f} MB ({memory['reduction_%']:.0f}% smaller than wide)")
+    print(analysis.loans.head())
+
+
+def _summary_section(analysis, args):
+    totals = analysis.summaries['totals']
+    print("\n💰 Portfolio Summary:")
+    print(f"Total Loans: {totals['Total_Loans']:,}")
+    print(f"Total Exposure: ${totals['Total_Exposure']:,.2f}")
+    print(f"Total ECL: ${totals['Total_ECL']:,.2f}")
+    print(f"Average ECL Rate: {totals['Avg_ECL_Rate']:.2f}%")
+    print(f"Coverage Ratio: {totals['Coverage_Ratio']:.2f}%")
+
+
+def _correlation_section(analysis, args):
+    _print_table("Key Correlations", key_correlations(analysis.summaries['correlation_matrix']))
+
+
+def _watchlist_section(analysis, args):
+    high_risk = analysis.high_risk
+    print(f"\n⚠️ High-Risk Loans Identified: {len(high_risk)}")
+    print(f"   Total Exposure: ${high_risk['outstanding_balance'].sum():,.2f}")
+    print(f"   Total ECL: ${high_risk['ecl_amount'].sum():,.2f}")
+    print(f"\n📋 Top {args.top} High-Risk Loans:")
+    print(analysis.watchlist.top(args.top, columns=WATCHLIST_COLUMNS).to_string(index=False))
+
+
+def _charts_section(analysis, args):
+    import report_renderer
+    status = report_renderer.render_report(analysis.summaries, args.output_dir, formats=('html',))
+    print(f"\n✅ Charts: {os.path.join(args.output_dir, report_renderer.BUNDLE_FILE)} "
+          f"({sum(state == 'rendered' for state in status.values())} re-rendered)")
+
+
+def _export_section(analysis, args):
+    for path in analysis.export(args.output_dir):
+        print(f"✅ Saved: {path}")
+
+
+def _table_section(title, table):
+    return lambda analysis, args: _print_table(title, analysis.summaries[table])
+
+
+# Notebook steps, in notebook order
+SECTIONS = {
+    'loans': _loans_section,
+    'summary': _summary_section,
+    'staging': _table_section("IFRS 9 Staging Distribution", 'staging_summary'),
+    'product': _table_section("Product Risk Metrics", 'product_analysis'),
+    'credit': _table_section("Credit Quality Distribution", 'credit_summary'),
+    'correlation': _correlation_section,
+    'vintage': _table_section("Vintage Performance", 'vintage_summary'),
+    'geography': _table_section("Geographic Distribution", 'geo_summary'),
+    'watchlist': _watchlist_section,
+    'charts': _charts_section,
+    'export': _export_section,
+}
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def benchmark(location, sections=('summary', 'staging', 'watchlist', 'charts'), output_dir='analytics_benchmark'):
+    """Wall time of a fresh process per section, against running the whole notebook script"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    output_dir = os.path.abspath(output_dir)
+    env = dict(os.environ, IFRS9_LOCAL_DATA=os.path.abspath(location), PYTHONPATH=here)
+
+    def wall_time(command, cwd=here):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+    timings = {'python startup': wall_time([sys.executable, '-c', 'pass']),
+               'import pandas': wall_time([sys.executable, '-c', 'import pandas'])}
+    for section in sections:
+        timings[section] = wall_time([sys.executable, os.path.abspath(__file__), 'run', section,
+                                      '--output-dir', output_dir])
+    os.makedirs(output_dir, exist_ok=True)
+    # The notebook writes its CSVs to the working directory; fig.show() is disabled (no display)
+    timings['whole notebook'] = wall_time(
+        [sys.executable, '-c', "import plotly.basedatatypes as b; b.BaseFigure.show = lambda *a, **k: None; "
+                               f"exec(open({os.path.join(here, 'ifrs9_plotly_notebook.py')!r}).read())"],
+        cwd=output_dir)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IFRS 9 portfolio analytics, section by section")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Compute and print the requested sections")
+    run_parser.add_argument('sections', nargs='*', choices=list(SECTIONS), default=['summary'], metavar='SECTION',
+                            help=f"One or more of: {', '.join(SECTIONS)} (default: summary)")
+    run_parser.add_argument('--source', help="Portfolio file, summary cube (.npz) or project.dataset.table "
+                                             "(default: $IFRS9_LOCAL_DATA, then the BigQuery table)")
+    run_parser.add_argument('--project')
+    run_parser.add_argument('--reporting-date', default=DEFAULT_REPORTING_DATE)
+    run_parser.add_argument('--output-dir', default='.', help="Where charts and exports are written")
+    run_parser.add_argument('--top', type=int, default=10, help="Watchlist loans to show")
+    run_parser.add_argument('--profile', metavar='REPORT_JSON', help="Record stage timings to a run report")
+
+    bench_parser = subparsers.add_parser('benchmark', help="Single-section startup vs the whole notebook")
+    bench_parser.add_argument('source', help="Local portfolio file")
+    bench_parser.add_argument('--output-dir', default='analytics_benchmark')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        if args.profile:
+            profiler.enable()
+        analysis = PortfolioAnalytics(args.source, args.project, args.reporting_date)
+        for section in dict.fromkeys(args.sections):
+            with profiler.stage(f"section.{section}"):
+                SECTIONS[section](analysis, args)
+        print(f"\n⏱️ {', '.join(dict.fromkeys(args.sections))} in {time.perf_counter() - _START:.2f}s "
+              f"(computed: {', '.join(analysis.computed()) or 'nothing'})")
+        if args.profile:
+            print(f"✅ Saved: {profiler.write_json(args.profile)}")
+
+    elif args.command == 'benchmark':
+        timings = benchmark(args.source, output_dir=args.output_dir)
+        print(f"Fresh-process wall time over {args.source}:")
+        for label, seconds in timings.items():
+            print(f"  {label:<16} {seconds:8.3f}s")
@@ -0,0 +1,413 @@
+"""
+Batched Synthetic Portfolio Generator
+Vectorized version of generate_sample_data.generate_loan_portfolio built on
+numpy.random.Generator: every column is drawn in one call (per product group
+where the distribution depends on the product).
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import ecl_engine
+import portfolio_io
+import portfolio_schema
+import profiler
+from portfolio_schema import PRODUCT_TYPES, REGIONS, SECTORS, format_loan_ids
+
+REPORTING_DATE = np.datetime64('2024-12-31', 'D')
+
+# Product mix and per-product parameters, in portfolio_schema.PRODUCT_TYPES order
+PRODUCT_WEIGHTS = [0.35, 0.25, 0.20, 0.15, 0.05]
+AMOUNT_LOG_MEAN = np.array([12.5, 9.5, 10.3, 8.5, 11.5])
+AMOUNT_LOG_SIGMA = np.array([0.5, 0.6, 0.4, 0.5, 0.7])
+BASE_RATE = np.array([4.5, 9.0, 6.5, 18.0, 7.5])
+SME_CODE = PRODUCT_TYPES.index('SME Loan')
+
+REGION_WEIGHTS = [0.25, 0.20, 0.20, 0.20, 0.15]
+
+DPD_VALUES = np.array([0, 30, 60, 90, 120, 180])
+DPD_WEIGHTS = [0.85, 0.08, 0.03, 0.02, 0.01, 0.01]
+
+DEFAULT_CHUNK_SIZE = 250_000
+
+
+@profiler.profiled('generate_loan_portfolio')
+def generate_loan_portfolio_batched(n_loans=5000, seed=42, rng=None, first_loan_id=1,
+                                    reporting_date=REPORTING_DATE, compact=False, product_weights=None):
+    """Generate synthetic loan portfolio data with batched draws
+
+    Same schema and distributions as generate_loan_portfolio. Pass ``rng`` to
+    draw from an existing numpy.random.Generator instead of seeding one, and
+    ``first_loan_id`` to number a slice of a larger book. With ``compact=True``
+    the frame is built directly in the portfolio_schema compact layout.
+    ``product_weights`` overrides PRODUCT_WEIGHTS (PRODUCT_TYPES order).
+    """
+    rng = np.random.default_rng(seed) if rng is None else rng
+    reporting_date = np.datetime64(reporting_date, 'D')
+
+    # Product types as codes into PRODUCT_TYPES
+    codes = rng.choice(len(PRODUCT_TYPES), n_loans,
+                       p=PRODUCT_WEIGHTS if product_weights is None else product_weights)
+    groups = [np.flatnonzero(codes == k) for k in range(len(PRODUCT_TYPES))]
+
+    # Origination dates (between 1-5 years ago)
+    days_ago = rng.integers(365, 1825, n_loans)
+    origination_dates = reporting_date - days_ago.astype('timedelta64[D]')
+
+    # Original loan amounts, one lognormal draw per product group
+    original_amounts = np.empty(n_loans)
+    for k, idx in enumerate(groups):
+        original_amounts[idx] = rng.lognormal(AMOUNT_LOG_MEAN[k], AMOUNT_LOG_SIGMA[k], len(idx))
+
+    # Current outstanding balance (EAD), linear amortization over 5 years
+    amort_factor = np.maximum(0.3, 1 - (days_ago / 30) / 60)
+    outstanding_balances = original_amounts * amort_factor * rng.uniform(0.85, 1.0, n_loans)
+
+    # Credit scores at origination and today
+    credit_scores_orig = rng.normal(680, 80, n_loans).clip(300, 850)
+    credit_scores_current = (credit_scores_orig + rng.normal(0, 30, n_loans)).clip(300, 850)
+
+    # Days past due (DPD)
+    dpd_distribution = DPD_VALUES[rng.choice(len(DPD_VALUES), n_loans, p=DPD_WEIGHTS)]
+
+    # Interest rates: product base rate plus credit score risk premium
+    risk_premium = (750 - credit_scores_orig) / 100 * 0.5
+    interest_rates = np.maximum(
+        2.0, BASE_RATE[codes] + risk_premium + rng.uniform(-0.5, 0.5, n_loans)
+    )
+
+    # Industry sector (for SME loans)
+    sector_codes = np.full(n_loans, len(SECTORS) - 1)
+    sector_codes[groups[SME_CODE]] = rng.integers(0, len(SECTORS) - 1, len(groups[SME_CODE]))
+
+    # Geography
+    region_codes = rng.choice(len(REGIONS), n_loans, p=REGION_WEIGHTS)
+
+    loan_numbers = np.arange(first_loan_id, first_loan_id + n_loans)
+    credit_scores_orig = credit_scores_orig.round(0)
+    credit_scores_current = credit_scores_current.round(0)
+
+    if compact:
+        df = pd.DataFrame({
+            'loan_id': loan_numbers,
+            'product_type': pd.Categorical.from_codes(codes, dtype=portfolio_schema.PRODUCT_DTYPE),
+            'origination_date': origination_dates,
+            'original_amount': original_amounts.round(2),
+            'outstanding_balance': outstanding_balances.round(2),
+            'credit_score_origination': credit_scores_orig,
+            'credit_score_current': credit_scores_current,
+            'days_past_due': dpd_distribution,
+            'dpd_bucket': portfolio_schema.dpd_bucket(dpd_distribution),
+            'interest_rate': interest_rates.round(2),
+            'industry_sector': pd.Categorical.from_codes(sector_codes, dtype=portfolio_schema.SECTOR_DTYPE),
+            'geography': pd.Categorical.from_codes(region_codes, dtype=portfolio_schema.GEOGRAPHY_DTYPE),
+        })
+        df.attrs['schema'] = 'compact'
+        df.attrs['reporting_date'] = pd.Timestamp(reporting_date)
+        return portfolio_schema.apply_dtypes(df)
+
+    df = pd.DataFrame({
+        'loan_id': format_loan_ids(loan_numbers),
+        'reporting_date': np.full(n_loans, reporting_date),
+        'product_type': np.array(PRODUCT_TYPES)[codes],
+        'origination_date': origination_dates,
+        'original_amount': original_amounts.round(2),
+        'outstanding_balance': outstanding_balances.round(2),
+        'credit_score_origination': credit_scores_orig.astype(np.int64),
+        'credit_score_current': credit_scores_current.astype(np.int64),
+        'days_past_due': dpd_distribution,
+        'interest_rate': interest_rates.round(2),
+        'industry_sector': np.array(SECTORS)[sector_codes],
+        'geography': np.array(REGIONS)[region_codes],
+    })
+
+    return df
+
+
+# =============================================================================
+# CHUNKED STREAMING GENERATION
+# =============================================================================
+
+def chunk_rng(seed, chunk_index):
+    """Independent Generator for one chunk, derived from (seed, chunk_index)
+
+    Equivalent to ``SeedSequence(seed).spawn(n)[chunk_index]``, so any chunk can
+    be regenerated on its own without drawing the chunks before it.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(chunk_index,)))
+
+
+def generate_chunk(chunk_index, n_loans, chunk_size=DEFAULT_CHUNK_SIZE, seed=42,
+                   reporting_date=REPORTING_DATE, product_weights=None):
+    """Generate one chunk of the book (compact schema) and run PD/LGD, staging and ECL on it"""
+    first = chunk_index * chunk_size
+    size = min(chunk_size, n_loans - first)
+    if size <= 0:
+        raise ValueError(f"Chunk {chunk_index} is outside a {n_loans:,}-loan portfolio")
+
+    rng = chunk_rng(seed, chunk_index)
+    df = generate_loan_portfolio_batched(size, rng=rng, first_loan_id=first + 1,
+                                         reporting_date=reporting_date, compact=True,
+                                         product_weights=product_weights)
+    return ecl_engine.run_ecl_pipeline(df, rng)
+
+
+def n_chunks(n_loans, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Number of chunks needed to cover n_loans"""
+    return -(-n_loans // chunk_size)
+
+
+def iter_portfolio_chunks(n_loans, chunk_size=DEFAULT_CHUNK_SIZE, seed=42,
+                          reporting_date=REPORTING_DATE, product_weights=None):
+    """Yield the portfolio as fixed-size, fully calculated DataFrame chunks"""
+    for chunk_index in range(n_chunks(n_loans, chunk_size)):
+        yield generate_chunk(chunk_index, n_loans, chunk_size, seed, reporting_date, product_weights)
+
+
+def summarise_chunk(chunk):
+    """Additive portfolio totals for one calculated chunk"""
+    return {
+        'loans': len(chunk),
+        'exposure': chunk['outstanding_balance'].sum(),
+        'ecl': chunk['ecl_amount'].sum(),
+        'stage_counts': np.bincount(chunk['ifrs9_stage'], minlength=4)[1:4],
+    }
+
+
+def merge_totals(chunk_totals):
+    """Combine per-chunk totals (in chunk order) into portfolio totals"""
+    totals = {'loans': 0, 'exposure': 0.0, 'ecl': 0.0}
+    stage_counts = np.zeros(3, dtype=np.int64)
+    for chunk in chunk_totals:
+        totals['loans'] += chunk['loans']
+        totals['exposure'] += chunk['exposure']
+        totals['ecl'] += chunk['ecl']
+        stage_counts += chunk['stage_counts']
+
+    totals['stage_counts'] = dict(zip([1, 2, 3], stage_counts.tolist()))
+    return totals
+
+
+def write_portfolio_stream(output_file, n_loans, chunk_size=DEFAULT_CHUNK_SIZE, seed=42):
+    """Stream the portfolio to one CSV or Parquet file, holding only one chunk in memory"""
+    chunk_totals = []
+    chunks = iter_portfolio_chunks(n_loans, chunk_size, seed)
+
+    if output_file.endswith('.parquet'):
+        with portfolio_io.ParquetChunkWriter(output_file) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+                chunk_totals.append(summarise_chunk(chunk))
+    else:
+        for chunk_index, chunk in enumerate(chunks):
+            portfolio_schema.expand(chunk).to_csv(output_file, mode='w' if chunk_index == 0 else 'a',
+                                                  header=chunk_index == 0, index=False)
+            chunk_totals.append(summarise_chunk(chunk))
+
+    return merge_totals(chunk_totals)
+
+
+# =============================================================================
+# PARALLEL SHARDED GENERATION
+# =============================================================================
+
+def _run_shard(task):
+    """Worker: generate and calculate one loan-ID range, optionally writing it out"""
+    shard_index, n_loans, shard_size, seed, shard_file = task
+    shard = generate_chunk(shard_index, n_loans, shard_size, seed)
+    if shard_file is None:
+        return shard
+
+    portfolio_io.write_portfolio(shard, shard_file)
+    return summarise_chunk(shard)
+
+
+def _shard_tasks(n_loans, shard_size, seed, shard_dir=None, extension='.csv'):
+    """One task per loan-ID range; shards are fixed by shard_size, never by worker count"""
+    tasks = []
+    for shard_index in range(n_chunks(n_loans, shard_size)):
+        shard_file = None if shard_dir is None else os.path.join(shard_dir, f"shard_{shard_index:06d}{extension}")
+        tasks.append((shard_index, n_loans, shard_size, seed, shard_file))
+    return tasks
+
+
+def generate_portfolio_parallel(n_loans, n_workers=None, shard_size=DEFAULT_CHUNK_SIZE, seed=42):
+    """Generate and calculate the book across a process pool and merge the shards
+
+    Shard i draws from the i-th child of SeedSequence(seed).spawn(), see
+    chunk_rng, so the merged result is identical for any worker count.
+    """
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        shards = list(pool.map(_run_shard, _shard_tasks(n_loans, shard_size, seed)))
+    return pd.concat(shards, ignore_index=True)
+
+
+def merge_csv_shards(shard_files, output_file):
+    """Concatenate shard CSVs in order, keeping only the first header"""
+    with open(output_file, 'wb') as out:
+        for i, shard_file in enumerate(shard_files):
+            with open(shard_file, 'rb') as src:
+                if i > 0:
+                    src.readline()
+                shutil.copyfileobj(src, out)
+
+
+def write_portfolio_parallel(output_file, n_loans, n_workers=None, shard_size=DEFAULT_CHUNK_SIZE,
+                             seed=42):
+    """Write shards from a process pool, then merge them into one CSV or Parquet file"""
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    extension = os.path.splitext(output_file)[1].lower()
+    shard_dir = tempfile.mkdtemp(prefix='shards_', dir=output_dir)
+    try:
+        tasks = _shard_tasks(n_loans, shard_size, seed, shard_dir, extension)
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            shard_totals = list(pool.map(_run_shard, tasks))
+
+        shard_files = [task[-1] for task in tasks]
+        if extension == '.parquet':
+            portfolio_io.merge_parquet_shards(shard_files, output_file)
+        else:
+            merge_csv_shards(shard_files, output_file)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    return merge_totals(shard_totals)
+
+
+def scaling_report(n_loans, max_workers=None, shard_size=DEFAULT_CHUNK_SIZE, seed=42):
+    """Throughput of the parallel pipeline from 1 to max_workers workers"""
+    max_workers = max_workers or os.cpu_count()
+    worker_counts = sorted({1, max_workers} | {2 ** k for k in range(1, max_workers.bit_length())
+                                               if 2 ** k < max_workers})
+
+    results = []
+    reference = None
+    for n_workers in worker_counts:
+        start = time.perf_counter()
+        df = generate_portfolio_parallel(n_loans, n_workers, shard_size, seed)
+        elapsed = time.perf_counter() - start
+
+        # Results must not depend on the number of workers
+        if reference is None:
+            reference = df
+        else:
+            pd.testing.assert_frame_equal(df, reference, check_exact=True)
+
+        results.append({'workers': n_workers, 'seconds': elapsed, 'rows_per_sec': n_loans / elapsed})
+
+    report = pd.DataFrame(results)
+    report['speedup'] = report['seconds'].iloc[0] / report['seconds']
+    report['efficiency'] = report['speedup'] / report['workers']
+    return report
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def benchmark(sizes, seed=42, legacy_max=50_000):
+    """Report rows/second for the batched generator (and legacy for small sizes)"""
+    import generate_sample_data as legacy
+
+    results = []
+    for n_loans in sizes:
+        start = time.perf_counter()
+        df = generate_loan_portfolio_batched(n_loans, seed=seed)
+        elapsed = time.perf_counter() - start
+        del df
+
+        row = {'n_loans': n_loans, 'seconds': elapsed, 'rows_per_sec': n_loans / elapsed}
+        line = f"{n_loans:>12,} loans: {elapsed:8.3f}s  {n_loans / elapsed:>14,.0f} rows/s"
+
+        if n_loans <= legacy_max:
+            start = time.perf_counter()
+            legacy.generate_loan_portfolio(n_loans)
+            legacy_elapsed = time.perf_counter() - start
+            row['legacy_rows_per_sec'] = n_loans / legacy_elapsed
+            line += f"  (legacy {n_loans / legacy_elapsed:,.0f} rows/s)"
+
+        results.append(row)
+        print(line)
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched portfolio generation")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    bench_parser = subparsers.add_parser('benchmark', help="Report generator rows/sec")
+    bench_parser.add_argument('--sizes', type=int, nargs='+', default=[5000, 1_000_000, 10_000_000])
+    bench_parser.add_argument('--seed', type=int, default=42)
+
+    stream_parser = subparsers.add_parser('stream', help="Write a calculated book chunk by chunk")
+    stream_parser.add_argument('--n-loans', type=int, required=True)
+    stream_parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    stream_parser.add_argument('--seed', type=int, default=42)
+    stream_parser.add_argument('--output', default='loan_portfolio_data.csv',
+                               help="Output file (.csv or .parquet)")
+
+    parallel_parser = subparsers.add_parser('parallel', help="Write a calculated book from a process pool")
+    parallel_parser.add_argument('--n-loans', type=int, required=True)
+    parallel_parser.add_argument('--workers', type=int, default=None)
+    parallel_parser.add_argument('--shard-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parallel_parser.add_argument('--seed', type=int, default=42)
+    parallel_parser.add_argument('--output', default='loan_portfolio_data.csv',
+                                 help="Output file (.csv or .parquet)")
+
+    scaling_parser = subparsers.add_parser('scaling', help="Report throughput from 1 to N workers")
+    scaling_parser.add_argument('--n-loans', type=int, default=2_000_000)
+    scaling_parser.add_argument('--max-workers', type=int, default=None)
+    scaling_parser.add_argument('--shard-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    scaling_parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    if args.command == 'benchmark':
+        print("Batched portfolio generator throughput:")
+        benchmark(args.sizes, seed=args.seed)
+
+    elif args.command == 'stream':
+        print(f"Streaming {args.n_loans:,} loans in chunks of {args.chunk_size:,}...")
+        start = time.perf_counter()
+        totals = write_portfolio_stream(args.output, args.n_loans, args.chunk_size, args.seed)
+        elapsed = time.perf_counter() - start
+
+        print(f"\nDataset generated successfully: {args.output}")
+        print(f"Total loans: {totals['loans']:,}")
+        print(f"Staging distribution: {totals['stage_counts']}")
+        print(f"Total ECL: ${totals['ecl']:,.2f}")
+        print(f"Elapsed: {elapsed:.1f}s ({totals['loans'] / elapsed:,.0f} rows/s)")
+        print(f"Peak RSS: {peak_rss_mb():,.0f} MB")
+        print(f"File size: {os.path.getsize(args.output) / 1e6:,.0f} MB")
+
+    elif args.command == 'parallel':
+        print(f"Generating {args.n_loans:,} loans in shards of {args.shard_size:,} "
+              f"on {args.workers or os.cpu_count()} workers...")
+        start = time.perf_counter()
+        totals = write_portfolio_parallel(args.output, args.n_loans, args.workers,
+                                          args.shard_size, args.seed)
+        elapsed = time.perf_counter() - start
+
+        print(f"\nDataset generated successfully: {args.output}")
+        print(f"Total loans: {totals['loans']:,}")
+        print(f"Staging distribution: {totals['stage_counts']}")
+        print(f"Total ECL: ${totals['ecl']:,.2f}")
+        print(f"Elapsed: {elapsed:.1f}s ({totals['loans'] / elapsed:,.0f} rows/s)")
+
+    elif args.command == 'scaling':
+        print(f"Parallel pipeline scaling ({args.n_loans:,} loans):")
+        report = scaling_report(args.n_loans, args.max_workers, args.shard_size, args.seed)
+        print(report.to_string(index=False, float_format=lambda v: f"{v:,.2f}"))
@@ -0,0 +1,155 @@
+"""
+Columnar Portfolio I/O
+Parquet and Arrow IPC (Feather) writers and readers for the loan portfolio
+schema defined in setup_bigquery.create_loan_portfolio_table.
+"""
+
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+import portfolio_schema
+import profiler
+
+CATEGORY = pa.dictionary(pa.int8(), pa.string())
+
+# Column order, types and nullability follow the BigQuery table schema
+PORTFOLIO_SCHEMA = pa.schema([
+    pa.field('loan_id', pa.string(), nullable=False),
+    pa.field('reporting_date', pa.date32(), nullable=False),
+    pa.field('product_type', CATEGORY, nullable=False),
+    pa.field('origination_date', pa.date32(), nullable=False),
+    pa.field('original_amount', pa.float64(), nullable=False),
+    pa.field('outstanding_balance', pa.float64(), nullable=False),
+    pa.field('credit_score_origination', pa.int16(), nullable=False),
+    pa.field('credit_score_current', pa.int16(), nullable=False),
+    pa.field('days_past_due', pa.int16(), nullable=False),
+    pa.field('interest_rate', pa.float64(), nullable=False),
+    pa.field('industry_sector', CATEGORY, nullable=True),
+    pa.field('geography', CATEGORY, nullable=False),
+    pa.field('pd_12m', pa.float64(), nullable=False),
+    pa.field('pd_lifetime', pa.float64(), nullable=False),
+    pa.field('lgd', pa.float64(), nullable=False),
+    pa.field('ifrs9_stage', pa.int8(), nullable=False),
+    pa.field('ecl_amount', pa.float64(), nullable=False),
+    pa.field('ecl_rate', pa.float64(), nullable=False),
+])
+
+PARQUET_COMPRESSION = 'zstd'
+
+
+def to_arrow(df, schema=PORTFOLIO_SCHEMA):
+    """Convert a portfolio DataFrame to an Arrow table with the portfolio schema
+
+    Columns outside the schema (e.g. notebook helper columns) are dropped.
+    """
+    df = portfolio_schema.expand(df)
+    columns = [name for name in schema.names if name in df.columns]
+    schema = pa.schema([schema.field(name) for name in columns])
+    table = pa.Table.from_pandas(df[columns], preserve_index=False)
+    return table.cast(schema)
+
+
+def from_arrow(table):
+    """Convert an Arrow portfolio table to pandas (categoricals and datetime64 dates)"""
+    return table.to_pandas(date_as_object=False)
+
+
+def write_parquet(df, path, compression=PARQUET_COMPRESSION):
+    """Write a portfolio DataFrame to Parquet"""
+    pq.write_table(to_arrow(df), path, compression=compression)
+
+
+def read_parquet(path, columns=None, filters=None):
+    """Read a Parquet portfolio, optionally projecting columns and filtering rows"""
+    return from_arrow(pq.read_table(path, columns=columns, filters=filters))
+
+
+def write_feather(df, path, compression=PARQUET_COMPRESSION):
+    """Write a portfolio DataFrame to Arrow IPC (Feather v2)"""
+    feather.write_feather(to_arrow(df), path, compression=compression)
+
+
+def read_feather(path, columns=None):
+    """Read an Arrow IPC (Feather v2) portfolio"""
+    return from_arrow(feather.read_table(path, columns=columns))
+
+
+class ParquetChunkWriter:
+    """Append portfolio chunks to one Parquet file, one row group per chunk"""
+
+    def __init__(self, path, compression=PARQUET_COMPRESSION):
+        self.path = path
+        self._writer = pq.ParquetWriter(path, PORTFOLIO_SCHEMA, compression=compression)
+
+    def write(self, df):
+        self._writer.write_table(to_arrow(df))
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def merge_parquet_shards(shard_files, output_file, compression=PARQUET_COMPRESSION):
+    """Concatenate shard Parquet files in order without going through pandas"""
+    with pq.ParquetWriter(output_file, PORTFOLIO_SCHEMA, compression=compression) as writer:
+        for shard_file in shard_files:
+            writer.write_table(pq.read_table(shard_file).cast(PORTFOLIO_SCHEMA))
+
+
+@profiler.profiled()
+def read_portfolio(path, columns=None):
+    """Read a portfolio file, choosing the reader from the file extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        return read_parquet(path, columns=columns)
+    if extension in ('.feather', '.arrow'):
+        return read_feather(path, columns=columns)
+    if extension == '.csv':
+        # 'N/A' is a real industry_sector value, not a missing marker
+        return pd.read_csv(path, usecols=columns, keep_default_na=False,
+                           parse_dates=[c for c in ('reporting_date', 'origination_date')
+                                        if columns is None or c in columns])
+    raise ValueError(f"Unsupported portfolio file format: {path}")
+
+
+@profiler.profiled(rows=lambda result, args: len(args[0]))
+def write_portfolio(df, path):
+    """Write a portfolio file, choosing the writer from the file extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        write_parquet(df, path)
+    elif extension in ('.feather', '.arrow'):
+        write_feather(df, path)
+    elif extension == '.csv':
+        portfolio_schema.expand(df).to_csv(path, index=False)
+    else:
+        raise ValueError(f"Unsupported portfolio file format: {path}")
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    # Convert the demo CSV and compare size and read time
+    csv_file = 'loan_portfolio_data.csv'
+    df = read_portfolio(csv_file)
+    out_dir = tempfile.mkdtemp()
+
+    print(f"{'Format':<10}{'Size (KB)':>12}{'Read (ms)':>12}")
+    for path in (csv_file, os.path.join(out_dir, 'loan_portfolio_data.parquet'),
+                 os.path.join(out_dir, 'loan_portfolio_data.feather')):
+        if path != csv_file:
+            write_portfolio(df, path)
+        start = time.perf_counter()
+        read_portfolio(path)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{os.path.splitext(path)[1]:<10}{os.path.getsize(path) / 1024:>12,.0f}{elapsed:>12,.1f}")
@@ -0,0 +1,233 @@
+"""
+Compact Portfolio Schema
+Canonical in-memory representation of the loan portfolio: categoricals for
+the text dimensions, narrow integers for scores/stage/DPD, float32 for
+display-only rates, integer loan IDs and one scalar reporting date.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Category dictionaries (order is fixed so codes are stable across snapshots)
+PRODUCT_TYPES = ['Mortgage', 'Personal Loan', 'Auto Loan', 'Credit Card', 'SME Loan']
+REGIONS = ['North', 'South', 'East', 'West', 'Central']
+SECTORS = ['Retail', 'Manufacturing', 'Services', 'Construction', 'Technology', 'Healthcare', 'N/A']
+DPD_BUCKETS = ['Current', '1-30 DPD', '31-60 DPD', '61-90 DPD', '90+ DPD']
+
+PRODUCT_DTYPE = pd.CategoricalDtype(PRODUCT_TYPES)
+GEOGRAPHY_DTYPE = pd.CategoricalDtype(REGIONS)
+SECTOR_DTYPE = pd.CategoricalDtype(SECTORS)
+
+LOAN_ID_PREFIX = 'LN'
+LOAN_ID_DIGITS = 7
+
+# Risk parameters and money columns stay float64 so ECL is identical to the
+# wide schema; only presentation rates are narrowed to float32
+COMPACT_DTYPES = {
+    'loan_id': np.uint32,
+    'product_type': PRODUCT_DTYPE,
+    'original_amount': np.float64,
+    'outstanding_balance': np.float64,
+    'credit_score_origination': np.int16,
+    'credit_score_current': np.int16,
+    'days_past_due': np.int16,
+    'dpd_bucket': np.uint8,
+    'interest_rate': np.float32,
+    'industry_sector': SECTOR_DTYPE,
+    'geography': GEOGRAPHY_DTYPE,
+    'pd_12m': np.float64,
+    'pd_lifetime': np.float64,
+    'lgd': np.float64,
+    'ifrs9_stage': np.uint8,
+    'ecl_amount': np.float64,
+    'ecl_rate': np.float32,
+}
+
+# dtypes of the original (wide) generator output
+WIDE_DTYPES = {
+    'credit_score_origination': np.int64,
+    'credit_score_current': np.int64,
+    'days_past_due': np.int64,
+    'interest_rate': np.float64,
+    'ifrs9_stage': np.int64,
+    'ecl_rate': np.float64,
+}
+
+# Decimal places of float32 columns, restored when widening back to float64
+FLOAT32_DECIMALS = {'interest_rate': 2, 'ecl_rate': 4}
+
+COLUMN_ORDER = [
+    'loan_id', 'reporting_date', 'product_type', 'origination_date', 'original_amount',
+    'outstanding_balance', 'credit_score_origination', 'credit_score_current', 'days_past_due',
+    'interest_rate', 'industry_sector', 'geography', 'pd_12m', 'pd_lifetime', 'lgd',
+    'ifrs9_stage', 'ecl_amount', 'ecl_rate',
+]
+
+
+def is_compact(df):
+    """True if the frame uses the compact schema"""
+    return df.attrs.get('schema') == 'compact'
+
+
+def format_loan_ids(numbers, digits=LOAN_ID_DIGITS):
+    """Format integer loan numbers as 'LN' + zero-padded digits without a Python loop
+
+    Like str.zfill, numbers longer than ``digits`` widen the ID instead of
+    being truncated, so 12345678 becomes 'LN12345678'.
+    """
+    numbers = np.asarray(numbers, dtype=np.int64)
+    prefix = len(LOAN_ID_PREFIX)
+    widths = digits + np.searchsorted(10 ** np.arange(digits, 19, dtype=np.int64), numbers, side='right')
+    unique_widths = np.unique(widths)
+    out = np.empty(len(numbers), dtype=f'U{prefix + max(unique_widths, default=digits)}')
+    for width in unique_widths:
+        rows = slice(None) if len(unique_widths) == 1 else np.flatnonzero(widths == width)
+        remaining = numbers[rows].copy()
+        chars = np.empty((len(remaining), prefix + width), dtype=np.uint8)
+        chars[:, :prefix] = np.frombuffer(LOAN_ID_PREFIX.encode(), dtype=np.uint8)
+        for pos in range(prefix + width - 1, prefix - 1, -1):
+            chars[:, pos] = ord('0') + remaining % 10
+            remaining //= 10
+        out[rows] = chars.view(f'S{prefix + width}').ravel()
+    return out
+
+
+def parse_loan_ids(loan_ids):
+    """Integer loan numbers from 'LN0000123'-style identifiers"""
+    loan_ids = pd.Series(loan_ids)
+    if pd.api.types.is_integer_dtype(loan_ids):
+        return loan_ids.to_numpy(dtype=np.uint32)
+    return loan_ids.str.slice(len(LOAN_ID_PREFIX)).astype(np.uint32).to_numpy()
+
+
+def dpd_bucket(days_past_due):
+    """DPD bucket codes into DPD_BUCKETS (same bands as sql_queries.sql)"""
+    days_past_due = np.asarray(days_past_due)
+    return np.select(
+        [days_past_due == 0, days_past_due <= 30, days_past_due <= 60, days_past_due <= 90],
+        [0, 1, 2, 3],
+        default=4,
+    ).astype(np.uint8)
+
+
+def has_dtype(values, dtype):
+    """Exact dtype match; categoricals must also match category order (== ignores it)"""
+    if isinstance(dtype, pd.CategoricalDtype):
+        return isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories.equals(dtype.categories)
+    return values.dtype == dtype
+
+
+def apply_dtypes(df):
+    """Cast the columns present in df to their compact dtypes, in place"""
+    for column, dtype in COMPACT_DTYPES.items():
+        if column in df.columns and not has_dtype(df[column], dtype):
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                # astype() is a no-op between categoricals that differ only in order
+                df[column] = df[column].cat.set_categories(dtype.categories)
+            else:
+                df[column] = df[column].astype(dtype)
+    return df
+
+
+def compact(df):
+    """Convert a wide portfolio frame to the compact schema"""
+    if is_compact(df):
+        return df
+
+    out = df.copy()
+    out.attrs['schema'] = 'compact'
+    if 'reporting_date' in out.columns:
+        out.attrs['reporting_date'] = pd.Timestamp(out['reporting_date'].iloc[0])
+        out = out.drop(columns='reporting_date')
+
+    if 'loan_id' in out.columns:
+        out['loan_id'] = parse_loan_ids(out['loan_id'])
+    if 'days_past_due' in out.columns:
+        out['dpd_bucket'] = dpd_bucket(out['days_past_due'])
+    for column in ('origination_date',):
+        if column in out.columns:
+            out[column] = pd.to_datetime(out[column])
+
+    return apply_dtypes(out)
+
+
+def expand(df):
+    """Convert a compact frame back to the wide schema used by CSV/BigQuery exports"""
+    if not is_compact(df):
+        return df
+
+    out = df.copy()
+    out.attrs = {}
+    if 'loan_id' in out.columns:
+        out['loan_id'] = format_loan_ids(out['loan_id'])
+    if 'reporting_date' in df.attrs:
+        out['reporting_date'] = df.attrs['reporting_date']
+    for column in ('product_type', 'industry_sector', 'geography'):
+        if column in out.columns:
+            out[column] = out[column].astype(str)
+    for column, dtype in WIDE_DTYPES.items():
+        if column in out.columns:
+            out[column] = out[column].astype(dtype)
+    for column, decimals in FLOAT32_DECIMALS.items():
+        if column in out.columns:
+            out[column] = out[column].round(decimals)
+
+    out = out.drop(columns=[c for c in ('dpd_bucket',) if c in out.columns])
+    ordered = [c for c in COLUMN_ORDER if c in out.columns]
+    return out[ordered + [c for c in out.columns if c not in ordered]]
+
+
+def memory_footprint(df):
+    """Deep memory usage per column in bytes"""
+    return df.memory_usage(deep=True, index=False)
+
+
+def memory_report(wide, compact_df):
+    """Per-column memory before/after compaction, with a total row"""
+    report = pd.DataFrame({
+        'wide_bytes': memory_footprint(wide),
+        'compact_bytes': memory_footprint(compact_df),
+    }).fillna(0).astype(np.int64)
+    report.loc['TOTAL'] = report.sum()
+    report['reduction_%'] = (
+        (1 - report['compact_bytes'] / report['wide_bytes'].where(report['wide_bytes'] > 0)) * 100
+    ).round(1)
+    return report
+
+
+def verify_round_trip(n_loans=5000, first_loan_id=9_998_000, seed=42):
+    """Check wide -> compact -> wide is lossless, with loan IDs past 9,999,999"""
+    import ecl_engine
+    import portfolio_generator
+
+    wide = ecl_engine.run_ecl_pipeline(
+        portfolio_generator.generate_loan_portfolio_batched(n_loans, seed=seed, first_loan_id=first_loan_id))
+    numbers = np.arange(first_loan_id, first_loan_id + n_loans)
+    expected_ids = [f"{LOAN_ID_PREFIX}{str(i).zfill(LOAN_ID_DIGITS)}" for i in numbers]
+
+    compact_df = compact(wide)
+    np.testing.assert_array_equal(compact_df['loan_id'].to_numpy(), numbers)
+    np.testing.assert_array_equal(wide['loan_id'].to_numpy(), expected_ids)
+    pd.testing.assert_frame_equal(expand(compact_df), wide, check_exact=True)
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import ecl_engine
+    import portfolio_generator
+
+    parser = argparse.ArgumentParser(description="Compare wide vs compact portfolio memory")
+    parser.add_argument('--n-loans', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    verify_round_trip()
+    print("✅ Compact round trip is lossless (loan IDs LN9998000-LN10002999)")
+
+    wide = ecl_engine.run_ecl_pipeline(
+        portfolio_generator.generate_loan_portfolio_batched(args.n_loans))
+    report = memory_report(wide, compact(wide))
+
+    print(f"Memory footprint for {args.n_loans:,} loans (MB):")
+    print((report[['wide_bytes', 'compact_bytes']] / 1e6).round(1).join(report['reduction_%']))
@@ -0,0 +1,381 @@
+"""
+Pipeline Stage Profiler
+Records wall time, CPU time, peak RSS and rows processed for each pipeline
+stage (generation, PD/LGD, staging, ECL, aggregation, export and the notebook
+steps) and emits a JSON run report or Prometheus text metrics. Profiling is
+off unless IFRS9_PROFILE=1 or enable() is called; while off, a profiled
+function costs one flag check on top of the call.
+"""
+
+import argparse
+import functools
+import json
+import os
+import resource
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+METRIC_PREFIX = 'ifrs9_pipeline'
+
+
+class _State:
+    enabled = os.environ.get('IFRS9_PROFILE', '').lower() in ('1', 'true', 'yes')
+
+
+_state = _State()
+_stack = []     # open stage frames, innermost last
+_stages = {}    # stage name -> totals over every call
+_step = None    # frame of the open notebook step
+_run = {'run_id': uuid.uuid4().hex[:12], 'started': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+
+
+def enable():
+    _state.enabled = True
+
+
+def disable():
+    _state.enabled = False
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def reset():
+    """Drop every recorded stage and start a new run"""
+    global _step
+    _stack.clear()
+    _stages.clear()
+    _step = None
+    _run.update(run_id=uuid.uuid4().hex[:12], started=datetime.now(timezone.utc).isoformat(timespec='seconds'))
+
+
+# =============================================================================
+# PEAK RSS
+# =============================================================================
+
+def _read_hwm_kb():
+    """Peak RSS since the last reset (VmHWM), or None off Linux"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _reset_hwm():
+    """Restart VmHWM from the current RSS; False if the kernel does not allow it"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+_observed_peak_kb = 0   # resetting VmHWM also lowers ru_maxrss, so the process peak is tracked here
+
+
+def _process_peak_kb():
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, _observed_peak_kb)
+
+
+def _observe(kb):
+    global _observed_peak_kb
+    _observed_peak_kb = max(_observed_peak_kb, kb)
+
+
+# =============================================================================
+# STAGES
+# =============================================================================
+
+class _Frame:
+    __slots__ = ('name', 'wall', 'cpu', 'peak_kb', 'rows')
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        # The enclosing stage keeps the peak reached so far before the counter is reset
+        hwm = _read_hwm_kb()
+        if hwm is not None:
+            _observe(hwm)
+            if _stack:
+                _stack[-1].peak_kb = max(_stack[-1].peak_kb, hwm)
+        # Without a resettable counter a stage reports the process peak so far
+        self.peak_kb = 0 if _reset_hwm() else _process_peak_kb()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+
+    def close(self):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        hwm = _read_hwm_kb()
+        peak_kb = max(self.peak_kb, hwm if hwm is not None else _process_peak_kb())
+        _observe(peak_kb)
+        if _stack and _stack[-1] is not self:
+            _stack[-1].peak_kb = max(_stack[-1].peak_kb, peak_kb)
+
+        totals = _stages.get(self.name)
+        if totals is None:
+            totals = _stages[self.name] = {'stage': self.name, 'calls': 0, 'wall_seconds': 0.0,
+                                           'cpu_seconds': 0.0, 'peak_rss_mb': 0.0, 'rows': None}
+        totals['calls'] += 1
+        totals['wall_seconds'] += wall
+        totals['cpu_seconds'] += cpu
+        totals['peak_rss_mb'] = max(totals['peak_rss_mb'], peak_kb / 1024)
+        if self.rows is not None:
+            totals['rows'] = (totals['rows'] or 0) + self.rows
+        totals['parent'] = _stack[-1].name if _stack else None
+
+
+class stage:
+    """Context manager timing one stage; set ``.rows`` inside the block if not known up front"""
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self._frame = None
+
+    def __enter__(self):
+        if _state.enabled:
+            self._frame = _Frame(self.name, self.rows)
+            _stack.append(self._frame)
+        return self
+
+    def __exit__(self, *exc):
+        frame = self._frame
+        if frame is not None:
+            _stack.pop()
+            frame.rows = self.rows
+            frame.close()
+            self._frame = None
+        return False
+
+
+def _result_rows(result, args):
+    """Rows processed: length of the returned frame, else of the first argument"""
+    for value in (result, args[0] if args else None):
+        try:
+            return len(value)
+        except TypeError:
+            continue
+    return None
+
+
+def profiled(name=None, rows=_result_rows):
+    """Decorator recording every call of a function as a stage
+
+    ``rows(result, args)`` gives the rows processed by a call.
+    """
+    def decorate(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return func(*args, **kwargs)
+            frame = _Frame(stage_name)
+            _stack.append(frame)
+            try:
+                result = func(*args, **kwargs)
+                frame.rows = rows(result, args)
+                return result
+            finally:
+                _stack.pop()
+                frame.close()
+        return wrapper
+    return decorate
+
+
+def step(name, rows=None):
+    """End the current notebook step (if any) and start the next one; step(None) just ends it
+
+    Steps are flat sections of a script, so no indentation is needed around them.
+    """
+    global _step
+    if _step is not None:
+        if _step in _stack:
+            _stack.remove(_step)
+        _step.close()
+        _step = None
+    if name is not None and _state.enabled:
+        _step = _Frame(name, rows)
+        _stack.append(_step)
+
+
+# =============================================================================
+# REPORTS
+# =============================================================================
+
+def report():
+    """Run report: metadata plus one record per stage, in first-call order"""
+    stages = []
+    for totals in _stages.values():
+        record = dict(totals)
+        record['wall_seconds'] = round(record['wall_seconds'], 6)
+        record['cpu_seconds'] = round(record['cpu_seconds'], 6)
+        record['peak_rss_mb'] = round(record['peak_rss_mb'], 1)
+        record['rows_per_sec'] = (round(record['rows'] / record['wall_seconds'])
+                                  if record['rows'] and record['wall_seconds'] else None)
+        stages.append(record)
+    return dict(_run, python=sys.version.split()[0], argv=sys.argv,
+                process_peak_rss_mb=round(_process_peak_kb() / 1024, 1), stages=stages)
+
+
+def write_json(path):
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+    return path
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(prefix=METRIC_PREFIX):
+    """Stage metrics in the Prometheus text exposition format"""
+    run = report()
+    metrics = [
+        ('stage_calls_total', 'counter', 'Calls of the stage', 'calls'),
+        ('stage_wall_seconds_total', 'counter', 'Wall-clock time spent in the stage', 'wall_seconds'),
+        ('stage_cpu_seconds_total', 'counter', 'CPU time spent in the stage', 'cpu_seconds'),
+        ('stage_peak_rss_bytes', 'gauge', 'Peak resident set size during the stage', 'peak_rss_mb'),
+        ('stage_rows_total', 'counter', 'Rows processed by the stage', 'rows'),
+        ('stage_rows_per_second', 'gauge', 'Rows processed per wall-clock second', 'rows_per_sec'),
+    ]
+    lines = []
+    for metric, kind, help_text, key in metrics:
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} {kind}")
+        for record in run['stages']:
+            value = record[key]
+            if value is None:
+                continue
+            if key == 'peak_rss_mb':
+                value = int(value * 1024 ** 2)
+            lines.append(f'{prefix}_{metric}{{run_id="{run["run_id"]}",stage="{_label(record["stage"])}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    with open(path, 'w') as f:
+        f.write(prometheus_text())
+    return path
+
+
+def format_report(run=None):
+    """Plain-text table of a run report"""
+    run = run or report()
+    width = max([len('stage')] + [len(record['stage']) for record in run['stages']])
+    lines = [f"{'stage':<{width}} {'calls':>6} {'wall s':>9} {'cpu s':>9} {'peak MB':>9} {'rows':>12} {'rows/s':>12}"]
+    for record in run['stages']:
+        rows = f"{record['rows']:,}" if record['rows'] is not None else '-'
+        rate = f"{record['rows_per_sec']:,}" if record['rows_per_sec'] else '-'
+        lines.append(f"{record['stage']:<{width}} {record['calls']:>6} {record['wall_seconds']:>9.3f} "
+                     f"{record['cpu_seconds']:>9.3f} {record['peak_rss_mb']:>9.1f} {rows:>12} {rate:>12}")
+    return '\n'.join(lines)
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def run_pipeline(n_loans, chunk_size, output_dir, seed=42):
+    """Generate, calculate, aggregate and export a portfolio chunk by chunk (stages recorded if enabled)"""
+    import pandas as pd
+
+    import portfolio_generator
+    import portfolio_io
+    import summary_cube
+
+    os.makedirs(output_dir, exist_ok=True)
+    cube = summary_cube.SummaryCube()
+    chunks = []
+    for chunk in portfolio_generator.iter_portfolio_chunks(n_loans, chunk_size, seed=seed):
+        cube.acc.update(chunk)
+        chunks.append(chunk)
+    with stage('export', rows=n_loans):
+        portfolio_io.write_portfolio(pd.concat(chunks, ignore_index=True),
+                                     os.path.join(output_dir, 'portfolio.parquet'))
+        summary_cube.export_summaries(cube, output_dir)
+    return cube
+
+
+def benchmark(n_loans, chunk_size, output_dir, repeats=3, seed=42):
+    """Pipeline wall time with profiling off vs on, and the per-call cost of a disabled wrapper"""
+    timings = {}
+    for label, switch in (('profiling off', disable), ('profiling on', enable)):
+        switch()
+        best = float('inf')
+        for _ in range(repeats):
+            reset()
+            start = time.perf_counter()
+            run_pipeline(n_loans, chunk_size, output_dir, seed)
+            best = min(best, time.perf_counter() - start)
+        timings[label] = best
+    run = report()
+
+    disable()
+    calls = 1_000_000
+
+    def identity(value):
+        return value
+
+    for label, func in (('plain call', identity), ('disabled wrapper', profiled('identity')(identity))):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func(None)
+        timings[label] = (time.perf_counter() - start) / calls
+    return timings, run
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the portfolio pipeline stage by stage")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Profile generation, ECL, aggregation and export")
+    run_parser.add_argument('--n-loans', type=int, default=1_000_000)
+    run_parser.add_argument('--chunk-size', type=int, default=250_000)
+    run_parser.add_argument('--output-dir', default='profile_run')
+    run_parser.add_argument('--json', default='run_report.json', help="Run report path")
+    run_parser.add_argument('--prometheus', help="Also write Prometheus text metrics to this path")
+
+    show_parser = subparsers.add_parser('show', help="Print a saved run report")
+    show_parser.add_argument('report')
+
+    bench_parser = subparsers.add_parser('benchmark', help="Pipeline time with profiling off vs on")
+    bench_parser.add_argument('--n-loans', type=int, default=1_000_000)
+    bench_parser.add_argument('--chunk-size', type=int, default=250_000)
+    bench_parser.add_argument('--output-dir', default='profile_benchmark')
+
+    args = parser.parse_args()
+
+    # The pipeline modules record into the imported module, not into __main__
+    import profiler
+
+    if args.command == 'run':
+        profiler.enable()
+        profiler.run_pipeline(args.n_loans, args.chunk_size, args.output_dir)
+        print(profiler.format_report())
+        print(f"\n✅ Saved: {profiler.write_json(args.json)}")
+        if args.prometheus:
+            print(f"✅ Saved: {profiler.write_prometheus(args.prometheus)}")
+
+    elif args.command == 'show':
+        with open(args.report) as f:
+            print(profiler.format_report(json.load(f)))
+
+    elif args.command == 'benchmark':
+        timings, run = profiler.benchmark(args.n_loans, args.chunk_size, args.output_dir)
+        print(profiler.format_report(run))
+        overhead = timings['profiling on'] / timings['profiling off'] - 1
+        print(f"\nPipeline over {args.n_loans:,} loans (best of 3):")
+        print(f"  profiling off:      {timings['profiling off']:8.3f}s")
+        print(f"  profiling on:       {timings['profiling on']:8.3f}s ({overhead:+.1%})")
+        print(f"  plain call:         {timings['plain call'] * 1e9:8.0f} ns")
+        print(f"  disabled wrapper:   {timings['disabled wrapper'] * 1e9:8.0f} ns")
@@ -0,0 +1,341 @@
+"""
+Query Result Cache
+Content-addressed cache for aggregate query results. Entries are keyed by the
+normalized SQL (or an aggregation spec) plus the version of every table the
+query reads, stored as Parquet on local disk and evicted least recently used
+once the cache exceeds its size budget. Loading a table through
+setup_bigquery.load_data_to_bigquery bumps its version, so cached results for
+the previous snapshot are never served again.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Shared by every dashboard and loader, whatever their working directory
+CACHE_DIR = os.environ.get('IFRS9_QUERY_CACHE',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '.query_cache'))
+MAX_CACHE_BYTES = 512 * 1024 ** 2
+
+VERSIONS_FILE = 'versions.json'
+STATS_FILE = 'stats.log'
+ENTRIES_DIR = 'entries'
+
+# String literals are kept verbatim; comments and whitespace runs are not significant
+_SQL_TOKENS = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")|((?:\s|--[^\n]*|/\*.*?\*/)+)", re.S)
+_FUNCTION_FROM = re.compile(r"\b(?:EXTRACT|TRIM|SUBSTRING)\s*\([^()]*?\bFROM\b", re.I)
+_TABLE_REFERENCE = re.compile(r"\b(?:FROM|JOIN)\s+(`[^`]+`|[\w.-]+)|(`[^`]+`)", re.I)
+
+
+def normalize_sql(sql):
+    """SQL with comments removed, whitespace collapsed and the trailing ';' dropped"""
+    def token(match):
+        literal, _ = match.groups()
+        return literal if literal else ' '
+    return _SQL_TOKENS.sub(token, sql).strip().rstrip(';').strip()
+
+
+def table_name(reference):
+    """Bare table name of a reference such as `project.dataset.table` or dataset.table"""
+    return reference.strip('`').split('.')[-1]
+
+
+def referenced_tables(sql):
+    """Bare names of the tables a statement reads (FROM/JOIN targets and backticked references)"""
+    references = _TABLE_REFERENCE.findall(_FUNCTION_FROM.sub('(', normalize_sql(sql)))
+    return sorted({table_name(ref) for pair in references for ref in pair if ref})
+
+
+def query_key(query, versions):
+    """Cache key of a SQL string or aggregation spec (dict) at the given table versions"""
+    if isinstance(query, str):
+        text = normalize_sql(query)
+    else:
+        text = json.dumps(query, sort_keys=True, default=str)
+    payload = json.dumps({'query': text, 'versions': versions}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def file_version(path):
+    """Version token of a local portfolio file or directory (size and mtime)"""
+    paths = [path]
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    stats = [os.stat(p) for p in paths]
+    return hashlib.sha256(repr([(p, s.st_size, s.st_mtime_ns) for p, s in zip(paths, stats)]).encode()).hexdigest()[:16]
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class QueryCache:
+    """Parquet result cache on local disk with LRU eviction by total size"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.join(cache_dir, ENTRIES_DIR), exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, ENTRIES_DIR, f"{key}.parquet")
+
+    def versions(self, tables):
+        """Current version token of each table"""
+        versions = _read_json(os.path.join(self.cache_dir, VERSIONS_FILE), {})
+        return {table: versions.get(table, 'initial') for table in tables}
+
+    def invalidate(self, table):
+        """Start a new version of a table; results cached for older versions become unreachable"""
+        table = table_name(table)
+        path = os.path.join(self.cache_dir, VERSIONS_FILE)
+        versions = _read_json(path, {})
+        versions[table] = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        _write_json(path, versions)
+        return versions[table]
+
+    def get(self, key):
+        """Cached result, or None on a miss"""
+        path = self._path(key)
+        try:
+            df = pq.read_table(path).to_pandas()
+            os.utime(path)  # recency for LRU eviction
+        except FileNotFoundError:
+            # Never cached, or evicted by another process between the read and the touch
+            self._count(miss=True)
+            return None
+        self._count(miss=False)
+        return df
+
+    def put(self, key, df):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(pa.Table.from_pandas(df), tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def cached(self, query, compute, tables=None, snapshot=None):
+        """Result of ``compute()`` for a query, served from the cache when possible
+
+        ``tables`` defaults to the tables referenced by a SQL query; ``snapshot``
+        is an extra version token, e.g. file_version() of a local source.
+        """
+        tables = referenced_tables(query) if tables is None and isinstance(query, str) else tables or []
+        versions = self.versions(tables)
+        if snapshot is not None:
+            versions['snapshot'] = snapshot
+        key = query_key(query, versions)
+        df = self.get(key)
+        if df is None:
+            df = compute()
+            try:
+                self.put(key, df)
+            except OSError as e:
+                # A failed cache write must never fail the query itself
+                print(f"⚠️ Query cache write skipped: {e}")
+        return df
+
+    def entries(self):
+        """(path, bytes, last used) of every entry, least recently used first"""
+        directory = os.path.join(self.cache_dir, ENTRIES_DIR)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.parquet'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process since the scan
+                entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return sorted(entries, key=lambda e: e[2])
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass  # another process evicted it first; it no longer counts either way
+            total -= size
+        return evicted
+
+    def _count(self, miss):
+        if miss:
+            self.misses += 1
+        else:
+            self.hits += 1
+        # One byte per lookup in a single O_APPEND write, so concurrent processes never lose counts
+        fd = os.open(os.path.join(self.cache_dir, STATS_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, b'm' if miss else b'h')
+        finally:
+            os.close(fd)
+
+    def stats(self):
+        """Hit/miss counts (this session and all time) and cache size"""
+        try:
+            with open(os.path.join(self.cache_dir, STATS_FILE), 'rb') as f:
+                log = f.read()
+        except FileNotFoundError:
+            log = b''
+        totals = {'hits': log.count(b'h'), 'misses': log.count(b'm')}
+        entries = self.entries()
+        lookups = totals['hits'] + totals['misses']
+        return {
+            'session_hits': self.hits,
+            'session_misses': self.misses,
+            'hits': totals['hits'],
+            'misses': totals['misses'],
+            'hit_rate': totals['hits'] / lookups if lookups else 0.0,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(os.path.join(self.cache_dir, ENTRIES_DIR), exist_ok=True)
+
+
+class CachedQueryJob:
+    """Result handle with the parts of bigquery.QueryJob the notebook uses"""
+
+    def __init__(self, client, sql):
+        self._client = client
+        self.query = sql
+
+    def result(self):
+        return self
+
+    def to_dataframe(self):
+        client = self._client
+        return client.cache.cached(self.query, lambda: client.client.query(self.query).to_dataframe(),
+                                   snapshot=client.snapshot)
+
+
+class CachedClient:
+    """Wrap a bigquery.Client (or local_sql.LocalClient) so query results go through the cache"""
+
+    def __init__(self, client, cache=None, snapshot=None):
+        self.client = client
+        self.cache = cache or QueryCache()
+        self.snapshot = snapshot
+
+    def query(self, sql):
+        return CachedQueryJob(self, sql)
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def benchmark(n_loans, refreshes, work_dir, seed=42):
+    """Dashboard refreshes of the whole query library, direct vs through the cache"""
+    import local_sql
+    import portfolio_generator
+
+    os.makedirs(work_dir, exist_ok=True)
+    parquet_file = os.path.join(work_dir, 'portfolio.parquet')
+    portfolio_generator.write_portfolio_stream(parquet_file, n_loans, seed=seed)
+    queries = local_sql.load_query_library()
+    client = local_sql.LocalClient(parquet_file)
+
+    start = time.perf_counter()
+    for _ in range(refreshes):
+        direct = local_sql.run_library(client, queries)
+    direct_seconds = time.perf_counter() - start
+
+    cache = QueryCache(os.path.join(work_dir, 'cache'))
+    cache.clear()
+    cached_client = CachedClient(client, cache, snapshot=file_version(parquet_file))
+    start = time.perf_counter()
+    for _ in range(refreshes):
+        cached = local_sql.run_library(cached_client, queries)
+    cached_seconds = time.perf_counter() - start
+
+    for key, (df, _) in direct.items():
+        assert df.equals(cached[key][0]), key
+    return direct_seconds, cached_seconds, len(queries), cache.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query result cache")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--max-mb', type=float, default=MAX_CACHE_BYTES / 1024 ** 2)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run the query library against a local file through the cache")
+    run_parser.add_argument('source', help="Portfolio Parquet/CSV file or Parquet directory")
+    run_parser.add_argument('--query', nargs='+', help="Query keys to run (default: all)")
+
+    subparsers.add_parser('stats', help="Hit/miss statistics and cache size")
+
+    invalidate_parser = subparsers.add_parser('invalidate', help="Start a new version of a table")
+    invalidate_parser.add_argument('table', nargs='?', default='loan_portfolio')
+
+    subparsers.add_parser('clear', help="Delete every cached result")
+
+    bench_parser = subparsers.add_parser('benchmark', help="Repeated dashboard refreshes, direct vs cached")
+    bench_parser.add_argument('--n-loans', type=int, default=1_000_000)
+    bench_parser.add_argument('--refreshes', type=int, default=20)
+    bench_parser.add_argument('--work-dir', default='cache_benchmark')
+
+    args = parser.parse_args()
+    cache = QueryCache(args.cache_dir, int(args.max_mb * 1024 ** 2))
+
+    if args.command == 'run':
+        import local_sql
+        queries = [q for q in local_sql.load_query_library() if not args.query or q['key'] in args.query]
+        client = CachedClient(local_sql.LocalClient(args.source), cache, snapshot=file_version(args.source))
+        for key, (result, seconds) in local_sql.run_library(client, queries).items():
+            print(f"{key:<60} {len(result):>6,} rows {seconds * 1000:>9.1f} ms")
+        stats = cache.stats()
+        print(f"\n✅ Session: {stats['session_hits']} hits, {stats['session_misses']} misses")
+
+    elif args.command == 'stats':
+        stats = cache.stats()
+        print(f"Hits:     {stats['hits']:,}")
+        print(f"Misses:   {stats['misses']:,}")
+        print(f"Hit rate: {stats['hit_rate']:.1%}")
+        print(f"Entries:  {stats['entries']:,} ({stats['bytes'] / 1024 ** 2:,.2f} of {stats['max_bytes'] / 1024 ** 2:,.2f} MB)")
+
+    elif args.command == 'invalidate':
+        print(f"✅ {args.table} is now at version {cache.invalidate(args.table)}")
+
+    elif args.command == 'clear':
+        cache.clear()
+        print(f"✅ Cleared {args.cache_dir}")
+
+    elif args.command == 'benchmark':
+        direct_seconds, cached_seconds, n_queries, stats = benchmark(args.n_loans, args.refreshes, args.work_dir)
+        print(f"{args.refreshes} refreshes of {n_queries} views over {args.n_loans:,} loans (results verified equal):")
+        print(f"  direct: {direct_seconds:8.3f}s ({direct_seconds / args.refreshes * 1000:,.0f} ms per refresh)")
+        print(f"  cached: {cached_seconds:8.3f}s ({cached_seconds / args.refreshes * 1000:,.0f} ms per refresh)")
+        print(f"  hit rate {stats['session_hits'] / max(stats['session_hits'] + stats['session_misses'], 1):.1%}, "
+              f"{stats['entries']} entries, {stats['bytes'] / 1024:,.0f} KB")
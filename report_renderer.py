@@ -0,0 +1,463 @@
+"""
+Batch Report Renderer
+Builds the notebook's six Plotly charts from precomputed summary tables
+(aggregation.compute_summaries or a saved summary cube) and renders them
+headless. The charts are exported to PNG/SVG concurrently in a process pool,
+and a self-contained HTML bundle is written alongside. A manifest of input
+hashes lets re-runs skip charts whose aggregates have not changed.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.subplots import make_subplots
+
+MANIFEST_FILE = 'report_manifest.json'
+BUNDLE_FILE = 'ifrs9_report.html'
+IMAGE_FORMATS = ('png', 'svg')
+
+# Bump when a chart builder changes so every chart is re-rendered
+RENDERER_VERSION = 1
+
+STAGE_COLORS = ['#2ecc71', '#f39c12', '#e74c3c']
+PRODUCT_COLORS = ['#e74c3c', '#e67e22', '#f39c12', '#2ecc71', '#27ae60']
+
+NUMERICAL_COLUMNS = ['outstanding_balance', 'credit_score_current', 'days_past_due',
+                     'pd_12m', 'pd_lifetime', 'lgd', 'ecl_amount', 'ecl_rate']
+
+
+# =============================================================================
+# CHART BUILDERS
+# =============================================================================
+
+def staging_figure(staging_summary):
+    """Loan count pie and ECL bars by IFRS 9 stage"""
+    stage_counts = staging_summary['Loan Count']
+    stage_labels = [f'Stage {s}' for s in stage_counts.index]
+
+    fig = make_subplots(
+        rows=1, cols=2,
+        subplot_titles=('Loan Distribution by IFRS 9 Stage', 'ECL Amount by Stage'),
+        specs=[[{'type': 'pie'}, {'type': 'bar'}]]
+    )
+    fig.add_trace(
+        go.Pie(
+            labels=stage_labels,
+            values=stage_counts.values,
+            marker=dict(colors=STAGE_COLORS),
+            textinfo='label+percent',
+            hovertemplate='%{label}<br>Count: %{value}<br>Percent: %{percent}<extra></extra>'
+        ),
+        row=1, col=1
+    )
+    stage_ecl = staging_summary['Total ECL'] / 1000000  # Convert to millions
+    fig.add_trace(
+        go.Bar(
+            x=stage_labels,
+            y=stage_ecl.values,
+            marker=dict(color=STAGE_COLORS),
+            text=[f'${v:.2f}M' for v in stage_ecl.values],
+            textposition='outside',
+            hovertemplate='%{x}<br>ECL: $%{y:.2f}M<extra></extra>'
+        ),
+        row=1, col=2
+    )
+    fig.update_layout(
+        title_text="IFRS 9 Staging Analysis",
+        showlegend=False,
+        height=500,
+        font=dict(size=12)
+    )
+    fig.update_yaxes(title_text="ECL Amount ($ Millions)", row=1, col=2)
+    return fig
+
+
+def product_risk_figure(product_analysis):
+    """ECL rate by product, horizontal bars"""
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        y=product_analysis.index,
+        x=product_analysis['ECL Rate %'],
+        orientation='h',
+        marker=dict(
+            color=PRODUCT_COLORS,
+            line=dict(color='white', width=1)
+        ),
+        text=[f'{v:.2f}%' for v in product_analysis['ECL Rate %']],
+        textposition='outside',
+        hovertemplate='%{y}<br>ECL Rate: %{x:.2f}%<extra></extra>'
+    ))
+    fig.update_layout(
+        title='Risk Profile by Product Type',
+        xaxis_title='ECL Rate (%)',
+        yaxis_title='',
+        height=500,
+        font=dict(size=12),
+        showlegend=False
+    )
+    return fig
+
+
+def credit_quality_figure(credit_summary):
+    """Loan count, exposure, average PD and ECL share by credit band (2x2)"""
+    fig = make_subplots(
+        rows=2, cols=2,
+        subplot_titles=(
+            'Loan Count by Credit Quality',
+            'Exposure by Credit Quality ($ Millions)',
+            'Average PD by Credit Quality',
+            'ECL Concentration by Credit Quality'
+        ),
+        vertical_spacing=0.15,
+        horizontal_spacing=0.12
+    )
+    fig.add_trace(
+        go.Bar(
+            x=credit_summary.index,
+            y=credit_summary['loan_id'],
+            marker=dict(color='steelblue'),
+            showlegend=False,
+            hovertemplate='%{x}<br>Loans: %{y}<extra></extra>'
+        ),
+        row=1, col=1
+    )
+    fig.add_trace(
+        go.Bar(
+            x=credit_summary.index,
+            y=credit_summary['outstanding_balance'] / 1000000,
+            marker=dict(color='coral'),
+            showlegend=False,
+            hovertemplate='%{x}<br>Exposure: $%{y:.2f}M<extra></extra>'
+        ),
+        row=1, col=2
+    )
+    fig.add_trace(
+        go.Bar(
+            x=credit_summary.index,
+            y=credit_summary['pd_12m'],
+            marker=dict(color='indianred'),
+            showlegend=False,
+            hovertemplate='%{x}<br>Avg PD: %{y:.4f}<extra></extra>'
+        ),
+        row=2, col=1
+    )
+    ecl_pct = (credit_summary['ecl_amount'] / credit_summary['ecl_amount'].sum() * 100)
+    fig.add_trace(
+        go.Bar(
+            x=credit_summary.index,
+            y=ecl_pct,
+            marker=dict(color='darkgreen'),
+            showlegend=False,
+            hovertemplate='%{x}<br>ECL %: %{y:.1f}%<extra></extra>'
+        ),
+        row=2, col=2
+    )
+    fig.update_layout(
+        title_text='Credit Quality Analysis',
+        height=800,
+        font=dict(size=11)
+    )
+    fig.update_yaxes(title_text="Number of Loans", row=1, col=1)
+    fig.update_yaxes(title_text="Exposure ($ Millions)", row=1, col=2)
+    fig.update_yaxes(title_text="Probability of Default", row=2, col=1)
+    fig.update_yaxes(title_text="% of Total ECL", row=2, col=2)
+    fig.update_xaxes(tickangle=45)
+    return fig
+
+
+def correlation_figure(correlation_matrix):
+    """Heatmap of the risk metric correlations"""
+    correlation_matrix = correlation_matrix.loc[NUMERICAL_COLUMNS, NUMERICAL_COLUMNS]
+    fig = go.Figure(data=go.Heatmap(
+        z=correlation_matrix.values,
+        x=correlation_matrix.columns,
+        y=correlation_matrix.columns,
+        colorscale='RdBu',
+        zmid=0,
+        text=correlation_matrix.values.round(2),
+        texttemplate='%{text}',
+        textfont={"size": 10},
+        colorbar=dict(title="Correlation")
+    ))
+    fig.update_layout(
+        title='Correlation Matrix - Risk Metrics',
+        height=700,
+        width=800,
+        font=dict(size=11)
+    )
+    return fig
+
+
+def vintage_figure(vintage_summary):
+    """Default rate and ECL rate by origination year"""
+    fig = make_subplots(
+        rows=1, cols=2,
+        subplot_titles=('Default Rate by Vintage Year', 'ECL Rate by Vintage Year')
+    )
+    fig.add_trace(
+        go.Bar(
+            x=vintage_summary.index,
+            y=vintage_summary['Default Rate %'],
+            marker=dict(color='crimson'),
+            showlegend=False,
+            hovertemplate='Year: %{x}<br>Default Rate: %{y:.2f}%<extra></extra>'
+        ),
+        row=1, col=1
+    )
+    fig.add_trace(
+        go.Bar(
+            x=vintage_summary.index,
+            y=vintage_summary['ECL Rate %'],
+            marker=dict(color='darkorange'),
+            showlegend=False,
+            hovertemplate='Year: %{x}<br>ECL Rate: %{y:.2f}%<extra></extra>'
+        ),
+        row=1, col=2
+    )
+    fig.update_layout(
+        title_text='Vintage Analysis',
+        height=500,
+        font=dict(size=12)
+    )
+    fig.update_yaxes(title_text="Default Rate (%)", row=1, col=1)
+    fig.update_yaxes(title_text="ECL Rate (%)", row=1, col=2)
+    fig.update_xaxes(title_text="Origination Year")
+    return fig
+
+
+def geographic_figure(geo_summary):
+    """ECL rate by region, horizontal bars"""
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        y=geo_summary.index,
+        x=geo_summary['ECL Rate %'],
+        orientation='h',
+        marker=dict(color='teal'),
+        text=[f'{v:.2f}%' for v in geo_summary['ECL Rate %']],
+        textposition='outside',
+        hovertemplate='%{y}<br>ECL Rate: %{x:.2f}%<extra></extra>'
+    ))
+    fig.update_layout(
+        title='Risk by Geographic Region',
+        xaxis_title='ECL Rate (%)',
+        yaxis_title='',
+        height=500,
+        font=dict(size=12),
+        showlegend=False
+    )
+    return fig
+
+
+# name -> (builder, summary table, export width, export height), in report order
+CHARTS = {
+    'staging_distribution': (staging_figure, 'staging_summary', 1400, 500),
+    'product_risk_analysis': (product_risk_figure, 'product_analysis', 1200, 500),
+    'credit_quality_analysis': (credit_quality_figure, 'credit_summary', 1400, 800),
+    'correlation_heatmap': (correlation_figure, 'correlation_matrix', 800, 700),
+    'vintage_analysis': (vintage_figure, 'vintage_summary', 1400, 500),
+    'geographic_analysis': (geographic_figure, 'geo_summary', 1200, 500),
+}
+
+
+# =============================================================================
+# RENDERING
+# =============================================================================
+
+def input_hash(table):
+    """Content hash of a summary table (values, index and column labels)"""
+    digest = hashlib.sha256()
+    digest.update(f"{RENDERER_VERSION}|{list(table.columns)}|{table.index.name}".encode())
+    digest.update(pd.util.hash_pandas_object(table, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _render_images(task):
+    """Worker: export one chart to each image format"""
+    name, figure_json, paths, width, height = task
+    fig = pio.from_json(figure_json)
+    start = time.perf_counter()
+    for path in paths:
+        fig.write_image(path, width=width, height=height)
+    return name, time.perf_counter() - start
+
+
+def image_export_available():
+    """True if Kaleido (static image export) is installed"""
+    try:
+        import kaleido  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_bundle(figures, path, title='IFRS 9 Portfolio Report'):
+    """One self-contained HTML file: plotly.js inlined once, then every chart"""
+    sections = []
+    for i, (name, fig) in enumerate(figures.items()):
+        sections.append(f'<section id="{name}">'
+                        + fig.to_html(full_html=False, include_plotlyjs=(i == 0)) + '</section>')
+    with open(path, 'w') as f:
+        f.write(f'<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>{title}</title></head>\n'
+                f'<body>\n<h1>{title}</h1>\n' + '\n'.join(sections) + '\n</body>\n</html>\n')
+
+
+def render_report(summaries, output_dir, formats=IMAGE_FORMATS + ('html',), workers=None, force=False):
+    """Render every chart whose summary table changed since the last run
+
+    Returns {chart: 'rendered' | 'unchanged'} and the manifest is updated in
+    output_dir. Raises RuntimeError before rendering anything if image formats
+    are requested and Kaleido is missing.
+    """
+    image_formats = [f for f in formats if f in IMAGE_FORMATS]
+    if image_formats and not image_export_available():
+        raise RuntimeError(f"{', '.join(image_formats)} export needs kaleido (pip install kaleido); "
+                           f"use --formats html for the HTML bundle only")
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    figures, status, tasks = {}, {}, []
+    for name, (builder, table, width, height) in CHARTS.items():
+        if table not in summaries:
+            continue
+        fig = builder(summaries[table])
+        figures[name] = fig
+        digest = input_hash(summaries[table])
+        paths = [os.path.join(output_dir, f"{name}.{fmt}") for fmt in image_formats]
+        previous = manifest.get(name, {})
+        if (previous.get('hash') == digest and set(image_formats) <= set(previous.get('formats', []))
+                and all(os.path.exists(p) for p in paths)):
+            status[name] = 'unchanged'
+            continue
+        status[name] = 'rendered'
+        manifest[name] = {'hash': digest, 'formats': image_formats}
+        if paths:
+            tasks.append((name, fig.to_json(), paths, width, height))
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(tasks))) as pool:
+            for name, seconds in pool.map(_render_images, tasks):
+                manifest[name]['render_seconds'] = round(seconds, 3)
+
+    bundle_path = os.path.join(output_dir, BUNDLE_FILE)
+    if 'html' in formats and ('rendered' in status.values() or not os.path.exists(bundle_path)):
+        write_bundle(figures, bundle_path)
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return status
+
+
+def load_summaries(source, reporting_date=None):
+    """Summary tables from a saved cube (.npz), a loan tape or one scan of a portfolio source"""
+    import summary_cube
+
+    if source.endswith('.npz'):
+        return summary_cube.SummaryCube.load(source).summaries()
+
+    import loan_tape
+    if os.path.isdir(source) and os.path.exists(os.path.join(source, loan_tape.HEADER_FILE)):
+        return summary_cube.SummaryCube.build(loan_tape.open_loan_tape(source)).summaries()
+
+    import aggregation
+    import data_source
+    chunks = data_source.open_source(source).iter_chunks(data_source.SUMMARY_COLUMNS,
+                                                         data_source.stage_filter(reporting_date))
+    return aggregation.compute_summaries(chunks)
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def benchmark(n_loans, work_dir, workers=None, seed=42):
+    """Report refresh: summaries from a portfolio scan vs a saved cube, cold vs unchanged render"""
+    import data_source
+    import portfolio_generator
+    import summary_cube
+
+    os.makedirs(work_dir, exist_ok=True)
+    formats = IMAGE_FORMATS + ('html',) if image_export_available() else ('html',)
+    parquet_file = os.path.join(work_dir, 'portfolio.parquet')
+    cube_file = os.path.join(work_dir, 'portfolio_cube.npz')
+    output_dir = os.path.join(work_dir, 'report')
+    portfolio_generator.write_portfolio_stream(parquet_file, n_loans, seed=seed)
+
+    timings = {}
+    start = time.perf_counter()
+    scanned = load_summaries(parquet_file)
+    timings['summaries from portfolio scan'] = time.perf_counter() - start
+    data = data_source.open_source(parquet_file)
+    summary_cube.SummaryCube.build(data.iter_chunks(data_source.SUMMARY_COLUMNS)).save(cube_file)
+
+    start = time.perf_counter()
+    summaries = load_summaries(cube_file)
+    timings['summaries from cube'] = time.perf_counter() - start
+    for _, table, _, _ in CHARTS.values():
+        pd.testing.assert_frame_equal(summaries[table], scanned[table], check_dtype=False)
+
+    start = time.perf_counter()
+    render_report(summaries, output_dir, formats, workers=workers, force=True)
+    timings['render, all charts'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    status = render_report(summaries, output_dir, formats, workers=workers)
+    timings['render, inputs unchanged'] = time.perf_counter() - start
+    assert set(status.values()) == {'unchanged'}
+    return timings, formats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the IFRS 9 chart report headless")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    render_parser = subparsers.add_parser('render', help="Render the charts whose summaries changed")
+    render_parser.add_argument('source', help="Summary cube (.npz), loan tape, portfolio file or project.dataset.table")
+    render_parser.add_argument('--output-dir', default='report')
+    render_parser.add_argument('--formats', default='png,svg,html', help="Comma-separated: png, svg, html")
+    render_parser.add_argument('--workers', type=int, help="Image export processes (default: CPU count)")
+    render_parser.add_argument('--reporting-date', help="Snapshot to read from multi-date sources")
+    render_parser.add_argument('--force', action='store_true', help="Re-render unchanged charts")
+
+    bench_parser = subparsers.add_parser('benchmark', help="Cold vs unchanged report refresh")
+    bench_parser.add_argument('--n-loans', type=int, default=1_000_000)
+    bench_parser.add_argument('--workers', type=int)
+    bench_parser.add_argument('--work-dir', default='report_benchmark')
+
+    args = parser.parse_args()
+
+    if args.command == 'render':
+        start = time.perf_counter()
+        summaries = load_summaries(args.source, args.reporting_date)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            status = render_report(summaries, args.output_dir, tuple(args.formats.split(',')),
+                                   args.workers, args.force)
+        except RuntimeError as e:
+            sys.exit(f"❌ {e}")
+        render_seconds = time.perf_counter() - start
+
+        for name, state in status.items():
+            print(f"{'✅' if state == 'rendered' else '⏭️ '} {name}: {state}")
+        print(f"\nSummaries {load_seconds:.2f}s, rendering {render_seconds:.2f}s → {args.output_dir}/")
+
+    elif args.command == 'benchmark':
+        timings, formats = benchmark(args.n_loans, args.work_dir, args.workers)
+        print(f"Report refresh over {args.n_loans:,} loans, {'/'.join(formats)} "
+              f"(cube summaries verified against the scan):")
+        for label, seconds in timings.items():
+            print(f"  {label:<31} {seconds:8.3f}s")
@@ -0,0 +1,544 @@
+"""
+Rule-Table PD/LGD/Staging Engine
+Declarative rule sets (YAML, JSON or CSV) for the PD score bands, DPD
+multipliers, product adjustments, LGD ranges and staging criteria, so each
+legal entity can run its own parameters through the same vectorized kernels
+as ecl_engine. A rule set is compiled once into lookup arrays and comparison
+masks, and compiled plans are cached by the hash of the normalized rules.
+A loan tape is prepared once (product codes, LGD uniforms) and can then be
+evaluated under any number of plans.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import ecl_engine
+
+PRODUCT_TYPES = ecl_engine.PRODUCT_TYPES
+
+# Loan attributes a staging criterion can test (score_drop = origination - current score)
+CRITERION_FIELDS = ('days_past_due', 'credit_score_current', 'credit_score_origination', 'score_drop',
+                    'pd_12m', 'pd_lifetime', 'outstanding_balance', 'product_type')
+
+OPERATORS = {
+    '>': np.greater, '>=': np.greater_equal, '<': np.less, '<=': np.less_equal,
+    '==': np.equal, '!=': np.not_equal, 'in': np.isin,
+}
+
+CSV_COLUMNS = ['table', 'key', 'op', 'value', 'upper']
+
+
+def default_rules():
+    """The ecl_engine parameters (generate_sample_data behaviour) as a rule set"""
+    scores = [0] + ecl_engine.SCORE_BAND_EDGES.tolist()
+    return {
+        'name': 'default',
+        'pd_bands': [{'min_score': s, 'pd': p} for s, p in zip(scores, ecl_engine.BASE_PD_BY_BAND.tolist())][::-1],
+        'dpd_multipliers': [{'max_dpd': 0, 'multiplier': 1.0}, {'max_dpd': ecl_engine.SICR_DPD, 'multiplier': 2.0},
+                            {'max_dpd': ecl_engine.STAGE3_DPD, 'multiplier': 4.0}, {'multiplier': 8.0}],
+        'product_pd_adj': dict(zip(PRODUCT_TYPES, ecl_engine.PRODUCT_PD_ADJ[:-1].tolist())),
+        'default_pd_adj': float(ecl_engine.PRODUCT_PD_ADJ[-1]),
+        'lgd': {p: [lo, hi] for p, lo, hi in zip(PRODUCT_TYPES, ecl_engine.LGD_LOW.tolist(),
+                                                   ecl_engine.LGD_HIGH.tolist())},
+        'default_lgd': ecl_engine.DEFAULT_LGD,
+        'lifetime_pd_multiplier': ecl_engine.LIFETIME_PD_MULTIPLIER,
+        'pd_cap': 1.0,
+        'stage3': [{'field': 'days_past_due', 'op': '>', 'value': ecl_engine.STAGE3_DPD}],
+        'sicr': [{'field': 'days_past_due', 'op': '>=', 'value': ecl_engine.SICR_DPD},
+                 {'field': 'score_drop', 'op': '>', 'value': ecl_engine.SICR_SCORE_DROP},
+                 {'field': 'pd_12m', 'op': '>', 'value': ecl_engine.SICR_PD_THRESHOLD}],
+    }
+
+
+# =============================================================================
+# RULE FILES
+# =============================================================================
+
+def _number(text):
+    value = float(text)
+    return int(value) if value.is_integer() and '.' not in text else value
+
+
+def _rules_from_csv(rows):
+    """Rule set from long-format rows: table, key, op, value, upper
+
+    Only tables with rows are set, so the rest keep their defaults. A
+    ``stage3,none`` or ``sicr,none`` row switches that criteria set off.
+    """
+    rules = {}
+    for row in rows:
+        table, key, op, value, upper = (row.get(c, '').strip() for c in CSV_COLUMNS)
+        if not table or table.startswith('#'):
+            continue
+        if table == 'pd_band':
+            rules.setdefault('pd_bands', []).append({'min_score': _number(key), 'pd': float(value)})
+        elif table == 'dpd_multiplier':
+            band = {'multiplier': float(value)}
+            if key:
+                band['max_dpd'] = _number(key)
+            rules.setdefault('dpd_multipliers', []).append(band)
+        elif table == 'product_pd_adj':
+            if key == '*':
+                rules['default_pd_adj'] = float(value)
+            else:
+                rules.setdefault('product_pd_adj', {})[key] = float(value)
+        elif table == 'lgd':
+            if key == '*':
+                rules['default_lgd'] = float(value)
+            else:
+                rules.setdefault('lgd', {})[key] = [float(value), float(upper or value)]
+        elif table == 'param':
+            rules[key] = value if key == 'name' else float(value)
+        elif table in ('stage3', 'sicr'):
+            criteria = rules.setdefault(table, [])
+            if key == 'none':
+                continue
+            if op == 'in':
+                criterion_value = [v.strip() for v in value.split('|')]
+            else:
+                criterion_value = value if key == 'product_type' else _number(value)
+            criteria.append({'field': key, 'op': op, 'value': criterion_value})
+        else:
+            raise ValueError(f"Unknown rule table {table!r}")
+    return rules
+
+
+def _rules_to_csv_rows(rules):
+    rows = [{'table': 'param', 'key': 'name', 'value': rules['name']}] if 'name' in rules else []
+    rows += [{'table': 'pd_band', 'key': b['min_score'], 'value': b['pd']} for b in rules.get('pd_bands', [])]
+    rows += [{'table': 'dpd_multiplier', 'key': b.get('max_dpd', ''), 'value': b['multiplier']}
+             for b in rules.get('dpd_multipliers', [])]
+    rows += [{'table': 'product_pd_adj', 'key': p, 'value': v} for p, v in rules.get('product_pd_adj', {}).items()]
+    if 'default_pd_adj' in rules:
+        rows.append({'table': 'product_pd_adj', 'key': '*', 'value': rules['default_pd_adj']})
+    rows += [{'table': 'lgd', 'key': p, 'value': lo, 'upper': hi} for p, (lo, hi) in rules.get('lgd', {}).items()]
+    if 'default_lgd' in rules:
+        rows.append({'table': 'lgd', 'key': '*', 'value': rules['default_lgd']})
+    rows += [{'table': 'param', 'key': k, 'value': rules[k]} for k in ('lifetime_pd_multiplier', 'pd_cap') if k in rules]
+    for table in ('stage3', 'sicr'):
+        if table in rules and not rules[table]:
+            rows.append({'table': table, 'key': 'none'})
+        for c in rules.get(table, []):
+            value = '|'.join(c['value']) if isinstance(c['value'], list) else c['value']
+            rows.append({'table': table, 'key': c['field'], 'op': c['op'], 'value': value})
+    return rows
+
+
+def load_rules(path):
+    """Read a rule set from .yaml/.yml, .json or .csv"""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='') as f:
+        if extension in ('.yaml', '.yml'):
+            import yaml
+            rules = yaml.safe_load(f)
+        elif extension == '.json':
+            rules = json.load(f)
+        elif extension == '.csv':
+            rules = _rules_from_csv(csv.DictReader(f))
+        else:
+            raise ValueError(f"Unsupported rule file format: {path}")
+    rules.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    return rules
+
+
+def save_rules(rules, path):
+    """Write a rule set as .yaml/.yml, .json or .csv"""
+    extension = os.path.splitext(path)[1].lower()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        if extension in ('.yaml', '.yml'):
+            import yaml
+            yaml.safe_dump(rules, f, sort_keys=False)
+        elif extension == '.json':
+            json.dump(rules, f, indent=2)
+        elif extension == '.csv':
+            writer = csv.DictWriter(f, CSV_COLUMNS)
+            writer.writeheader()
+            writer.writerows(_rules_to_csv_rows(rules))
+        else:
+            raise ValueError(f"Unsupported rule file format: {path}")
+
+
+# =============================================================================
+# COMPILATION
+# =============================================================================
+
+def normalize_rules(rules):
+    """Validated rule set with defaults filled in and bands sorted (the hashed form)
+
+    Anything a rule set leaves out, including products missing from its
+    ``product_pd_adj`` or ``lgd`` table, keeps the default_rules() value. An
+    empty ``stage3`` or ``sicr`` list switches that criteria set off.
+    """
+    base = default_rules()
+    missing = [key for key in ('pd_bands', 'dpd_multipliers') if not rules.get(key)]
+    if missing:
+        raise ValueError(f"Rule set is missing {', '.join(missing)}")
+
+    unknown = (set(rules.get('product_pd_adj', {})) | set(rules.get('lgd', {}))) - set(PRODUCT_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown products in rule set: {', '.join(sorted(unknown))}")
+
+    pd_bands = sorted(({'min_score': float(b['min_score']), 'pd': float(b['pd'])} for b in rules['pd_bands']),
+                      key=lambda b: b['min_score'])
+    dpd_bands = sorted(({'max_dpd': float(b['max_dpd']) if b.get('max_dpd') is not None else None,
+                         'multiplier': float(b['multiplier'])} for b in rules['dpd_multipliers']),
+                       key=lambda b: np.inf if b['max_dpd'] is None else b['max_dpd'])
+    if dpd_bands[-1]['max_dpd'] is not None:
+        raise ValueError("dpd_multipliers needs a top band without max_dpd")
+
+    criteria = {}
+    for table in ('stage3', 'sicr'):
+        criteria[table] = []
+        for c in rules.get(table, base[table]):
+            if c['field'] not in CRITERION_FIELDS or c['op'] not in OPERATORS:
+                raise ValueError(f"Invalid {table} criterion: {c}")
+            value = c['value']
+            if c['field'] == 'product_type':
+                value = sorted(value) if isinstance(value, list) else value
+            else:
+                value = [float(v) for v in value] if isinstance(value, list) else float(value)
+            criteria[table].append({'field': c['field'], 'op': c['op'], 'value': value})
+
+    lgd = {}
+    for product in PRODUCT_TYPES:
+        low, high = (float(v) for v in rules.get('lgd', {}).get(product, base['lgd'][product]))
+        if not 0 <= low <= high <= 1:
+            raise ValueError(f"Invalid LGD range for {product}: {[low, high]}")
+        lgd[product] = [low, high]
+
+    return {
+        'pd_bands': pd_bands,
+        'dpd_multipliers': dpd_bands,
+        'product_pd_adj': {p: float(rules.get('product_pd_adj', {}).get(p, base['product_pd_adj'][p]))
+                           for p in PRODUCT_TYPES},
+        'default_pd_adj': float(rules.get('default_pd_adj', base['default_pd_adj'])),
+        'lgd': lgd,
+        'default_lgd': float(rules.get('default_lgd', base['default_lgd'])),
+        'lifetime_pd_multiplier': float(rules.get('lifetime_pd_multiplier', base['lifetime_pd_multiplier'])),
+        'pd_cap': float(rules.get('pd_cap', base['pd_cap'])),
+        'stage3': criteria['stage3'],
+        'sicr': criteria['sicr'],
+    }
+
+
+def rules_hash(rules):
+    """Content hash of a rule set (the name is not part of it)"""
+    normalized = normalize_rules(rules)
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+class LoanArrays:
+    """The loan attributes the rules read, extracted once per loan tape
+
+    With ``rng`` (or ``seed``) each loan gets the uniform that ecl_engine
+    would turn into its LGD draw, so any rule set's LGD ranges can be applied
+    to the same draws. Without one, the tape's own ``lgd`` column is used,
+    which only rule sets with the default LGD ranges accept.
+    """
+
+    def __init__(self, df, rng=None, seed=None):
+        self.index = df.index
+        self.n = len(df)
+        self.codes = ecl_engine.product_codes(df['product_type']).astype(np.intp)
+        self.fields = {
+            'days_past_due': np.asarray(df['days_past_due']),
+            'credit_score_current': np.asarray(df['credit_score_current']),
+            'credit_score_origination': np.asarray(df['credit_score_origination']),
+            'outstanding_balance': np.asarray(df['outstanding_balance'], dtype=np.float64),
+        }
+        self.fields['score_drop'] = (self.fields['credit_score_origination'].astype(np.int64)
+                                     - self.fields['credit_score_current'])
+        if seed is not None:
+            rng = np.random.default_rng(seed)
+        if rng is not None:
+            # Same five-per-loan stream as ecl_engine.lgd_vectorized; uniform(low, high) == low + (high - low) * u
+            uniforms = rng.random((self.n, len(PRODUCT_TYPES)))
+            self.lgd_uniform = uniforms[np.arange(self.n), np.maximum(self.codes, 0)]
+            self.tape_lgd = None
+        elif 'lgd' in df.columns:
+            self.lgd_uniform = None
+            self.tape_lgd = np.asarray(df['lgd'], dtype=np.float64)
+        else:
+            raise ValueError("Loans without an lgd column need an rng or seed for the LGD draws")
+
+
+class RulePlan:
+    """A compiled rule set: lookup arrays plus staging masks"""
+
+    def __init__(self, rules):
+        normalized = normalize_rules(rules)
+        self.name = rules.get('name', 'rules')
+        self.hash = hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+        self.rules = normalized
+
+        bands = normalized['pd_bands']
+        self.score_edges = np.array([b['min_score'] for b in bands[1:]])
+        self.base_pd = np.array([b['pd'] for b in bands])
+        dpd = normalized['dpd_multipliers']
+        self.dpd_edges = np.array([b['max_dpd'] for b in dpd[:-1]])
+        self.dpd_multipliers = np.array([b['multiplier'] for b in dpd])
+        # Trailing entry is picked by code -1 (unknown product)
+        self.product_adj = np.array([normalized['product_pd_adj'][p] for p in PRODUCT_TYPES]
+                                    + [normalized['default_pd_adj']])
+        default_lgd = normalized['default_lgd']
+        ranges = [normalized['lgd'][p] for p in PRODUCT_TYPES]
+        self.lgd_low = np.array([r[0] for r in ranges] + [default_lgd])
+        self.lgd_range = np.array([r[1] for r in ranges] + [default_lgd]) - self.lgd_low
+        self.lgd_range[-1] = 0.0
+        base = normalize_rules(default_rules())
+        self.overrides_lgd = (normalized['lgd'], default_lgd) != (base['lgd'], base['default_lgd'])
+        self.lifetime_multiplier = normalized['lifetime_pd_multiplier']
+        self.pd_cap = normalized['pd_cap']
+        self.stage3 = [self._criterion(c) for c in normalized['stage3']]
+        self.sicr = [self._criterion(c) for c in normalized['sicr']]
+
+    def __repr__(self):
+        return f"RulePlan({self.name!r}, {self.hash[:12]})"
+
+    @staticmethod
+    def _criterion(c):
+        value = c['value']
+        if c['field'] == 'product_type':
+            names = value if isinstance(value, list) else [value]
+            value = [PRODUCT_TYPES.index(v) if v in PRODUCT_TYPES else -2 for v in names]
+            value = value if c['op'] == 'in' else value[0]
+        return c['field'], OPERATORS[c['op']], value
+
+    @staticmethod
+    def _mask(criteria, values, n):
+        mask = np.zeros(n, dtype=bool)
+        for field, op, value in criteria:
+            mask |= op(values[field], value)
+        return mask
+
+    def evaluate(self, loans):
+        """pd_12m, pd_lifetime, lgd, ifrs9_stage, ecl_amount and ecl_rate (rounded as ecl_engine)"""
+        fields = loans.fields
+        band = np.searchsorted(self.score_edges, fields['credit_score_current'], side='right')
+        dpd_band = np.searchsorted(self.dpd_edges, fields['days_past_due'], side='left')
+        pd_raw = np.minimum(self.base_pd[band] * self.dpd_multipliers[dpd_band] * self.product_adj[loans.codes],
+                            self.pd_cap)
+        pd_12m = np.round(pd_raw, 6)
+        pd_lifetime = np.round(np.minimum(pd_raw * self.lifetime_multiplier, self.pd_cap), 6)
+
+        if loans.lgd_uniform is not None:
+            lgd = self.lgd_low[loans.codes] + self.lgd_range[loans.codes] * loans.lgd_uniform
+            lgd = np.round(lgd, 4)
+        elif self.overrides_lgd:
+            raise ValueError(f"Rule set {self.name!r} overrides the LGD ranges, but the loans carry the tape's "
+                             f"LGD; prepare them with an rng or seed (run --seed) to redraw under its ranges")
+        else:
+            lgd = loans.tape_lgd
+
+        values = dict(fields, pd_12m=pd_12m, pd_lifetime=pd_lifetime, product_type=loans.codes)
+        stage = np.where(self._mask(self.stage3, values, loans.n), 3,
+                         np.where(self._mask(self.sicr, values, loans.n), 2, 1))
+
+        balance = fields['outstanding_balance']
+        ecl = pd.Series(ecl_engine.ecl_vectorized(balance, stage, pd_12m, pd_lifetime, lgd), index=loans.index).round(2)
+        return pd.DataFrame({
+            'pd_12m': pd_12m, 'pd_lifetime': pd_lifetime, 'lgd': lgd, 'ifrs9_stage': stage,
+            'ecl_amount': ecl, 'ecl_rate': (ecl / balance * 100).round(4),
+        }, index=loans.index)
+
+
+# Compiled plans by rules_hash, and rule files by content hash
+_PLANS = {}
+_FILES = {}
+
+
+def compile_rules(rules):
+    """Compiled plan for a rule set, reused for any rule set with the same hash"""
+    key = rules_hash(rules)
+    plan = _PLANS.get(key)
+    if plan is None:
+        plan = _PLANS[key] = RulePlan(rules)
+    return plan
+
+
+def load_plan(path):
+    """Compiled plan for a rule file; an unchanged file is not parsed again"""
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    key = _FILES.get((path, digest))
+    if key is None or key not in _PLANS:
+        plan = compile_rules(load_rules(path))
+        _FILES[(path, digest)] = plan.hash
+        return plan
+    return _PLANS[key]
+
+
+def clear_cache():
+    _PLANS.clear()
+    _FILES.clear()
+
+
+def evaluate_entities(loans, rule_sets):
+    """Portfolio totals under each entity's rule set (rule set dicts or file paths)"""
+    rows = []
+    for entity, rules in rule_sets.items():
+        plan = load_plan(rules) if isinstance(rules, str) else compile_rules(rules)
+        result = plan.evaluate(loans)
+        stages = np.bincount(result['ifrs9_stage'].to_numpy(), minlength=4)
+        exposure = loans.fields['outstanding_balance'].sum()
+        rows.append({
+            'entity': entity, 'rules': plan.hash[:12], 'total_ecl': result['ecl_amount'].sum(),
+            'coverage_%': result['ecl_amount'].sum() / exposure * 100,
+            'stage_1': stages[1], 'stage_2': stages[2], 'stage_3': stages[3],
+        })
+    return pd.DataFrame(rows).set_index('entity')
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def random_rules(n_sets, seed=0):
+    """Entity rule sets perturbing the default bands, multipliers, LGDs and SICR thresholds"""
+    rng = np.random.default_rng(seed)
+    rule_sets = {}
+    for i in range(n_sets):
+        rules = default_rules()
+        rules['name'] = f'entity_{i:03d}'
+        for band in rules['pd_bands']:
+            band['pd'] = round(band['pd'] * rng.uniform(0.8, 1.25), 5)
+        for band in rules['dpd_multipliers']:
+            band['multiplier'] = round(band['multiplier'] * rng.uniform(0.9, 1.1), 3)
+        rules['lgd'] = {p: sorted(np.round(np.clip(np.array(r) * rng.uniform(0.9, 1.1), 0, 1), 3).tolist())
+                        for p, r in rules['lgd'].items()}
+        rules['sicr'][1]['value'] = int(rng.choice([80, 100, 120]))
+        rules['sicr'][2]['value'] = round(float(rng.uniform(0.02, 0.05)), 3)
+        rule_sets[rules['name']] = rules
+    return rule_sets
+
+
+def verify_default(n_loans=200_000, seed=42):
+    """Default rules reproduce ecl_engine.run_ecl_pipeline exactly"""
+    import portfolio_generator
+
+    df = portfolio_generator.generate_loan_portfolio_batched(n_loans, seed=seed)
+    expected = ecl_engine.run_ecl_pipeline(df.copy(), np.random.default_rng(seed + 1))
+    result = compile_rules(default_rules()).evaluate(LoanArrays(df, seed=seed + 1))
+    for column in result.columns:
+        np.testing.assert_array_equal(result[column].to_numpy(), expected[column].to_numpy(), err_msg=column)
+
+
+def verify_formats(work_dir, n_loans=50_000, seed=42):
+    """The same rule set gives identical plans and results from YAML, JSON and CSV"""
+    import portfolio_generator
+
+    base = default_rules()
+    partial = {'pd_bands': base['pd_bands'], 'dpd_multipliers': base['dpd_multipliers']}
+    rule_sets = {'default': base, 'partial': partial, 'no_sicr': dict(partial, sicr=[]),
+                 **random_rules(1, seed)}
+    loans = LoanArrays(portfolio_generator.generate_loan_portfolio_batched(n_loans, seed=seed), seed=seed)
+    os.makedirs(work_dir, exist_ok=True)
+    for name, rules in rule_sets.items():
+        results = {}
+        for extension in ('yaml', 'json', 'csv'):
+            path = os.path.join(work_dir, f"verify_{name}.{extension}")
+            save_rules(rules, path)
+            plan = RulePlan(load_rules(path))
+            results[extension] = (plan.hash, plan.evaluate(loans))
+        for extension in ('json', 'csv'):
+            assert results[extension][0] == results['yaml'][0], f"{name}: {extension} plan differs from yaml"
+            pd.testing.assert_frame_equal(results[extension][1], results['yaml'][1], check_exact=True)
+    # Tables a rule set leaves out keep the defaults; an empty list switches criteria off
+    assert rules_hash(partial) == rules_hash(base)
+    assert rules_hash(dict(partial, sicr=[])) != rules_hash(base)
+
+
+def benchmark(n_loans, n_sets, work_dir, seed=42):
+    """Many entity rule sets over one tape: parse + compile once, then vectorized evaluation"""
+    import portfolio_generator
+
+    os.makedirs(work_dir, exist_ok=True)
+    rule_sets = random_rules(n_sets, seed)
+    paths = {}
+    for i, (entity, rules) in enumerate(rule_sets.items()):
+        paths[entity] = os.path.join(work_dir, f"{entity}.{('yaml', 'csv', 'json')[i % 3]}")
+        save_rules(rules, paths[entity])
+
+    df = portfolio_generator.generate_loan_portfolio_batched(n_loans, seed=seed, compact=True)
+    timings = {}
+    start = time.perf_counter()
+    loans = LoanArrays(df, seed=seed)
+    timings['prepare loan tape'] = time.perf_counter() - start
+
+    clear_cache()
+    start = time.perf_counter()
+    for path in paths.values():
+        load_plan(path)
+    timings[f'parse + compile {n_sets} rule sets'] = time.perf_counter() - start
+    start = time.perf_counter()
+    for path in paths.values():
+        load_plan(path)
+    timings[f'cached plans {n_sets} rule sets'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    totals = evaluate_entities(loans, paths)
+    timings[f'evaluate {n_sets} entities'] = time.perf_counter() - start
+
+    # Reference: the same rule set through ecl_engine's pipeline on a copy of the tape, per entity
+    start = time.perf_counter()
+    ecl_engine.run_ecl_pipeline(df.copy(), np.random.default_rng(seed))
+    timings['ecl_engine pipeline, one entity'] = time.perf_counter() - start
+    return timings, totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rule-table driven PD/LGD/staging engine")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    template_parser = subparsers.add_parser('template', help="Write the default rule set (.yaml, .json or .csv)")
+    template_parser.add_argument('path')
+
+    run_parser = subparsers.add_parser('run', help="Evaluate entity rule sets over one loan tape")
+    run_parser.add_argument('source', help="Portfolio file or project.dataset.table")
+    run_parser.add_argument('rules', nargs='+', help="Rule files, one per entity")
+    run_parser.add_argument('--seed', type=int, help="Redraw LGDs from this seed instead of using the tape's")
+
+    bench_parser = subparsers.add_parser('benchmark', help="Many entity rule sets over one tape")
+    bench_parser.add_argument('--n-loans', type=int, default=1_000_000)
+    bench_parser.add_argument('--n-sets', type=int, default=20)
+    bench_parser.add_argument('--work-dir', default='rules_benchmark')
+
+    args = parser.parse_args()
+
+    if args.command == 'template':
+        save_rules(default_rules(), args.path)
+        print(f"✅ Saved: {args.path}")
+
+    elif args.command == 'run':
+        import data_source
+
+        entities = {os.path.splitext(os.path.basename(path))[0]: path for path in args.rules}
+        if len(entities) < len(args.rules):
+            names = [os.path.splitext(os.path.basename(path))[0] for path in args.rules]
+            duplicates = sorted({name for name in names if names.count(name) > 1})
+            parser.error(f"Rule files must have distinct names (one entity each): {', '.join(duplicates)}")
+        overriding = [entity for entity, path in entities.items() if load_plan(path).overrides_lgd]
+        if overriding and args.seed is None:
+            parser.error(f"Rule sets with their own LGD ranges need --seed to redraw LGDs: {', '.join(overriding)}")
+        df = data_source.open_source(args.source).read()
+        loans = LoanArrays(df, seed=args.seed)
+        pd.set_option('display.width', 200)
+        print(evaluate_entities(loans, entities).round(2).to_string())
+
+    elif args.command == 'benchmark':
+        verify_default()
+        verify_formats(args.work_dir)
+        timings, totals = benchmark(args.n_loans, args.n_sets, args.work_dir)
+        print(f"{args.n_sets} entity rule sets over {args.n_loans:,} loans (default rules verified against "
+              f"ecl_engine, YAML/JSON/CSV loading verified identical):")
+        for label, seconds in timings.items():
+            print(f"  {label:<36} {seconds:8.3f}s")
+        print(f"\n{totals[['total_ecl', 'coverage_%', 'stage_2', 'stage_3']].head().round(2).to_string()}")
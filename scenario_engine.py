@@ -0,0 +1,272 @@
+"""
+Multi-Scenario Forward-Looking ECL
+Probability-weighted ECL across macro scenarios. Each scenario scales PD and
+LGD by product and region; all scenarios are evaluated together as a
+(loans x scenarios) matrix in row blocks, so N scenarios cost one scan of
+the portfolio instead of N (cf. section 10 of sql_queries.sql).
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import ecl_engine
+import portfolio_schema
+
+BLOCK_SIZE = 200_000
+
+# Weights sum to 1; multipliers default to 1.0 where not given
+DEFAULT_SCENARIOS = [
+    {'name': 'Base', 'weight': 0.50},
+    {'name': 'Upside', 'weight': 0.20, 'pd_multiplier': 0.85, 'lgd_multiplier': 0.95},
+    {'name': 'Downside', 'weight': 0.25, 'pd_multiplier': 1.5, 'lgd_multiplier': 1.1,
+     'pd_by_product': {'Credit Card': 1.2, 'Personal Loan': 1.1}},
+    {'name': 'Severe', 'weight': 0.05, 'pd_multiplier': 2.5, 'lgd_multiplier': 1.25,
+     'pd_by_product': {'SME Loan': 1.3}, 'lgd_by_product': {'Mortgage': 1.3}},
+]
+
+
+def load_scenarios(path):
+    """Read a JSON list of scenario definitions"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def compile_scenarios(scenarios):
+    """PD and LGD multiplier tables indexed by (product x region cell, scenario)
+
+    Scenario weights are normalised to sum to one.
+    """
+    products = ecl_engine.PRODUCT_TYPES
+    regions = portfolio_schema.REGIONS
+    n_cells = (len(products) + 1) * len(regions)
+    pd_table = np.ones((n_cells, len(scenarios)))
+    lgd_table = np.ones((n_cells, len(scenarios)))
+
+    for s, scenario in enumerate(scenarios):
+        for table, kind in ((pd_table, 'pd'), (lgd_table, 'lgd')):
+            factor = np.full((len(products) + 1, len(regions)), float(scenario.get(f'{kind}_multiplier', 1.0)))
+            for product, value in scenario.get(f'{kind}_by_product', {}).items():
+                factor[products.index(product)] *= value
+            for region, value in scenario.get(f'{kind}_by_region', {}).items():
+                factor[:, regions.index(region)] *= value
+            table[:, s] = factor.ravel()
+
+    weights = np.array([float(s['weight']) for s in scenarios])
+    if (weights < 0).any() or weights.sum() <= 0:
+        raise ValueError("Scenario weights must be non-negative and not all zero")
+    names = [s['name'] for s in scenarios]
+    return names, weights / weights.sum(), pd_table, lgd_table
+
+
+def _cell_codes(df):
+    """Row of the multiplier tables for each loan (unknown products use the last block)"""
+    product = ecl_engine.product_codes(df['product_type']).astype(np.intp)
+    product[product < 0] = len(ecl_engine.PRODUCT_TYPES)
+    geography = df['geography']
+    if isinstance(geography.dtype, pd.CategoricalDtype):
+        region = geography.cat.set_categories(portfolio_schema.REGIONS).cat.codes.to_numpy()
+    else:
+        region = pd.Categorical(geography.to_numpy(), categories=portfolio_schema.REGIONS).codes
+    if (region < 0).any():
+        raise ValueError("geography contains regions outside portfolio_schema.REGIONS")
+    return product * len(portfolio_schema.REGIONS) + region
+
+
+def _scenario_block(pd_12m, pd_lifetime, lgd, balance, pd_factor, lgd_factor, lifetime, restage):
+    """Loans x scenarios ECL matrix and lifetime-ECL flags for one block of rows"""
+    stressed_12m = np.minimum(pd_12m[:, None] * pd_factor, 1.0)
+    stressed_lifetime = np.minimum(pd_lifetime[:, None] * pd_factor, 1.0)
+    lifetime = lifetime[:, None]
+    if restage:
+        lifetime = lifetime | (stressed_12m > ecl_engine.SICR_PD_THRESHOLD)
+    ecl = np.where(lifetime, stressed_lifetime, stressed_12m)
+    ecl *= np.minimum(lgd[:, None] * lgd_factor, 1.0)
+    ecl *= balance[:, None]
+    return ecl, lifetime
+
+
+def scenario_ecl(df, scenarios=DEFAULT_SCENARIOS, restage=True, block_size=BLOCK_SIZE):
+    """Per-loan weighted ECL and per-scenario totals in one pass over the loans
+
+    With ``restage`` the SICR PD test is re-run on each scenario's stressed
+    12-month PD, so loans can move between Stage 1 and Stage 2 per scenario.
+
+    Multipliers are constant within a product x region cell, so a loan whose
+    stage cannot change and whose stressed PD and LGD cannot reach the 1.0
+    cap contributes ``balance * pd * lgd`` times a per-cell factor to every
+    scenario. Only the remaining loans are evaluated as a matrix.
+    """
+    names, weights, pd_table, lgd_table = compile_scenarios(scenarios)
+    n_scenarios = len(names)
+    cells = _cell_codes(df)
+
+    balance = df['outstanding_balance'].to_numpy(dtype=np.float64)
+    pd_12m = df['pd_12m'].to_numpy(dtype=np.float64)
+    pd_lifetime = df['pd_lifetime'].to_numpy(dtype=np.float64)
+    lgd = df['lgd'].to_numpy(dtype=np.float64)
+    pd_max = pd_table.max(axis=1, initial=0.0)[cells]
+
+    if restage:
+        # Stage 3 and the non-PD SICR triggers do not depend on the scenario
+        days_past_due = df['days_past_due'].to_numpy()
+        score_drop = (df['credit_score_origination'].to_numpy(dtype=np.int64)
+                      - df['credit_score_current'].to_numpy(dtype=np.int64))
+        stage3 = days_past_due > ecl_engine.STAGE3_DPD
+        lifetime = (stage3 | (days_past_due >= ecl_engine.SICR_DPD)
+                    | (score_drop > ecl_engine.SICR_SCORE_DROP)
+                    | (pd_12m * pd_table.min(axis=1, initial=np.inf)[cells] > ecl_engine.SICR_PD_THRESHOLD))
+        fixed_stage = lifetime | (pd_12m * pd_max <= ecl_engine.SICR_PD_THRESHOLD)
+        stage = np.where(stage3, 3, np.where(lifetime, 2, 1))
+    else:
+        stage = df['ifrs9_stage'].to_numpy().astype(np.intp)
+        lifetime = stage != 1
+        fixed_stage = np.ones(len(df), dtype=bool)
+
+    pd_applied = np.where(lifetime, pd_lifetime, pd_12m)
+    linear = (fixed_stage
+              & (pd_applied * pd_max <= 1.0)
+              & (lgd * lgd_table.max(axis=1, initial=0.0)[cells] <= 1.0))
+
+    # Linear loans: one multiply per loan, one bincount per cell
+    factor = pd_table * lgd_table
+    base_ecl = np.where(linear, balance * pd_applied * lgd, 0.0)
+    weighted_ecl = base_ecl * (factor @ weights)[cells]
+    totals = np.bincount(cells, weights=base_ecl, minlength=len(factor)) @ factor
+    stage_counts = np.repeat(np.bincount(stage[linear], minlength=4)[1:, None], n_scenarios, axis=1)
+
+    # Remaining loans: full loans x scenarios matrix, in row blocks
+    rows = np.flatnonzero(~linear)
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        block_cells = cells[block]
+        ecl, block_lifetime = _scenario_block(
+            pd_12m[block], pd_lifetime[block], lgd[block], balance[block],
+            pd_table[block_cells], lgd_table[block_cells], lifetime[block], restage)
+        if restage:
+            n_stage3 = (stage[block] == 3).sum()
+            n_lifetime = np.broadcast_to(block_lifetime, ecl.shape).sum(axis=0)
+            stage_counts[0] += len(block) - n_lifetime
+            stage_counts[1] += n_lifetime - n_stage3
+            stage_counts[2] += n_stage3
+        else:
+            stage_counts += np.bincount(stage[block], minlength=4)[1:, None]
+
+        totals += ecl.sum(axis=0)
+        weighted_ecl[block] = ecl @ weights
+
+    exposure = balance.sum()
+    summary = pd.DataFrame({
+        'weight': weights,
+        'total_ecl': totals,
+        'coverage_pct': totals / exposure * 100,
+        'stage_1': stage_counts[0],
+        'stage_2': stage_counts[1],
+        'stage_3': stage_counts[2],
+    }, index=pd.Index(names, name='scenario'))
+    summary.loc['Probability-weighted'] = [
+        1.0, weights @ totals, weights @ totals / exposure * 100,
+        *(stage_counts @ weights).round()]
+    stage_columns = ['stage_1', 'stage_2', 'stage_3']
+    summary[stage_columns] = summary[stage_columns].astype(np.int64)
+    return weighted_ecl.round(2), summary
+
+
+def apply_scenarios(df, scenarios=DEFAULT_SCENARIOS, restage=True):
+    """Add the probability-weighted ECL column and return the scenario summary"""
+    weighted_ecl, summary = scenario_ecl(df, scenarios, restage)
+    df['ecl_weighted'] = weighted_ecl
+    return summary
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def random_scenarios(n_scenarios, seed=0):
+    """n_scenarios scenarios with random product/region PD and LGD multipliers"""
+    rng = np.random.default_rng(seed)
+    weights = rng.dirichlet(np.ones(n_scenarios))
+    return [{
+        'name': f'Scenario {s + 1}',
+        'weight': float(weights[s]),
+        'pd_multiplier': float(rng.uniform(0.8, 2.5)),
+        'lgd_multiplier': float(rng.uniform(0.9, 1.3)),
+        'pd_by_product': {p: float(rng.uniform(0.9, 1.3)) for p in ecl_engine.PRODUCT_TYPES},
+        'pd_by_region': {r: float(rng.uniform(0.9, 1.2)) for r in portfolio_schema.REGIONS},
+        'lgd_by_region': {r: float(rng.uniform(0.95, 1.1)) for r in portfolio_schema.REGIONS},
+    } for s in range(n_scenarios)]
+
+
+def rescan_ecl(df, scenarios):
+    """Reference: one full pandas pass per scenario, stages held fixed"""
+    totals = []
+    for scenario in scenarios:
+        pd_factor = pd.Series(scenario.get('pd_multiplier', 1.0), index=df.index)
+        lgd_factor = pd.Series(scenario.get('lgd_multiplier', 1.0), index=df.index)
+        for column, kind in (('product_type', 'by_product'), ('geography', 'by_region')):
+            labels = df[column]
+            pd_factor *= labels.map(scenario.get(f'pd_{kind}', {})).astype(float).fillna(1.0)
+            lgd_factor *= labels.map(scenario.get(f'lgd_{kind}', {})).astype(float).fillna(1.0)
+        pd_applied = df['pd_12m'].where(df['ifrs9_stage'] == 1, df['pd_lifetime'])
+        ecl = (df['outstanding_balance'] * (pd_applied * pd_factor).clip(upper=1.0)
+               * (df['lgd'] * lgd_factor).clip(upper=1.0))
+        totals.append(ecl.sum())
+    return np.array(totals)
+
+
+def benchmark(n_loans, n_scenarios, seed=42):
+    """Time the batched pass against one rescan per scenario (stages held fixed)"""
+    import portfolio_generator
+
+    df = pd.concat(portfolio_generator.iter_portfolio_chunks(n_loans, seed=seed), ignore_index=True)
+    scenarios = random_scenarios(n_scenarios)
+
+    start = time.perf_counter()
+    _, summary = scenario_ecl(df, scenarios, restage=False)
+    batched_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = rescan_ecl(df, scenarios)
+    rescan_seconds = time.perf_counter() - start
+
+    np.testing.assert_allclose(summary['total_ecl'].to_numpy()[:-1], expected, rtol=1e-9)
+    return rescan_seconds, batched_seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Probability-weighted multi-scenario ECL")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Scenario ECL for a portfolio file")
+    run_parser.add_argument('input', help="Portfolio file (CSV, Parquet or Feather)")
+    run_parser.add_argument('--scenarios', help="JSON list of scenarios (default: built-in four)")
+    run_parser.add_argument('--no-restage', action='store_true', help="Keep reported stages in every scenario")
+    run_parser.add_argument('--output', help="Write the portfolio with an ecl_weighted column")
+
+    bench_parser = subparsers.add_parser('benchmark', help="Batched pass vs one rescan per scenario")
+    bench_parser.add_argument('--n-loans', type=int, default=10_000_000)
+    bench_parser.add_argument('--n-scenarios', type=int, default=50)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        import portfolio_io
+
+        df = portfolio_io.read_portfolio(args.input)
+        scenarios = load_scenarios(args.scenarios) if args.scenarios else DEFAULT_SCENARIOS
+        summary = apply_scenarios(df, scenarios, restage=not args.no_restage)
+        print(f"Scenario ECL for {len(df):,} loans (reported ECL ${df['ecl_amount'].sum():,.0f}):")
+        print(summary.to_string(float_format=lambda v: f"{v:,.2f}"))
+        if args.output:
+            portfolio_io.write_portfolio(df, args.output)
+            print(f"✅ Saved: {args.output}")
+
+    elif args.command == 'benchmark':
+        rescan_seconds, batched_seconds = benchmark(args.n_loans, args.n_scenarios)
+        print(f"{args.n_scenarios} scenarios over {args.n_loans:,} loans (verified equal):")
+        print(f"  one rescan per scenario:  {rescan_seconds:8.3f}s")
+        print(f"  batched matrix pass:      {batched_seconds:8.3f}s")
@@ -6,10 +6,13 @@ This script creates the necessary BigQuery dataset and table
 from google.cloud import bigquery
 import os
 
+import query_cache
+
 # Configuration
 PROJECT_ID = "your-gcp-project-id"  # Replace with your GCP project ID
 DATASET_ID = "credit_risk_ifrs9"
 TABLE_ID = "loan_portfolio"
+QUERY_CACHE_DIR = query_cache.CACHE_DIR  # Result cache the dashboards read (IFRS9_QUERY_CACHE overrides)
 
 def create_bigquery_dataset(client, dataset_id):
     """Create BigQuery dataset if it doesn't exist"""
@@ -72,19 +75,26 @@ def create_loan_portfolio_table(client, dataset_id, table_id):
         print(f"Table {table_id} might already exist: {e}")
 
 
-def load_data_to_bigquery(client, dataset_id, table_id, csv_file):
-    """Load CSV data into BigQuery table"""
+def load_data_to_bigquery(client, dataset_id, table_id, source_file_path, cache_dir=QUERY_CACHE_DIR):
+    """Load CSV or Parquet data into BigQuery table"""
     
     table_ref = f"{PROJECT_ID}.{dataset_id}.{table_id}"
     
-    job_config = bigquery.LoadJobConfig(
-        source_format=bigquery.SourceFormat.CSV,
-        skip_leading_rows=1,
-        autodetect=False,
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,  # Overwrite existing data
-    )
+    if source_file_path.endswith(".parquet"):
+        # Parquet carries its own typed schema (dates, categoricals, narrow ints)
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,  # Overwrite existing data
+        )
+    else:
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.CSV,
+            skip_leading_rows=1,
+            autodetect=False,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,  # Overwrite existing data
+        )
     
-    with open(csv_file, "rb") as source_file:
+    with open(source_file_path, "rb") as source_file:
         job = client.load_table_from_file(source_file, table_ref, job_config=job_config)
     
     job.result()  # Wait for the job to complete
@@ -92,6 +102,9 @@ def load_data_to_bigquery(client, dataset_id, table_id, csv_file):
     table = client.get_table(table_ref)
     print(f"Loaded {table.num_rows} rows into {table_id}")
 
+    # Cached query results for the previous snapshot are now stale
+    query_cache.QueryCache(cache_dir).invalidate(table_id)
+
 
 def main():
     """Main setup function"""
@@ -110,12 +123,13 @@ def main():
         # Create table
         create_loan_portfolio_table(client, DATASET_ID, TABLE_ID)
         
-        # Load data
-        csv_file = "loan_portfolio_data.csv"
-        if os.path.exists(csv_file):
-            load_data_to_bigquery(client, DATASET_ID, TABLE_ID, csv_file)
+        # Load data (prefer Parquet, fall back to CSV)
+        data_files = ["loan_portfolio_data.parquet", "loan_portfolio_data.csv"]
+        data_file = next((f for f in data_files if os.path.exists(f)), None)
+        if data_file:
+            load_data_to_bigquery(client, DATASET_ID, TABLE_ID, data_file, QUERY_CACHE_DIR)
         else:
-            print(f"CSV file {csv_file} not found. Please run generate_sample_data.py first.")
+            print(f"Data file {data_files[-1]} not found. Please run generate_sample_data.py first.")
         
         print("\nSetup completed successfully!")
         print(f"\nYou can now query your data using:")
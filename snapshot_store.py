@@ -0,0 +1,280 @@
+"""
+Historical Snapshot Store and Stage Migration
+Local multi-snapshot store: one memory-mapped loan tape per reporting date
+(root/reporting_date=YYYY-MM-DD/), each sorted by loan_id so snapshots join
+with a sorted-array merge. The migration engine maps two snapshots at a time
+and produces stage-transition count and exposure matrices, including new
+originations and closed loans.
+"""
+
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+import ecl_engine
+import loan_tape
+import portfolio_schema
+
+PARTITION_PREFIX = 'reporting_date='
+
+# Migration states: rows are the opening state, columns the closing state
+FROM_STATES = ['Stage 1', 'Stage 2', 'Stage 3', 'New']
+TO_STATES = ['Stage 1', 'Stage 2', 'Stage 3', 'Closed']
+NEW = CLOSED = 3
+
+MIGRATION_COLUMNS = ['loan_id', 'ifrs9_stage', 'outstanding_balance']
+
+
+class SnapshotStore:
+    """Reporting-date partitioned loan tapes under one root directory"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, reporting_date):
+        return os.path.join(self.root, f"{PARTITION_PREFIX}{pd.Timestamp(reporting_date).date()}")
+
+    def dates(self):
+        """Reporting dates held in the store, oldest first"""
+        return sorted(pd.Timestamp(name[len(PARTITION_PREFIX):]) for name in os.listdir(self.root)
+                      if name.startswith(PARTITION_PREFIX)
+                      and os.path.exists(os.path.join(self.root, name, loan_tape.HEADER_FILE)))
+
+    def write(self, df, reporting_date=None):
+        """Add (or replace) a snapshot; rows are stored sorted by loan_id"""
+        df = portfolio_schema.compact(df)
+        reporting_date = reporting_date if reporting_date is not None else df.attrs.get('reporting_date')
+        if reporting_date is None:
+            raise ValueError("Snapshot has no reporting_date")
+        if not df['loan_id'].is_monotonic_increasing:
+            df = df.sort_values('loan_id', ignore_index=True)
+        if df['loan_id'].duplicated().any():
+            raise ValueError("Snapshot contains duplicate loan IDs")
+        df.attrs['reporting_date'] = pd.Timestamp(reporting_date)
+
+        # Write next to the partition and swap in, so readers never see a partial tape
+        path = self._path(reporting_date)
+        staging = path + '.tmp'
+        shutil.rmtree(staging, ignore_errors=True)
+        loan_tape.write_loan_tape(df, staging)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(staging, path)
+        return path
+
+    def open(self, reporting_date, columns=None):
+        """Memory-map one snapshot as a compact frame"""
+        return loan_tape.open_loan_tape(self._path(reporting_date), columns)
+
+    def lookup(self, reporting_date, loan_ids, columns=None):
+        """Rows for the given loan IDs (binary search on the sorted loan_id column)"""
+        df = self.open(reporting_date, columns if columns is None or 'loan_id' in columns
+                       else ['loan_id'] + list(columns))
+        ids = df['loan_id'].to_numpy()
+        wanted = portfolio_schema.parse_loan_ids(loan_ids)
+        rows = np.searchsorted(ids, wanted)
+        found = rows < len(ids)
+        found[found] = ids[rows[found]] == wanted[found]
+        return df.iloc[rows[found]]
+
+    def loan_history(self, loan_ids, columns=('ifrs9_stage', 'days_past_due', 'outstanding_balance', 'ecl_amount')):
+        """One row per (reporting_date, loan) across all snapshots, one snapshot mapped at a time"""
+        frames = []
+        for date in self.dates():
+            rows = self.lookup(date, loan_ids, ['loan_id', *columns])
+            frames.append(pd.DataFrame({'reporting_date': date, **{c: rows[c].to_numpy() for c in rows.columns}}))
+        return pd.concat(frames, ignore_index=True)
+
+
+def migration_matrix(opening, closing):
+    """Stage-transition counts and exposure between two snapshots sorted by loan_id
+
+    Exposure is the opening balance, except for new loans (closing balance).
+    """
+    open_ids = opening['loan_id'].to_numpy()
+    close_ids = closing['loan_id'].to_numpy()
+    open_stage = opening['ifrs9_stage'].to_numpy().astype(np.intp) - 1
+    close_stage = closing['ifrs9_stage'].to_numpy().astype(np.intp) - 1
+    open_balance = opening['outstanding_balance'].to_numpy(dtype=np.float64)
+    close_balance = closing['outstanding_balance'].to_numpy(dtype=np.float64)
+
+    # Sorted-array merge: position of every opening loan in the closing snapshot
+    position = np.searchsorted(close_ids, open_ids)
+    survived = position < len(close_ids)
+    survived[survived] = close_ids[position[survived]] == open_ids[survived]
+    in_opening = np.zeros(len(close_ids), dtype=bool)
+    in_opening[position[survived]] = True
+
+    to_state = np.full(len(open_ids), CLOSED, dtype=np.intp)
+    to_state[survived] = close_stage[position[survived]]
+    key = np.concatenate([open_stage * len(TO_STATES) + to_state,
+                          NEW * len(TO_STATES) + close_stage[~in_opening]])
+    exposure = np.concatenate([open_balance, close_balance[~in_opening]])
+
+    cells = len(FROM_STATES) * len(TO_STATES)
+    shape = (len(FROM_STATES), len(TO_STATES))
+    counts = np.bincount(key, minlength=cells).reshape(shape)
+    balances = np.bincount(key, weights=exposure, minlength=cells).reshape(shape)
+    return (pd.DataFrame(counts, index=pd.Index(FROM_STATES, name='from'), columns=pd.Index(TO_STATES, name='to')),
+            pd.DataFrame(balances, index=pd.Index(FROM_STATES, name='from'), columns=pd.Index(TO_STATES, name='to')))
+
+
+def transition_rates(counts):
+    """Row-normalised migration probabilities"""
+    return counts.div(counts.sum(axis=1).where(lambda total: total > 0), axis=0).fillna(0.0)
+
+
+def migration_series(store, dates=None):
+    """Migration matrices for each pair of consecutive snapshots
+
+    Only the two snapshots of a pair (and only the columns needed) are mapped
+    at any time.
+    """
+    dates = store.dates() if dates is None else [pd.Timestamp(d) for d in dates]
+    results = []
+    closing = None
+    for previous, current in zip(dates[:-1], dates[1:]):
+        opening = closing if closing is not None else store.open(previous, MIGRATION_COLUMNS)
+        closing = store.open(current, MIGRATION_COLUMNS)
+        counts, exposure = migration_matrix(opening, closing)
+        results.append({'from_date': previous, 'to_date': current, 'counts': counts, 'exposure': exposure})
+    return results
+
+
+def average_transition_rates(series):
+    """Pooled transition rates over all periods (count-weighted)"""
+    total = sum(period['counts'] for period in series)
+    return transition_rates(total)
+
+
+# =============================================================================
+# SYNTHETIC HISTORY
+# =============================================================================
+
+# Monthly DPD roll between the generator's DPD values [0, 30, 60, 90, 120, 180]
+DPD_ROLL = np.array([
+    [0.97, 0.03, 0.00, 0.00, 0.00, 0.00],
+    [0.55, 0.15, 0.30, 0.00, 0.00, 0.00],
+    [0.30, 0.10, 0.20, 0.40, 0.00, 0.00],
+    [0.15, 0.05, 0.05, 0.25, 0.50, 0.00],
+    [0.05, 0.00, 0.00, 0.05, 0.30, 0.60],
+    [0.02, 0.00, 0.00, 0.00, 0.03, 0.95],
+])
+MONTHLY_REPAYMENT_RATE = 0.01
+MONTHLY_WRITE_OFF_RATE = 0.10   # of loans at 180 DPD
+MONTHLY_AMORTISATION = 0.985
+
+
+def evolve_snapshot(df, reporting_date, rng, n_new, next_loan_id):
+    """Next month's compact snapshot: DPD roll, score drift, amortisation, closures, originations"""
+    import portfolio_generator
+
+    dpd_values = portfolio_generator.DPD_VALUES
+    state = np.searchsorted(dpd_values, df['days_past_due'].to_numpy())
+    cumulative = np.cumsum(DPD_ROLL, axis=1)[state]
+    new_state = (rng.random(len(df))[:, None] > cumulative).sum(axis=1).clip(max=len(dpd_values) - 1)
+
+    closed = ((rng.random(len(df)) < MONTHLY_REPAYMENT_RATE)
+              | ((new_state == len(dpd_values) - 1) & (rng.random(len(df)) < MONTHLY_WRITE_OFF_RATE)))
+    keep = ~closed
+
+    nxt = df.loc[keep].copy()
+    nxt['days_past_due'] = dpd_values[new_state[keep]].astype(nxt['days_past_due'].dtype)
+    nxt['dpd_bucket'] = portfolio_schema.dpd_bucket(nxt['days_past_due'])
+    drift = rng.normal(0, 8, keep.sum()) - 15 * (new_state[keep] > state[keep])
+    nxt['credit_score_current'] = (nxt['credit_score_current'].to_numpy() + drift).round().clip(300, 850).astype(
+        nxt['credit_score_current'].dtype)
+    nxt['outstanding_balance'] = (nxt['outstanding_balance'] * MONTHLY_AMORTISATION).round(2)
+    nxt = ecl_engine.recalculate_ecl(nxt)
+
+    new_loans = portfolio_generator.generate_loan_portfolio_batched(
+        n_new, rng=rng, first_loan_id=next_loan_id, reporting_date=np.datetime64(reporting_date.date(), 'D'),
+        compact=True)
+    new_loans = ecl_engine.run_ecl_pipeline(new_loans, rng)
+
+    out = pd.concat([nxt, new_loans[nxt.columns]], ignore_index=True)
+    out.attrs = {'schema': 'compact', 'reporting_date': pd.Timestamp(reporting_date)}
+    return out
+
+
+def simulate_history(store, n_loans, n_months, end_date='2024-12-31', seed=42):
+    """Write n_months monthly snapshots of an evolving book into the store, one in memory at a time"""
+    import portfolio_generator
+
+    dates = pd.date_range(end=end_date, periods=n_months, freq='ME')
+    rng = np.random.default_rng(seed)
+    df = pd.concat(portfolio_generator.iter_portfolio_chunks(n_loans, seed=seed,
+                                                             reporting_date=np.datetime64(dates[0].date(), 'D')),
+                   ignore_index=True)
+    df.attrs['reporting_date'] = dates[0]
+    store.write(df)
+    next_loan_id = n_loans + 1
+
+    for date in dates[1:]:
+        n_new = rng.binomial(n_loans, MONTHLY_REPAYMENT_RATE + 0.002)
+        df = evolve_snapshot(df, date, rng, n_new, next_loan_id)
+        next_loan_id += n_new
+        store.write(df)
+    return list(dates)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Snapshot store and IFRS 9 stage migration")
+    parser.add_argument('--store', default='snapshots', help="Store root directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add', help="Add a portfolio file as a snapshot")
+    add_parser.add_argument('input')
+
+    sim_parser = subparsers.add_parser('simulate', help="Write a synthetic monthly history")
+    sim_parser.add_argument('--n-loans', type=int, default=1_000_000)
+    sim_parser.add_argument('--months', type=int, default=24)
+
+    mig_parser = subparsers.add_parser('migrate', help="Stage migration matrices across snapshots")
+    mig_parser.add_argument('--output', help="Write all period matrices to this CSV")
+
+    args = parser.parse_args()
+    store = SnapshotStore(args.store)
+
+    if args.command == 'add':
+        import portfolio_io
+
+        print(f"✅ Saved snapshot: {store.write(portfolio_io.read_portfolio(args.input))}")
+
+    elif args.command == 'simulate':
+        start = time.perf_counter()
+        dates = simulate_history(store, args.n_loans, args.months)
+        print(f"✅ Wrote {len(dates)} monthly snapshots ({dates[0].date()} to {dates[-1].date()}) "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    elif args.command == 'migrate':
+        start = time.perf_counter()
+        series = migration_series(store)
+        elapsed = time.perf_counter() - start
+        if not series:
+            parser.error("The store needs at least two snapshots")
+
+        latest = series[-1]
+        print(f"Stage migration {latest['from_date'].date()} → {latest['to_date'].date()} (loans):")
+        print(latest['counts'].to_string())
+        print("\nExposure ($M):")
+        print((latest['exposure'] / 1e6).round(2).to_string())
+        print(f"\nAverage monthly transition rates over {len(series)} periods:")
+        print(average_transition_rates(series).round(4).to_string())
+        print(f"\n{len(series)} periods joined in {elapsed:.2f}s")
+
+        if args.output:
+            rows = []
+            for period in series:
+                for measure in ('counts', 'exposure'):
+                    table = period[measure].stack().rename('value').reset_index()
+                    table.insert(0, 'measure', measure)
+                    table.insert(0, 'to_date', period['to_date'].date())
+                    table.insert(0, 'from_date', period['from_date'].date())
+                    rows.append(table)
+            pd.concat(rows, ignore_index=True).to_csv(args.output, index=False)
+            print(f"✅ Saved: {args.output}")
@@ -39,6 +39,7 @@ ORDER BY ifrs9_stage;
 
 
 -- Stage migration analysis (requires historical data)
+-- Transition matrices across reporting dates: python snapshot_store.py migrate
 SELECT 
     CASE 
         WHEN ifrs9_stage = 1 THEN 'Stage 1 - Performing'
@@ -149,14 +150,7 @@ SELECT
 FROM `{project_id}.{dataset_id}.loan_portfolio`
 WHERE reporting_date = '2024-12-31'
 GROUP BY credit_band
-ORDER BY 
-    CASE 
-        WHEN credit_score_current >= 750 THEN 1
-        WHEN credit_score_current >= 700 THEN 2
-        WHEN credit_score_current >= 650 THEN 3
-        WHEN credit_score_current >= 600 THEN 4
-        ELSE 5
-    END;
+ORDER BY MIN(credit_score_current) DESC;
 
 
 -- Credit migration (score deterioration)
@@ -197,14 +191,7 @@ SELECT
 FROM `{project_id}.{dataset_id}.loan_portfolio`
 WHERE reporting_date = '2024-12-31'
 GROUP BY dpd_bucket
-ORDER BY 
-    CASE 
-        WHEN days_past_due = 0 THEN 1
-        WHEN days_past_due <= 30 THEN 2
-        WHEN days_past_due <= 60 THEN 3
-        WHEN days_past_due <= 90 THEN 4
-        ELSE 5
-    END;
+ORDER BY MIN(days_past_due);
 
 
 -- ============================================================================
@@ -0,0 +1,205 @@
+"""
+Persisted Summary Cube
+Additive aggregate cube keyed by stage x product x credit band x geography x
+vintage x DPD bucket, saved to disk between runs. Dashboards and the CSV
+exports read from the cube, and loan-level deltas update only the cells the
+changed loans fall into, so refresh cost scales with the delta.
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import aggregation
+import portfolio_schema
+import profiler
+
+CUBE_DIMENSIONS = ['ifrs9_stage', 'product_type', 'credit_band', 'geography', 'vintage_year', 'dpd_bucket']
+CUBE_VERSION = 1
+
+
+class SummaryCube:
+    """Aggregate cube with additive measures and incremental refresh"""
+
+    def __init__(self, accumulator=None, reporting_date=None):
+        self.acc = accumulator or aggregation.CubeAccumulator(CUBE_DIMENSIONS)
+        self.reporting_date = reporting_date
+
+    @classmethod
+    def build(cls, source, reporting_date=None):
+        """Build the cube from a loan DataFrame or an iterable of chunks"""
+        cube = cls(reporting_date=reporting_date)
+        chunks = [source] if isinstance(source, pd.DataFrame) else source
+        for chunk in chunks:
+            if cube.reporting_date is None:
+                cube.reporting_date = chunk.attrs.get('reporting_date')
+                if cube.reporting_date is None and 'reporting_date' in chunk.columns and len(chunk):
+                    cube.reporting_date = pd.Timestamp(chunk['reporting_date'].iloc[0])
+            cube.acc.update(chunk)
+        return cube
+
+    def apply_delta(self, before=None, after=None):
+        """Replace changed loans: remove their previous rows, add their current rows
+
+        New loans appear only in ``after`` and closed loans only in ``before``.
+        """
+        if before is not None and len(before):
+            self.acc.update(before, sign=-1)
+        if after is not None and len(after):
+            self.acc.update(after, sign=1)
+        return self
+
+    def query(self, dimensions, where=None):
+        """Measures by the given dimensions, optionally filtered (for dashboards)"""
+        table = self.acc.cube(dimensions, where)
+        for measure in ('pd_12m', 'pd_lifetime', 'lgd', 'credit_score_current', 'ecl_rate'):
+            table[f'avg_{measure}'] = table[measure] / table['count']
+        table['coverage_pct'] = table['ecl_amount'] / table['outstanding_balance'] * 100
+        return table
+
+    def summaries(self):
+        """The notebook summary tables, served from the cube"""
+        return aggregation.build_summaries(self.acc)
+
+    def save(self, path):
+        """Persist the cube measures and correlation moments to one .npz file"""
+        acc = self.acc
+        np.savez(
+            path,
+            version=CUBE_VERSION,
+            dimensions=np.array(acc.dimensions),
+            reporting_date=str(pd.Timestamp(self.reporting_date).date()) if self.reporting_date is not None else '',
+            shift=acc._shift if acc._shift is not None else np.array([]),
+            sums=acc._sums,
+            cross=acc._cross,
+            **{f'measure_{m}': values for m, values in acc.measures.items()},
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load a cube saved with save()"""
+        with np.load(path) as data:
+            if int(data['version']) != CUBE_VERSION:
+                raise ValueError(f"Unsupported cube version {int(data['version'])} in {path}")
+            acc = aggregation.CubeAccumulator([str(d) for d in data['dimensions']])
+            for measure in acc.measures:
+                acc.measures[measure] = data[f'measure_{measure}'].copy()
+            acc._shift = data['shift'].copy() if data['shift'].size else None
+            acc._sums = data['sums'].copy()
+            acc._cross = data['cross'].copy()
+            reporting_date = str(data['reporting_date']) or None
+        return cls(acc, pd.Timestamp(reporting_date) if reporting_date else None)
+
+
+@profiler.profiled(rows=lambda result, args: result['totals']['Total_Loans'])
+def export_summaries(cube, output_dir='.'):
+    """Write portfolio_summary.csv and product_risk_analysis.csv from the cube"""
+    summaries = cube.summaries()
+    totals = summaries['totals']
+
+    summary_stats = {
+        'Total_Loans': totals['Total_Loans'],
+        'Total_Exposure': totals['Total_Exposure'],
+        'Total_ECL': totals['Total_ECL'],
+        'Coverage_Ratio': totals['Coverage_Ratio'],
+        'Stage_1_Count': totals['Stage_1_Count'],
+        'Stage_2_Count': totals['Stage_2_Count'],
+        'Stage_3_Count': totals['Stage_3_Count'],
+        'Avg_Credit_Score': totals['Avg_Credit_Score'],
+        'Analysis_Date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    pd.DataFrame([summary_stats]).to_csv(os.path.join(output_dir, 'portfolio_summary.csv'), index=False)
+    summaries['product_analysis'].to_csv(os.path.join(output_dir, 'product_risk_analysis.csv'))
+    return summaries
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def synthetic_delta(df, n_changes, seed=0):
+    """Previous and current rows for n_changes loans with moved DPD, score and balance"""
+    import ecl_engine
+
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(df), n_changes, replace=False))
+    before = df.iloc[rows].copy()
+    after = before.copy()
+
+    after['days_past_due'] = rng.choice([0, 30, 60, 90, 120, 180], n_changes).astype(after['days_past_due'].dtype)
+    if 'dpd_bucket' in after.columns:
+        after['dpd_bucket'] = portfolio_schema.dpd_bucket(after['days_past_due'])
+    after['credit_score_current'] = (after['credit_score_current'].astype(np.int64)
+                                     + rng.integers(-40, 41, n_changes)).clip(300, 850).astype(
+                                         before['credit_score_current'].dtype)
+    after['outstanding_balance'] = (after['outstanding_balance'] * 0.98).round(2)
+    after = ecl_engine.run_ecl_pipeline(after, rng)
+    return before, after
+
+
+def benchmark(n_loans, n_changes, seed=42):
+    """Compare a full cube rebuild with applying a loan-level delta"""
+    import portfolio_generator
+
+    df = pd.concat(portfolio_generator.iter_portfolio_chunks(n_loans, seed=seed), ignore_index=True)
+    cube = SummaryCube.build(df)
+    before, after = synthetic_delta(df, n_changes)
+
+    start = time.perf_counter()
+    cube.apply_delta(before, after)
+    delta_seconds = time.perf_counter() - start
+
+    updated = pd.concat([df.drop(index=before.index), after])
+    start = time.perf_counter()
+    rebuilt = SummaryCube.build(updated)
+    rebuild_seconds = time.perf_counter() - start
+
+    for measure, values in rebuilt.acc.measures.items():
+        np.testing.assert_allclose(cube.acc.measures[measure], values, rtol=1e-9, atol=1e-6)
+    return rebuild_seconds, delta_seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persisted summary cube")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Build a cube from a portfolio source or loan tape")
+    build_parser.add_argument('source', help="Portfolio file, loan tape directory or project.dataset.table")
+    build_parser.add_argument('cube', help="Output .npz file")
+    build_parser.add_argument('--reporting-date', help="Snapshot to read from multi-date sources")
+
+    export_parser = subparsers.add_parser('export', help="Write the summary CSVs from a cube")
+    export_parser.add_argument('cube')
+    export_parser.add_argument('--output-dir', default='.')
+
+    bench_parser = subparsers.add_parser('benchmark', help="Full rebuild vs delta refresh")
+    bench_parser.add_argument('--n-loans', type=int, default=5_000_000)
+    bench_parser.add_argument('--n-changes', type=int, default=5_000)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        import loan_tape
+        if os.path.isdir(args.source) and os.path.exists(os.path.join(args.source, loan_tape.HEADER_FILE)):
+            source = loan_tape.open_loan_tape(args.source)
+        else:
+            import data_source
+            # Only the cube's columns, streamed chunk by chunk
+            source = data_source.open_source(args.source).iter_chunks(
+                data_source.SUMMARY_COLUMNS, data_source.stage_filter(args.reporting_date))
+        SummaryCube.build(source).save(args.cube)
+        print(f"✅ Saved cube: {args.cube}")
+
+    elif args.command == 'export':
+        export_summaries(SummaryCube.load(args.cube), args.output_dir)
+        print("✅ Saved: portfolio_summary.csv, product_risk_analysis.csv")
+
+    elif args.command == 'benchmark':
+        rebuild_seconds, delta_seconds = benchmark(args.n_loans, args.n_changes)
+        print(f"Refreshing a {args.n_loans:,}-loan cube after {args.n_changes:,} loan changes (verified equal):")
+        print(f"  full rebuild:  {rebuild_seconds:8.3f}s")
+        print(f"  apply delta:   {delta_seconds:8.3f}s")
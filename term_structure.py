@@ -0,0 +1,199 @@
+"""
+Term-Structure Lifetime PD Engine
+Replaces the flat `pd_12m * 3` lifetime PD with monthly marginal-default
+term structures over each loan's remaining life. Survival, marginal PD,
+amortising exposure and discount factors are evaluated as (loans x months)
+NumPy matrices in memory-bounded blocks, giving lifetime PD and lifetime ECL
+discounted at the loan's effective interest rate.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import ecl_engine
+
+# Contractual term in months, in ecl_engine.PRODUCT_TYPES order
+# (credit cards use a behavioural life); last entry is the default
+CONTRACT_TERM_MONTHS = np.array([360, 60, 60, 36, 84, 60])
+REVOLVING = np.array([False, False, False, True, False, False])
+
+# Loans past their contractual term are assumed to run off over at least this long
+MIN_REMAINING_MONTHS = 12
+MAX_HORIZON_MONTHS = 360
+
+# Seasoning curve: hazard multiplier by loan age, peaking at PEAK_AGE_MONTHS
+# and decaying to LONG_RUN_FACTOR
+PEAK_AGE_MONTHS = np.array([36, 18, 15, 12, 24, 24])
+PEAK_FACTOR = 1.5
+LONG_RUN_FACTOR = 0.8
+MAX_AGE_MONTHS = 1200
+
+# Cells (loans x months) per block; each float64 matrix is 8 bytes per cell
+BLOCK_CELLS = 4_000_000
+
+
+def _seasoning_table():
+    """Cumulative hazard multiplier by (product code, loan age in months)"""
+    age = np.arange(MAX_AGE_MONTHS + 1) / PEAK_AGE_MONTHS[:, None]
+    seasoning = LONG_RUN_FACTOR + (PEAK_FACTOR - LONG_RUN_FACTOR) * age * np.exp(1 - age)
+    return np.cumsum(seasoning, axis=1)
+
+
+# Cumulative hazard over ages (a, b] is CUMULATIVE_SEASONING[p, b] - [p, a] times
+# the loan's base hazard, so no per-cell cumsum is needed
+CUMULATIVE_SEASONING = _seasoning_table()
+
+
+def months_on_book(origination_date, reporting_date):
+    """Whole calendar months between origination and the reporting date"""
+    origination = np.asarray(origination_date, dtype='datetime64[M]').astype(np.int64)
+    reporting = np.datetime64(pd.Timestamp(reporting_date), 'M').astype(np.int64)
+    return np.maximum(reporting - origination, 0)
+
+
+def remaining_months(codes, age):
+    """Remaining life in months from the product term and loan age"""
+    term = CONTRACT_TERM_MONTHS[codes]
+    remaining = np.where(REVOLVING[codes], term, term - age)
+    return np.clip(remaining, MIN_REMAINING_MONTHS, MAX_HORIZON_MONTHS)
+
+
+def _block_term_structure(pd_12m, lgd, balance, annual_rate, codes, age, remaining):
+    """Lifetime PD, 12-month and lifetime ECL for one block of loans"""
+    horizon = int(remaining.max())
+    month = np.arange(1, horizon + 1)
+    age = np.minimum(age, MAX_AGE_MONTHS - horizon - 12)
+
+    # Base hazard scaled so cumulative default over the next 12 months equals pd_12m
+    row = codes * CUMULATIVE_SEASONING.shape[1] + age
+    table = CUMULATIVE_SEASONING.ravel()
+    target = -np.log1p(-np.minimum(pd_12m, 1 - 1e-12))
+    base_hazard = target / (table[row + 12] - table[row])
+
+    # Cumulative hazard stops growing after the remaining life, so marginal PD
+    # beyond maturity is zero
+    elapsed = np.minimum(month, remaining[:, None])
+    elapsed += row[:, None]
+    cumulative_hazard = table[elapsed]
+    cumulative_hazard -= table[row][:, None]
+    cumulative_hazard *= -base_hazard[:, None]
+    survival = np.exp(cumulative_hazard, out=cumulative_hazard)
+
+    marginal_pd = np.empty_like(survival)
+    marginal_pd[:, 0] = 1 - survival[:, 0]
+    np.subtract(survival[:, :-1], survival[:, 1:], out=marginal_pd[:, 1:])
+    pd_lifetime = 1 - survival[:, -1]
+    del survival, cumulative_hazard, elapsed
+
+    # Exposure at the start of each month: annuity amortisation (flat for revolving)
+    monthly_rate = annual_rate / 100 / 12
+    compounded = (1 + monthly_rate) ** remaining
+    ead = np.exp(np.multiply.outer(np.log1p(monthly_rate), month - 1))
+    np.subtract(compounded[:, None], ead, out=ead)
+    ead /= np.where(compounded > 1, compounded - 1, 1)[:, None]
+    zero_rate = monthly_rate == 0
+    if zero_rate.any():
+        ead[zero_rate] = 1 - (month - 1) / remaining[zero_rate, None]
+    ead[REVOLVING[codes]] = 1.0
+
+    # Discount at the effective interest rate
+    discount = np.exp(np.multiply.outer(-np.log1p(annual_rate / 100) / 12, month))
+
+    loss = marginal_pd
+    loss *= ead
+    loss *= discount
+    scale = lgd * balance
+    return (pd_lifetime,
+            loss[:, :12].sum(axis=1) * scale,
+            loss.sum(axis=1) * scale)
+
+
+def term_structure_vectorized(pd_12m, lgd, balance, annual_rate, codes, age, block_cells=BLOCK_CELLS):
+    """Lifetime PD, 12-month ECL and lifetime ECL per loan, in memory-bounded blocks"""
+    pd_12m = np.asarray(pd_12m, dtype=np.float64)
+    lgd = np.asarray(lgd, dtype=np.float64)
+    balance = np.asarray(balance, dtype=np.float64)
+    annual_rate = np.asarray(annual_rate, dtype=np.float64)
+    codes = np.asarray(codes, dtype=np.intp)
+    age = np.asarray(age, dtype=np.int64)
+    remaining = remaining_months(codes, age)
+
+    n_loans = len(pd_12m)
+    pd_lifetime = np.empty(n_loans)
+    ecl_12m = np.empty(n_loans)
+    ecl_lifetime = np.empty(n_loans)
+
+    block_rows = max(1, block_cells // MAX_HORIZON_MONTHS)
+    for start in range(0, n_loans, block_rows):
+        block = slice(start, start + block_rows)
+        pd_lifetime[block], ecl_12m[block], ecl_lifetime[block] = _block_term_structure(
+            pd_12m[block], lgd[block], balance[block], annual_rate[block],
+            codes[block], age[block], remaining[block])
+    return remaining, pd_lifetime, ecl_12m, ecl_lifetime
+
+
+def calculate_term_structure(df, reporting_date=None):
+    """Add term-structure lifetime PD and discounted 12-month / lifetime ECL columns"""
+    if reporting_date is None:
+        reporting_date = df.attrs.get('reporting_date')
+    if reporting_date is None:
+        reporting_date = df['reporting_date'].iloc[0]
+
+    codes = ecl_engine.product_codes(df['product_type'])
+    age = months_on_book(pd.to_datetime(df['origination_date']).to_numpy(), reporting_date)
+    remaining, pd_lifetime, ecl_12m, ecl_lifetime = term_structure_vectorized(
+        df['pd_12m'], df['lgd'], df['outstanding_balance'], df['interest_rate'], codes, age)
+
+    df['remaining_months'] = remaining.astype(np.int16)
+    df['pd_lifetime_ts'] = pd_lifetime.round(6)
+    df['ecl_12m_ts'] = ecl_12m.round(2)
+    df['ecl_lifetime_ts'] = ecl_lifetime.round(2)
+    # Stage 1 carries 12-month ECL, Stages 2 and 3 lifetime ECL
+    df['ecl_amount_ts'] = np.where(np.asarray(df['ifrs9_stage']) == 1, df['ecl_12m_ts'], df['ecl_lifetime_ts'])
+    return df
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def benchmark(n_loans, horizon=MAX_HORIZON_MONTHS, seed=42):
+    """Throughput of the batched engine with every loan at the full horizon"""
+    rng = np.random.default_rng(seed)
+    pd_12m = rng.uniform(0.001, 0.3, n_loans)
+    lgd = rng.uniform(0.15, 0.8, n_loans)
+    balance = rng.lognormal(10.5, 1.0, n_loans)
+    annual_rate = rng.uniform(2.0, 20.0, n_loans)
+    # Mortgages aged so every loan's remaining life is the full horizon
+    codes = np.zeros(n_loans, dtype=np.intp)
+    age = np.full(n_loans, CONTRACT_TERM_MONTHS[0] - horizon)
+
+    start = time.perf_counter()
+    remaining, *_ = term_structure_vectorized(pd_12m, lgd, balance, annual_rate, codes, age)
+    elapsed = time.perf_counter() - start
+    loan_months = remaining.sum()
+    return elapsed, n_loans / elapsed, loan_months / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Term-structure lifetime PD and ECL")
+    parser.add_argument('--n-loans', type=int, default=1_000_000)
+    parser.add_argument('--horizon', type=int, default=MAX_HORIZON_MONTHS)
+    parser.add_argument('--input', help="Score a portfolio file and compare with the flat lifetime PD")
+    args = parser.parse_args()
+
+    if args.input:
+        import portfolio_io
+
+        df = calculate_term_structure(portfolio_io.read_portfolio(args.input))
+        print(f"Scored {len(df):,} loans (mean remaining life {df['remaining_months'].mean():.0f} months)")
+        print(f"  lifetime PD:   flat ×3 {df['pd_lifetime'].mean():.4f}   term structure {df['pd_lifetime_ts'].mean():.4f}")
+        print(f"  total ECL:     flat ×3 ${df['ecl_amount'].sum():,.0f}   term structure ${df['ecl_amount_ts'].sum():,.0f}")
+
+    else:
+        elapsed, loans_per_sec, loan_months_per_sec = benchmark(args.n_loans, args.horizon)
+        print(f"Term-structure engine, {args.n_loans:,} loans × {args.horizon}-month horizon:")
+        print(f"  {elapsed:8.3f}s  {loans_per_sec:>12,.0f} loans/s  {loan_months_per_sec:>14,.0f} loan-months/s")
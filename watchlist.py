@@ -0,0 +1,362 @@
+"""
+High-Risk Watchlist Service
+Keeps the flagged loans (Stage 3 or ECL rate above 10%) in a structure built
+for interactive top-k queries. Loans are partitioned into index cells by
+product x geography x stage x DPD bucket, and each cell is kept sorted by ECL
+(descending). A filtered top-k query merges only the first k entries of the
+matching cells. Loan updates re-sort only the cells they touch.
+"""
+
+import argparse
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+import aggregation
+import portfolio_schema
+
+HIGH_RISK_ECL_RATE = 10.0
+
+# Secondary index dimensions (encoders and labels from aggregation.DIMENSIONS)
+INDEX_DIMENSIONS = ['product_type', 'geography', 'ifrs9_stage', 'dpd_bucket']
+
+# Columns shown by default in query results
+DISPLAY_COLUMNS = ['loan_id', 'product_type', 'geography', 'outstanding_balance', 'ecl_amount',
+                   'ecl_rate', 'ifrs9_stage', 'days_past_due']
+
+INITIAL_CAPACITY = 1024
+
+
+def high_risk_mask(df):
+    """Loans on the watchlist: Stage 3 or ECL rate above HIGH_RISK_ECL_RATE"""
+    return ((df['ifrs9_stage'].to_numpy() == 3) | (df['ecl_rate'].to_numpy() > HIGH_RISK_ECL_RATE))
+
+
+class Watchlist:
+    """Flagged loans with per-cell ECL ordering for filtered top-k queries"""
+
+    def __init__(self, df):
+        df = portfolio_schema.compact(df)
+        self.reporting_date = df.attrs.get('reporting_date')
+        self.sizes = [len(aggregation.DIMENSIONS[d][1]) for d in INDEX_DIMENSIONS]
+
+        # Column store: one growable array per column, rows addressed by slot
+        self._dtypes = {}
+        self._columns = {}
+        for column in df.columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                self._dtypes[column] = values.dtype
+                self._columns[column] = np.empty(INITIAL_CAPACITY, dtype=values.cat.codes.dtype)
+            else:
+                self._columns[column] = np.empty(INITIAL_CAPACITY, dtype=values.to_numpy().dtype)
+        self._size = 0
+        self._free = np.empty(0, dtype=np.int64)
+
+        # loan_id -> slot, as sorted arrays
+        self._ids = np.empty(0, dtype=np.uint32)
+        self._id_slots = np.empty(0, dtype=np.int64)
+
+        # cell -> (negated ECL ascending, slots)
+        self._cells = {}
+        self._add(df[high_risk_mask(df)])
+
+    def __len__(self):
+        return len(self._ids)
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def _allocate(self, n):
+        reused, self._free = self._free[:n], self._free[n:]
+        n_new = n - len(reused)
+        if self._size + n_new > len(self._columns['loan_id']):
+            capacity = max(2 * len(self._columns['loan_id']), self._size + n_new)
+            for column, array in self._columns.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self._size] = array[:self._size]
+                self._columns[column] = grown
+        slots = np.concatenate([reused, np.arange(self._size, self._size + n_new)])
+        self._size += n_new
+        return slots
+
+    def _store(self, df, slots):
+        for column, array in self._columns.items():
+            values = df[column]
+            if column in self._dtypes:
+                if not values.cat.categories.equals(self._dtypes[column].categories):
+                    values = values.cat.set_categories(self._dtypes[column].categories)
+                array[slots] = values.cat.codes.to_numpy()
+            else:
+                array[slots] = values.to_numpy()
+
+    def _cell_keys(self, df):
+        key = np.zeros(len(df), dtype=np.int64)
+        for name, size in zip(INDEX_DIMENSIONS, self.sizes):
+            key = key * size + np.asarray(aggregation.DIMENSIONS[name][0](df))
+        return key
+
+    def _frame(self, slots, columns=None):
+        """Rows at the given slots as a compact DataFrame"""
+        data = {}
+        for column in columns or self._columns:
+            values = self._columns[column][slots]
+            if column in self._dtypes:
+                values = pd.Categorical.from_codes(values, dtype=self._dtypes[column])
+            data[column] = values
+        df = pd.DataFrame(data)
+        df.attrs['schema'] = 'compact'
+        if self.reporting_date is not None:
+            df.attrs['reporting_date'] = self.reporting_date
+        return df
+
+    def _display(self, slots, columns):
+        """Rows at the given slots in the wide schema, with exactly the requested columns"""
+        frame = self._frame(slots, columns)
+        out = portfolio_schema.expand(frame)
+        if 'dpd_bucket' in frame.columns:
+            out['dpd_bucket'] = np.asarray(portfolio_schema.DPD_BUCKETS)[frame['dpd_bucket'].to_numpy()]
+        return out[list(columns)]
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def _add(self, df):
+        """Insert flagged loans that are not on the list"""
+        if not len(df):
+            return
+        slots = self._allocate(len(df))
+        self._store(df, slots)
+
+        loan_ids = df['loan_id'].to_numpy()
+        at = np.searchsorted(self._ids, loan_ids)
+        order = np.argsort(at, kind='stable')
+        self._ids = np.insert(self._ids, at[order], loan_ids[order])
+        self._id_slots = np.insert(self._id_slots, at[order], slots[order])
+
+        keys = self._cell_keys(df)
+        neg_ecl = -df['ecl_amount'].to_numpy(dtype=np.float64)
+        order = np.lexsort((neg_ecl, keys))
+        keys, neg_ecl, slots = keys[order], neg_ecl[order], slots[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        for cell, cell_ecl, cell_slots in zip(keys[np.r_[0, bounds]], np.split(neg_ecl, bounds),
+                                              np.split(slots, bounds)):
+            if cell in self._cells:
+                ecl, existing = self._cells[cell]
+                at = np.searchsorted(ecl, cell_ecl, side='right')
+                self._cells[cell] = (np.insert(ecl, at, cell_ecl), np.insert(existing, at, cell_slots))
+            else:
+                self._cells[cell] = (cell_ecl, cell_slots)
+
+    def remove(self, loan_ids):
+        """Take loans off the list (closed, repaid or cured); unknown IDs are ignored"""
+        loan_ids = np.unique(portfolio_schema.parse_loan_ids(loan_ids))
+        at = np.searchsorted(self._ids, loan_ids)
+        found = at < len(self._ids)
+        found[found] = self._ids[at[found]] == loan_ids[found]
+        at = at[found]
+        if not len(at):
+            return 0
+        slots = self._id_slots[at]
+        self._ids = np.delete(self._ids, at)
+        self._id_slots = np.delete(self._id_slots, at)
+
+        keys = self._cell_keys(self._frame(slots, INDEX_DIMENSIONS))
+        for cell in np.unique(keys):
+            ecl, cell_slots = self._cells[cell]
+            keep = ~np.isin(cell_slots, slots[keys == cell])
+            if keep.any():
+                self._cells[cell] = (ecl[keep], cell_slots[keep])
+            else:
+                del self._cells[cell]
+        self._free = np.concatenate([self._free, slots])
+        return len(slots)
+
+    def update(self, df):
+        """Apply the current state of changed loans: replace their entries, flag or unflag them"""
+        df = portfolio_schema.compact(df)
+        self.remove(df['loan_id'].to_numpy())
+        self._add(df[high_risk_mask(df)])
+        return self
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _matching_cells(self, filters):
+        codes = []
+        for name in INDEX_DIMENSIONS:
+            labels = aggregation.DIMENSIONS[name][1]
+            wanted = filters.get(name)
+            if wanted is None:
+                codes.append(range(len(labels)))
+                continue
+            wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            codes.append([labels.index(label) for label in wanted])
+        cells = []
+        for combination in itertools.product(*codes):
+            key = 0
+            for code, size in zip(combination, self.sizes):
+                key = key * size + code
+            if key in self._cells:
+                cells.append(key)
+        return cells
+
+    def top(self, k=10, columns=DISPLAY_COLUMNS, **filters):
+        """Top-k loans by ECL, optionally filtered by index dimensions
+
+        Filters take one label or a list, e.g.
+        ``top(20, product_type='SME Loan', geography=['North', 'East'], dpd_bucket='90+ DPD')``.
+        """
+        cells = self._matching_cells(filters)
+        if not cells:
+            return self._display(np.empty(0, dtype=np.int64), columns)
+        neg_ecl = np.concatenate([self._cells[cell][0][:k] for cell in cells])
+        slots = np.concatenate([self._cells[cell][1][:k] for cell in cells])
+        if len(slots) > k:
+            keep = np.argpartition(neg_ecl, k - 1)[:k]
+            neg_ecl, slots = neg_ecl[keep], slots[keep]
+        slots = slots[np.lexsort((self._columns['loan_id'][slots], neg_ecl))]
+        return self._display(slots, columns)
+
+    def ranked(self):
+        """Every loan on the list, highest ECL first, ties by loan ID (compact schema)"""
+        if not self._cells:
+            return self._frame(np.empty(0, dtype=np.int64))
+        neg_ecl = np.concatenate([ecl for ecl, _ in self._cells.values()])
+        slots = np.concatenate([slots for _, slots in self._cells.values()])
+        return self._frame(slots[np.lexsort((self._columns['loan_id'][slots], neg_ecl))])
+
+    def lookup(self, loan_ids, columns=DISPLAY_COLUMNS):
+        """Watchlist entries for the given loans (those not on the list are skipped)"""
+        loan_ids = portfolio_schema.parse_loan_ids(loan_ids)
+        at = np.searchsorted(self._ids, loan_ids)
+        found = at < len(self._ids)
+        found[found] = self._ids[at[found]] == loan_ids[found]
+        return self._display(self._id_slots[at[found]], columns)
+
+    def summary(self, dimension):
+        """Loans, exposure and ECL on the list by one index dimension"""
+        labels = aggregation.DIMENSIONS[dimension][1]
+        slots = self._id_slots
+        codes = np.asarray(aggregation.DIMENSIONS[dimension][0](self._frame(slots, [dimension])))
+        table = pd.DataFrame({
+            'loans': np.bincount(codes, minlength=len(labels)),
+            'exposure': np.bincount(codes, self._columns['outstanding_balance'][slots], minlength=len(labels)),
+            'ecl': np.bincount(codes, self._columns['ecl_amount'][slots], minlength=len(labels)),
+        }, index=pd.Index(labels, name=dimension))
+        return table[table['loans'] > 0]
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def _parse_filters(args):
+    filters = {}
+    for name in INDEX_DIMENSIONS:
+        value = getattr(args, name, None)
+        if value:
+            labels = aggregation.DIMENSIONS[name][1]
+            values = [type(labels[0])(v) for v in value.split(',')]
+            filters[name] = values
+    return filters
+
+
+def benchmark(n_loans, n_queries=200, n_updates=10_000, k=20, seed=42):
+    """Filtered top-k: watchlist index vs mask + sort_values over the flagged loans"""
+    import incremental_ecl
+    import portfolio_generator
+
+    df = portfolio_schema.compact(pd.concat(portfolio_generator.iter_portfolio_chunks(n_loans, seed=seed),
+                                            ignore_index=True))
+    start = time.perf_counter()
+    watch = Watchlist(df)
+    build_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(n_queries):
+        query = {}
+        for name in INDEX_DIMENSIONS:
+            if rng.random() < 0.5:
+                labels = aggregation.DIMENSIONS[name][1]
+                query[name] = list(rng.choice(labels, size=rng.integers(1, 3), replace=False))
+        queries.append(query)
+
+    flagged = df[high_risk_mask(df)]
+    start = time.perf_counter()
+    for query in queries[:20]:
+        mask = np.ones(len(flagged), dtype=bool)
+        for name, labels in query.items():
+            mask &= flagged[name].isin(labels if name != 'dpd_bucket'
+                                       else [portfolio_schema.DPD_BUCKETS.index(l) for l in labels]).to_numpy()
+        expected = flagged[mask].sort_values('ecl_amount', ascending=False).head(k)
+    pandas_ms = (time.perf_counter() - start) / 20 * 1000
+
+    start = time.perf_counter()
+    for query in queries:
+        result = watch.top(k, **query)
+    index_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    # Last pandas query agrees with the index
+    result = watch.top(k, **queries[19])
+    assert np.allclose(np.sort(result['ecl_amount'].to_numpy()),
+                       np.sort(expected['ecl_amount'].to_numpy()))
+
+    # Loans entering and leaving the list after a DPD/score/balance change feed
+    state = incremental_ecl.IncrementalECL(df)
+    _, after = state.apply_changes(incremental_ecl.synthetic_changes(df, n_updates, seed))
+    start = time.perf_counter()
+    watch.update(after)
+    update_seconds = time.perf_counter() - start
+
+    rebuilt = Watchlist(state.df)
+    assert len(watch) == len(rebuilt)
+    assert np.array_equal(watch.top(100)['ecl_amount'].to_numpy(), rebuilt.top(100)['ecl_amount'].to_numpy())
+    return build_seconds, pandas_ms, index_ms, update_seconds, len(watch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="High-risk watchlist with top-k queries")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    top_parser = subparsers.add_parser('top', help="Top-k flagged loans by ECL")
+    top_parser.add_argument('source', help="Portfolio file or project.dataset.table")
+    top_parser.add_argument('-k', type=int, default=10)
+    top_parser.add_argument('--product-type', dest='product_type', help="e.g. 'SME Loan,Mortgage'")
+    top_parser.add_argument('--geography')
+    top_parser.add_argument('--stage', dest='ifrs9_stage', help="e.g. 2,3")
+    top_parser.add_argument('--dpd-bucket', dest='dpd_bucket', help="e.g. '90+ DPD'")
+    top_parser.add_argument('--summary', choices=INDEX_DIMENSIONS, help="Also show totals by a dimension")
+
+    bench_parser = subparsers.add_parser('benchmark', help="Index top-k vs pandas mask + sort")
+    bench_parser.add_argument('--n-loans', type=int, default=10_000_000)
+    bench_parser.add_argument('--n-updates', type=int, default=10_000)
+
+    args = parser.parse_args()
+
+    if args.command == 'top':
+        import data_source
+
+        df = data_source.open_source(args.source).read(filters=[[('ifrs9_stage', '=', 3)],
+                                                                [('ecl_rate', '>', HIGH_RISK_ECL_RATE)]])
+        watch = Watchlist(df)
+        print(f"⚠️ {len(watch):,} loans on the watchlist")
+        print(watch.top(args.k, **_parse_filters(args)).to_string(index=False))
+        if args.summary:
+            print()
+            print(watch.summary(args.summary).to_string())
+
+    elif args.command == 'benchmark':
+        build_seconds, pandas_ms, index_ms, update_seconds, size = benchmark(args.n_loans,
+                                                                               n_updates=args.n_updates)
+        print(f"Watchlist over {args.n_loans:,} loans ({size:,} flagged):")
+        print(f"  build index:              {build_seconds:8.3f}s")
+        print(f"  filtered top-20, pandas:  {pandas_ms:8.2f} ms/query")
+        print(f"  filtered top-20, index:   {index_ms:8.2f} ms/query")
+        print(f"  update {args.n_updates:,} loans:     {update_seconds * 1000:8.2f} ms")